@@ -4,11 +4,14 @@
 import json
 import os
 import ollama
+import queue
 import re
 import uuid
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 from termcolor import colored 
 from typing import List, Dict, Any, Optional
@@ -20,6 +23,29 @@ from tools import run_shell_command
 from tools import list_directory
 from tools import create_and_setup_venv
 from tools import available_functions
+from tools import ROOTED_TOOLS, SESSION_TOOLS
+from check import KeepAlivePinger, warm_up_models
+from catalog import get_catalog
+from checkpoint import CheckpointJournal
+from scheduler import get_scheduler
+from hedge import get_hedger, RequestCancelled, StreamStart
+from config import HEDGE_ENABLED, HEDGE_FALLBACK_MODEL, HEDGE_FALLBACK_HOST, HEDGE_SAME_SERVER, SPECULATIVE_STEPS, CHARS_PER_TOKEN, SNAPSHOTS_ENABLED, PLAN_LIBRARY_ENABLED, TOOL_POOL_ENABLED, TOOL_POOL_IN_PROCESS
+from results import default_store
+from store import ConversationStore, get_store
+from snapshot import SnapshotManager
+from plan_library import get_plan_library
+from memory import warm_up_memory
+from profiles import build_options, truncated, usage_report
+from loop_detector import LoopDetector
+from tool_pool import get_tool_pool
+from convert import CANONICAL_VERSION, convert_files
+from tool_cache import ToolCache, READ_ONLY_TOOLS
+from verifiers import verify as rule_verify
+from plan_parser import PLAN_SCHEMA, STEPS_SCHEMA, StreamingPlanParser, parse_json
+
+
+# Tools that only read, so execute_plan may run them ahead of time (SPECULATIVE_STEPS)
+SPECULATIVE_TOOLS = set(READ_ONLY_TOOLS) | {'search_workspace', 'read_result', 'recall', 'read_files'}
 
 
 class Spinner:
@@ -55,212 +81,131 @@ class Spinner:
 
 
 class TrainingDataLogger:
-    def __init__(self, workspace: str, format: str = "openai"):
+    def __init__(self, workspace: str, format: str = "openai", store: Optional[ConversationStore] = None, session_id: Optional[str] = None):
         """
-        format: "openai" or "sharegpt"
+        format: default export format ("openai", "sharegpt", "chatml", see convert.py).
+        Sessions are always logged losslessly in the canonical format and
+        rendered into other formats on export.
+        store/session_id: the logger keeps no messages of its own; a session
+        is the range of the agent's stored conversation (channel "agent")
+        from start_id on, converted to canonical form when it ends
         """
         self.workspace = workspace
         self.format = format
-        self.current_session = []
-        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.pending_tool_calls = {}  # Store tool calls waiting for results
+        self.store = store or get_store()
+        self.session_id = session_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.started_at = time.time()
+        self.start_id = 0
+        self.in_session = False
+        self.system_prompt = ""  # sessions that don't start with a system message get this one
         
         # Create training data file
-        self.training_file = os.path.join(workspace, f"training_data_{format}.jsonl")
+        self.training_file = os.path.join(workspace, "training_data_canonical.jsonl")
         
-    def start_session(self, system_prompt: str):
-        """Start a new conversation session"""
-        self.current_session = []
-        self.pending_tool_calls = {}
-        
-        if self.format == "openai":
-            self.current_session.append({
-                "role": "system",
-                "content": system_prompt
-            })
-        # ShareGPT doesn't typically include system prompts
+    @property
+    def current_session(self) -> List[Dict]:
+        """Messages of this session in canonical form (read back from the store)"""
+        if not self.in_session:
+            return []
+        return self.canonical(self.store.rows(self.session_id, after_id=self.start_id - 1))
     
-    def log_user_message(self, content: str):
-        """Log user message"""
-        if self.format == "openai":
-            self.current_session.append({
-                "role": "user",
-                "content": content
-            })
-        else:  # sharegpt
-            self.current_session.append({
-                "from": "human",
-                "value": content
-            })
+    def log_message(self, message: Dict, message_id: int):
+        """Called by Agent.add_message after it stored message under message_id"""
+        if message.get('role') == 'system' and not self.in_session:
+            self.system_prompt = message.get('content') or ""
+        if not self.in_session:
+            self.start_session(message_id)
     
-    def log_assistant_message(self, content: str, tool_calls: Optional[List[Dict]] = None):
-        """
-        Log assistant message with optional tool calls
-        
-        Args:
-            content: The assistant's text response
-            tool_calls: List of tool calls in the format:
-                [{
-                    "name": "tool_name",
-                    "arguments": {"arg1": "value1", ...}
-                }]
-        """
-        if self.format == "openai":
-            message = {
-                "role": "assistant",
-                "content": content
-            }
-            
-            if tool_calls:
-                # Format tool calls according to OpenAI spec
-                formatted_calls = []
-                for i, tc in enumerate(tool_calls):
-                    call_id = f"call_{uuid.uuid4().hex[:8]}"
-                    
-                    # Store for matching with results
-                    self.pending_tool_calls[call_id] = {
-                        "name": tc["name"],
-                        "arguments": tc["arguments"]
-                    }
-                    
-                    formatted_calls.append({
-                        "id": call_id,
-                        "type": "function",
-                        "function": {
-                            "name": tc["name"],
-                            "arguments": json.dumps(tc["arguments"], ensure_ascii=False)
-                        }
-                    })
-                
-                message["tool_calls"] = formatted_calls
-            
-            self.current_session.append(message)
-            
-        else:  # sharegpt
-            # ShareGPT doesn't have native tool support, so we'll add as text
-            if tool_calls:
-                tool_text = "\n\n[Tool Calls: " + ", ".join([
-                    f"{tc['name']}({json.dumps(tc['arguments'])[:50]}...)" 
-                    for tc in tool_calls
-                ]) + "]"
-                content += tool_text
-            
-            self.current_session.append({
-                "from": "gpt",
-                "value": content
-            })
+    def start_session(self, start_id: int):
+        """Start a new conversation session at store message start_id"""
+        self.start_id = start_id
+        self.started_at = time.time()
+        self.in_session = True
     
-    def log_tool_result(self, content: str, tool_call_id: Optional[str] = None, tool_name: Optional[str] = None):
+    def canonical(self, rows) -> List[Dict]:
         """
-        Log tool result message
-        
-        Args:
-            content: The result from tool execution
-            tool_call_id: ID of the tool call this result responds to (OpenAI format)
-            tool_name: Name of the tool (used if tool_call_id not available)
+        Agent messages -> canonical messages: tool calls as {id, name, arguments},
+        tool results with their call's duration, every message with its ts
         """
-        if self.format == "openai":
-            # If we don't have a call ID but have name, try to find matching pending call
-            if not tool_call_id and tool_name:
-                for cid, call in self.pending_tool_calls.items():
-                    if call["name"] == tool_name:
-                        tool_call_id = cid
-                        break
-            
-            # If still no ID, generate one (fallback)
-            if not tool_call_id:
-                tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-            
-            message = {
-                "role": "tool",
-                "content": content,
-                "tool_call_id": tool_call_id
-            }
-            
-            self.current_session.append(message)
-            
-            # Clean up pending call if we used it
-            if tool_call_id in self.pending_tool_calls:
-                del self.pending_tool_calls[tool_call_id]
-                
-        else:  # sharegpt
-            # For ShareGPT, we'll format tool results as part of the conversation
-            self.current_session.append({
-                "from": "system",
-                "value": f"[Tool Result: {content[:200]}...]"
-            })
-    
-    def log_error(self, error_msg: str, tool_name: Optional[str] = None):
-        """Log error message (helpful for training on error recovery)"""
-        if self.format == "openai":
-            self.current_session.append({
-                "role": "tool",
-                "content": f"ERROR: {error_msg}",
-                "tool_call_id": f"error_{uuid.uuid4().hex[:8]}"
-            })
-        else:
-            self.current_session.append({
-                "from": "system",
-                "value": f"[ERROR: {error_msg}]"
-            })
+        messages = []
+        pending = {}  # call id -> (name, ts of the assistant message)
+        for _, ts, message in rows:
+            role = message.get('role')
+            out = {"role": role, "content": message.get('content') or "", "ts": ts}
+            if role == 'assistant' and message.get('tool_calls'):
+                out["tool_calls"] = []
+                for tc in message['tool_calls']:
+                    function = tc.get('function') or tc
+                    call_id = tc.get('id') or f"call_{uuid.uuid4().hex[:8]}"
+                    pending[call_id] = (function.get('name'), ts)
+                    out["tool_calls"].append({"id": call_id, "name": function.get('name'), "arguments": function.get('arguments')})
+            elif role == 'tool':
+                call_id = message.get('tool_call_id')
+                name, started = pending.pop(call_id, (None, None))
+                out["tool_call_id"] = call_id or f"call_{uuid.uuid4().hex[:8]}"
+                out["name"] = message.get('name') or name
+                if started is not None:
+                    out["duration_ms"] = round((ts - started) * 1000, 1)
+                if out["content"].startswith("ERROR:") or call_id is None:
+                    out["error"] = True
+            messages.append(out)
+        
+        # Calls without a result (shouldn't happen in good data) get placeholder results
+        if pending:
+            print(f"⚠️ Warning: {len(pending)} tool calls pending at session end")
+        for call_id, (name, _) in pending.items():
+            messages.append({"role": "tool", "content": f"[Tool {name} was called but session ended before result]",
+                             "tool_call_id": call_id, "name": name, "error": True, "ts": time.time()})
+        
+        if self.system_prompt and (not messages or messages[0]["role"] != "system"):
+            messages.insert(0, {"role": "system", "content": self.system_prompt, "ts": self.started_at})
+        return messages
     
     def end_session(self):
         """End current session and save to file"""
-        # Check if there are any pending tool calls (shouldn't happen in good data)
-        if self.pending_tool_calls and self.format == "openai":
-            print(f"⚠️ Warning: {len(self.pending_tool_calls)} tool calls pending at session end")
-            
-            # Add placeholder results for incomplete calls
-            for call_id, call in self.pending_tool_calls.items():
-                self.current_session.append({
-                    "role": "tool",
-                    "content": f"[Tool {call['name']} was called but session ended before result]",
-                    "tool_call_id": call_id
-                })
+        if not self.in_session:
+            return False
+        session = self.current_session
+        self.in_session = False
         
         # Save session if it has at least one exchange
-        if len(self.current_session) > 1:  # More than just system prompt
-            if self.format == "openai":
-                training_example = {"messages": self.current_session}
-            else:  # sharegpt
-                training_example = {"conversations": self.current_session}
+        if len(session) > 1:  # More than just system prompt
+            training_example = {
+                "format": "canonical",
+                "version": CANONICAL_VERSION,
+                "session_id": self.session_id,
+                "started_at": self.started_at,
+                "ended_at": time.time(),
+                "messages": session
+            }
             
             # Append to JSONL file
             with open(self.training_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(training_example, ensure_ascii=False) + '\n')
+                f.write(json.dumps(training_example, ensure_ascii=False, default=str) + '\n')
             
             print(f"✅ Session saved to {self.training_file}")
             return True
         
         return False
     
-    def export_all_sessions(self, output_file: Optional[str] = None):
-        """Export all logged sessions to a single file"""
+    def export_all_sessions(self, output_file: Optional[str] = None, format: Optional[str] = None):
+        """Export all logged sessions to a single JSON file, rendered in `format` (default self.format)"""
+        format = format or self.format
         if not output_file:
-            output_file = os.path.join(self.workspace, f"training_data_{self.format}.json")
+            output_file = os.path.join(self.workspace, f"training_data_{format}.json")
         
-        sessions = []
-        try:
-            with open(self.training_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        sessions.append(json.loads(line))
-        except FileNotFoundError:
+        if not os.path.exists(self.training_file):
             print(f"No training data found at {self.training_file}")
             return None
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(sessions, f, indent=2, ensure_ascii=False)
-        
-        print(f"✅ Exported {len(sessions)} sessions to {output_file}")
+        report = convert_files([self.training_file], output_file, format, json_array=True)
+        print(f"✅ Exported {report['sessions']} sessions to {output_file}")
         return output_file
     
     def validate_session(self, session: List[Dict]) -> List[str]:
-        """Validate a session for OpenAI format compliance"""
+        """Validate a canonical session (tool calls complete, results matched to calls)"""
         issues = []
-        
-        if self.format != "openai":
-            return issues
+        call_ids = set()
         
         for i, msg in enumerate(session):
             # Check tool calls have required fields
@@ -268,26 +213,25 @@ class TrainingDataLogger:
                 for j, tc in enumerate(msg["tool_calls"]):
                     if "id" not in tc:
                         issues.append(f"Message {i}, tool call {j}: Missing 'id'")
-                    if "type" not in tc or tc["type"] != "function":
-                        issues.append(f"Message {i}, tool call {j}: 'type' must be 'function'")
-                    if "function" not in tc:
-                        issues.append(f"Message {i}, tool call {j}: Missing 'function'")
                     else:
-                        if "name" not in tc["function"]:
-                            issues.append(f"Message {i}, tool call {j}: Missing function.name")
-                        if "arguments" not in tc["function"]:
-                            issues.append(f"Message {i}, tool call {j}: Missing function.arguments")
+                        call_ids.add(tc["id"])
+                    if "name" not in tc:
+                        issues.append(f"Message {i}, tool call {j}: Missing 'name'")
+                    if "arguments" not in tc:
+                        issues.append(f"Message {i}, tool call {j}: Missing 'arguments'")
             
             # Check tool results have matching call IDs
             if msg.get("role") == "tool":
                 if "tool_call_id" not in msg:
                     issues.append(f"Message {i}: Tool result missing 'tool_call_id'")
+                elif msg["tool_call_id"] not in call_ids and not msg.get("error"):
+                    issues.append(f"Message {i}: Tool result for unknown call '{msg['tool_call_id']}'")
         
         return issues 
     
 
 class Agent:
-    def __init__(self, model="qwen2.5:7b", workspace=r"C:\Users\Administrator\Desktop\code\swstk\workspace"):
+    def __init__(self, model="qwen2.5:7b", workspace=r"C:\Users\Administrator\Desktop\code\swstk\workspace", on_event=None, interactive=True, host=None, store=None, session_id=None):
         self.model = model
         self.workspace = workspace
         self.conversation = []
@@ -295,9 +239,82 @@ class Agent:
         self.max_steps = 10
         self.verification_steps = 2
         
+        # Optional callback(event, data) used by headless front-ends (server.py)
+        # to stream tokens and tool activity instead of reading stdout
+        self.on_event = on_event
+        
+        # Headless runs (batch.py) must never block on input()
+        self.interactive = interactive
+        self.last_verification = None
+        
+        # Append-only journal so a crashed run_task can resume_task()
+        self.journal = CheckpointJournal(os.path.join(workspace, "agent_checkpoint.jsonl"))
+        self.journaled_messages = 0
+        
+        # Large tool output goes to disk; the conversation gets a preview + handle
+        self.result_store = default_store
+        
+        # Memoized read-only tool calls for this conversation
+        self.tool_cache = ToolCache(root=workspace)
+        
+        # Tools run in isolated worker processes with timeouts and rlimits
+        # (the process-wide pool starts on the first tool call)
+        self.isolate_tools = TOOL_POOL_ENABLED
+        self.verification_stats = {'rule': 0, 'llm': 0}
+        
+        # process_message tool iterations, and how many only repeated a cycle
+        self.loop_stats = {'iterations': 0, 'wasted': 0, 'hints': 0, 'stopped': 0}
+        
+        # Ollama server; host=None uses the default (OLLAMA_BASE_URL / OLLAMA_HOST).
+        # replay.py points agents at other servers or at a mock
+        self.host = host
+        self.client = ollama.Client(host=host) if host else ollama
+        
+        # Model metadata (context length, size, quantization) for option tuning
+        self.catalog = get_catalog(host) if host else get_catalog()
+        self.options = None
+        self.profile_options = {}  # generation profile -> options (profiles.py)
+        
+        # Calls, tokens and truncated responses per generation profile, from
+        # Ollama's prompt_eval_count / eval_count / done_reason
+        self.usage = {}
+        self.usage_lock = threading.Lock()
+        
+        # All LLM calls queue on one process-wide scheduler; batch runs set
+        # scheduling_class = 'batch' so they yield to interactive sessions
+        self.scheduler = get_scheduler()
+        self.session_id = session_id or uuid.uuid4().hex[:12]  # an existing id continues that stored session
+        self.scheduling_class = None
+        
+        # Tail-latency helpers, both off by default (see config.py)
+        # Hedging to the same server only doubles its load, so it needs a
+        # fallback host unless HEDGE_SAME_SERVER is set
+        self.hedger = get_hedger() if HEDGE_ENABLED and (HEDGE_FALLBACK_HOST or HEDGE_SAME_SERVER) else None
+        self.hedge_client = ollama.Client(host=HEDGE_FALLBACK_HOST) if HEDGE_FALLBACK_HOST else None
+        self.speculative = SPECULATIVE_STEPS
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        
+        # Every message is persisted as it happens (store.py), so a session can
+        # be resumed later and the logger needs no copy of its own
+        self.store = store or get_store()
+        self.store.set_owner(self.session_id, os.path.abspath(self.workspace))  # recall is scoped by owner
+        
+        # Workspace snapshot taken before each plan step, by step index, so a
+        # failed step is undone by restoring files instead of by more LLM steps
+        self.snapshots = SnapshotManager(workspace) if SNAPSHOTS_ENABLED else None
+        self.step_snapshots = {}
+        
+        # Verified plans of earlier tasks; plan_match is the library entry the
+        # current plan came from (reused or adapted), if any
+        self.plan_library = get_plan_library() if PLAN_LIBRARY_ENABLED else None
+        self.plan_match = None
+        
+        # Index past sessions in the background now (first Agent of the process
+        # only), so the first recall doesn't wait for (or miss) the whole build
+        warm_up_memory()
         
         # Initialize datalogger
-        self.training_logger = TrainingDataLogger(workspace,format="openai") # or sharegpt
+        self.training_logger = TrainingDataLogger(workspace, format="openai", store=self.store, session_id=self.session_id) # or sharegpt
         
         # Add system prompt on initialization
         self.add_system_prompt()
@@ -313,34 +330,89 @@ class Agent:
     def add_system_prompt(self):
         """Add System prompt that defines system behaviour"""
         system_content = self.read_prompt(prompt_path=r"C:/Users/Administrator/Desktop/code/swstk/Architecture/agent.md")
+        workspace_note = (f"\n\nYour workspace directory is {self.workspace}. File and shell tools only work "
+                          f"inside it; relative paths are taken relative to it.")
         if system_content:
             system_prompt = {
                 'role': 'system',
-                'content': system_content
+                'content': system_content + workspace_note
             }
-            self.conversation.append(system_prompt)
+            self.add_message(system_prompt)
             print("✅ System prompt added")
         else:
             # Fallback system prompt
-            self.conversation.append({
+            self.add_message({
                 'role': 'system',
                 'content': '''You are an autonomous AI agent. You can have normal conversations AND execute complex tasks.
                 When given a task, break it down into steps and use available tools.
-                After each tool execution, analyze the result and decide next steps.'''
+                After each tool execution, analyze the result and decide next steps.''' + workspace_note
             })
         
+    def add_message(self, message):
+        """Append to the in-memory conversation, the persistent store and the training log"""
+        self.conversation.append(message)
+        message_id = self.store.append(self.session_id, message)
+        self.training_logger.log_message(message, message_id)
+
+    def resume_session(self, session_id=None):
+        """
+        Continue an earlier session: keep the current system prompt and load
+        only the newest stored messages that fit in the model's context.
+        Normally the agent was created with Agent(session_id=...) and this
+        loads that session; another id moves the system prompt over to it.
+        """
+        session_id = session_id or self.session_id
+        num_ctx = self.model_options().get('num_ctx', 2048)
+        system = [m for m in self.conversation if m.get('role') == 'system']
+        budget = int(num_ctx * CHARS_PER_TOKEN * 0.75) - sum(len(m.get('content') or '') for m in system)
+        
+        tail = [m for m in self.store.tail(session_id, max(budget, 0)) if m.get('role') != 'system']
+        # A tool result without its assistant tool call is rejected by the model
+        while tail and tail[0].get('role') == 'tool':
+            tail.pop(0)
+        
+        if session_id != self.session_id:
+            # Drop the fresh session if it holds nothing but the system prompt
+            if all(m.get('role') == 'system' for _, _, m in self.store.rows(self.session_id)):
+                self.store.clear(self.session_id)
+            self.session_id = session_id
+            self.store.set_owner(session_id, os.path.abspath(self.workspace))
+            self.training_logger.session_id = session_id
+            self.training_logger.in_session = False
+            for message in system:
+                self.training_logger.log_message(message, self.store.append(session_id, message))
+        
+        self.conversation = system + tail
+        self.tool_cache.clear()
+        print(f"✅ Resumed session {session_id} with {len(tail)} messages")
+        return len(tail)
+
     def save_plan(self, plan):
         """Save plan to file for persistence"""
         with open(self.plan_file, 'w') as f:
             json.dump(plan, f, indent=2)
         print(f"📋 Plan saved to {self.plan_file}")
         
-    def create_plan(self, task):
-        """Ask the model to create a detailed plan"""
+    def create_plan(self, task, on_step=None, reference=None):
+        """
+        Ask the model to create a detailed plan (on_step(step) is called as each step streams in)
+        
+        reference is a plan_library match: the model only adapts that plan to
+        the task, with a short prompt and without the conversation history
+        """
+        messages = self.conversation
         plan_prompt = self.read_prompt(prompt_path=r"C:/Users/Administrator/Desktop/code/swstk/Architecture/plan.md")
         
+        if reference:
+            messages = self.conversation[:1]
+            plan_prompt = f"""This plan worked for the task "{reference['task']}":
+            {json.dumps(reference['plan'], indent=1)}
+            
+            Adapt it to this task: {task}
+            Change only what differs and return the whole plan as JSON with the same structure.
+            """
         # If plan.md doesn't exist, use a default prompt
-        if not plan_prompt:
+        elif not plan_prompt:
             plan_prompt = f"""Create a detailed step-by-step plan for this task: {task}
             Return the plan as JSON with this structure:
             {{
@@ -361,34 +433,42 @@ class Agent:
             }}
             """
         
-        response = ollama.chat(
-            model=self.model,
-            messages=self.conversation + [{'role': 'user', 'content': plan_prompt}],
-            tools=tools
+        # Structured output: the response content is the plan JSON itself.
+        # Streamed so completed steps can be handed to on_step early.
+        parser = StreamingPlanParser()
+        stream = self.chat(
+            'planning',
+            messages=messages + [{'role': 'user', 'content': plan_prompt}],
+            format=PLAN_SCHEMA,
+            stream=True
         )
         
-        # Extract plan from response
         try:
-            # look for json in response
-            json_match = re.search(r'\{.*\}', response.message.content, re.DOTALL)
-            if json_match:
-                plan = json.loads(json_match.group())
-                self.save_plan(plan)
-                return plan 
+            for chunk in stream:
+                for step in parser.feed(chunk.message.content or ""):
+                    if on_step:
+                        on_step(step)
         except Exception as e:
-            print(f"Error parsing plan: {e}")
-            # Fallback - create a simple plan
-            return {
-                "task": task,
-                "steps": [{
-                    "step": 1,
-                    "description": "Complete the task",
-                    "tool": None,
-                    "arguments": {},
-                    "expected_outcome": "Task completed"
-                }],
-                "verification": {"final_check": "User confirms completion"}
-            }
+            print(f"Error streaming plan: {e}")
+        
+        plan = parser.result()
+        if isinstance(plan, dict) and plan.get('steps'):
+            self.save_plan(plan)
+            return plan
+        
+        print("Error parsing plan: model did not return a usable plan")
+        # Fallback - create a simple plan
+        return {
+            "task": task,
+            "steps": [{
+                "step": 1,
+                "description": "Complete the task",
+                "tool": None,
+                "arguments": {},
+                "expected_outcome": "Task completed"
+            }],
+            "verification": {"final_check": "User confirms completion"}
+        }
         
     def load_plan(self):
         """Load existing plan"""
@@ -397,8 +477,43 @@ class Agent:
                 return json.load(f)
         return None
     
-    def execute_step(self, step):
-        """Execute Single step"""
+    def new_call_id(self):
+        """Tool call id, unique within the conversation (also across resumed sessions)"""
+        return f"call_{uuid.uuid4().hex[:8]}"
+
+    def run_tool(self, name, arguments, call_id=None):
+        """
+        Run a tool; output too large for the conversation is spilled to the result store
+        
+        call_id: the conversation's id for this call, which later repeats of an
+        unchanged read are pointed back to
+        """
+        # Repeated read of an unchanged file/directory: point back at the earlier result
+        if cached := self.tool_cache.lookup(name, arguments):
+            print(f"   ♻️ {name} result unchanged, reusing earlier call")
+            return cached
+        
+        # File and shell tools are confined to this agent's workspace
+        call_arguments = dict(arguments, root=self.workspace) if name in ROOTED_TOOLS else arguments
+        if name in SESSION_TOOLS:
+            call_arguments = dict(call_arguments, session_id=self.session_id)
+        if self.isolate_tools and name not in TOOL_POOL_IN_PROCESS:
+            result = get_tool_pool().call(name, call_arguments)
+        else:
+            result = available_functions[name](**call_arguments)
+        self.tool_cache.record(name, arguments, call_id)
+        if name == 'read_result':
+            return str(result)  # already a page of a stored result: spilling it again would lose the notice
+        return self.result_store.bounded(str(result))
+
+    def execute_step(self, step, prefetched=None, before_llm_verify=None, call_id=None):
+        """
+        Execute Single step
+        
+        prefetched: Future already running this step's (read-only) tool, see execute_plan
+        before_llm_verify: called right before verification has to ask the LLM
+        call_id: tool call id the prefetched run was started with
+        """
         print(f"\n [x] Executing step {step['step']}: {step.get('description','')}")
         print(f"    Tool: {step['tool']}")
         print(f"    Arguments: {step.get('arguments', {})}")
@@ -412,20 +527,33 @@ class Agent:
             }
         
         # call the appropriate tool
-        if function_to_call := available_functions.get(step['tool']):
+        if step['tool'] in available_functions:
             try:
-                result = function_to_call(**step['arguments'])
-                result_str = str(result)
+                call_id = call_id or self.new_call_id()
+                if prefetched is not None:
+                    result_str = prefetched.result()
+                else:
+                    result_str = self.run_tool(step['tool'], step['arguments'], call_id)
                 
-                # Add to conversation
-                self.conversation.append({
+                # Add to conversation, as a tool call and its result
+                self.add_message({
+                    'role': 'assistant',
+                    'content': "",
+                    'tool_calls': [{
+                        "id": call_id,
+                        "type": "function",
+                        "function": {"name": step['tool'], "arguments": step['arguments']}
+                    }]
+                })
+                self.add_message({
                     'role': 'tool',
                     'name': step['tool'],
-                    'content': result_str
+                    'content': result_str,
+                    'tool_call_id': call_id
                 })
                 
                 # verify the step
-                verification = self.verify_step(step, result_str)
+                verification = self.verify_step(step, result_str, before_llm=before_llm_verify)
                 
                 return {
                     'success': True,
@@ -443,18 +571,26 @@ class Agent:
                 'error': f"Tool {step['tool']} not found."
             }
             
-    def verify_step(self, step, result):
+    def verify_step(self, step, result, before_llm=None):
         """verify if steps executed properly"""
+        # Outcomes a rule can confirm (file written, exit code 0, ...) skip the LLM
+        if (verification := rule_verify(step, result, root=self.workspace)) is not None:
+            self.verification_stats['rule'] += 1
+            return verification
+        self.verification_stats['llm'] += 1
+        if before_llm:
+            before_llm()
+        
         verification_prompt = f"""
         Step: {step.get('description', 'Unknown step')}
         Expected outcome: {step.get('expected_outcome', 'Not specified')}
         Actual result: {result}
         
-        Did this step execute correctly? Answer YES or NO and explain why.
+        Did this step execute correctly? Answer YES or NO, then the reason in one short sentence.
         """
         
-        response = ollama.chat(
-            model=self.model,
+        response = self.chat(
+            'verification',
             messages=self.conversation + [{'role': 'user', 'content': verification_prompt}]
         )
         
@@ -473,19 +609,23 @@ class Agent:
         verification = plan['verification']
         
         if 'test_command' in verification:
-            # Run test command
-            test_result = run_shell_command(verification['test_command'])
+            # Run test command, in this agent's workspace and under the same
+            # limits as any other tool call
+            try:
+                test_result = self.run_tool('run_shell_command', {'command': verification['test_command']})
+            except Exception as e:
+                test_result = f"Error running test command: {e}"
             
             verification_prompt = f"""
             Final verification: {verification.get('final_check', 'Check if task completed')}
             Test command: {verification['test_command']}
             Test result: {test_result}
 
-            Did the task complete successfully? Answer YES or NO and explain.
+            Did the task complete successfully? Answer YES or NO, then the reason in one short sentence.
             """
             
-            response = ollama.chat(
-                model=self.model,
+            response = self.chat(
+                'verification',
                 messages=self.conversation + [{'role': 'user', 'content': verification_prompt}]
             )
             
@@ -497,9 +637,14 @@ class Agent:
         
         return {'verified': True, 'explanation': 'Verification passed'}
     
-    def update_plan(self, failed_step, error):
-        """Update plan based on failure"""
-        current_plan = self.load_plan()
+    def update_plan(self, failed_step, error, current_plan=None):
+        """
+        Update plan based on failure
+        
+        current_plan: the plan being executed (the saved agent_plan.json lags
+        behind step statuses and verification fixes)
+        """
+        current_plan = current_plan or self.load_plan()
         if not current_plan:
             return None
             
@@ -517,49 +662,213 @@ class Agent:
 
         Provide updated plan JSON.
         """
-        response = ollama.chat(
-            model=self.model,
-            messages=self.conversation + [{'role': 'user', 'content': update_prompt}]
+        response = self.chat(
+            'planning',
+            messages=self.conversation + [{'role': 'user', 'content': update_prompt}],
+            format=PLAN_SCHEMA
         )
         
         # Extract and save updated plan
-        try:
-            json_match = re.search(r'\{.*\}', response.message.content, re.DOTALL)
-            if json_match:
-                updated_plan = json.loads(json_match.group())
-                self.save_plan(updated_plan)
-                return updated_plan
-        except Exception as e:
-            print(f"Error updating plan: {e}")
-            return None
+        updated_plan = parse_json(response.message.content)
+        if isinstance(updated_plan, dict) and updated_plan.get('steps'):
+            self.save_plan(updated_plan)
+            return updated_plan
         
+        print("Error updating plan: model did not return a usable plan")
+        return None
+        
+    def checkpoint(self, record_type, **data):
+        """Append a journal record carrying the conversation delta since the last one"""
+        data['messages'] = self.conversation[self.journaled_messages:]
+        self.journaled_messages = len(self.conversation)
+        self.journal.append({'type': record_type, **data})
+
+    def snapshot_step(self, index, step):
+        """Snapshot the workspace before step `index` (read-only steps reuse the last one)"""
+        if not self.snapshots:
+            return
+        previous = self.step_snapshots.get(index - 1)
+        if previous and step.get('tool') in SPECULATIVE_TOOLS:
+            self.step_snapshots[index] = previous
+            return
+        snapshot_id = self.snapshots.take(label=f"before step {index + 1}: {step.get('description', '')}")
+        if snapshot_id:
+            self.step_snapshots[index] = snapshot_id
+
+    def rollback_to(self, index):
+        """
+        Restore the workspace to how it was before step `index`
+        Returns a note for the repair prompt ("" if nothing was rolled back)
+        """
+        snapshot_id = self.step_snapshots.get(index)
+        if not self.snapshots or not snapshot_id:
+            return ""
+        result = self.snapshots.rollback(snapshot_id)
+        if result is None:
+            return ""
+        
+        # Snapshots of later steps describe states that no longer exist
+        self.step_snapshots = {i: s for i, s in self.step_snapshots.items() if i <= index}
+        self.tool_cache.clear()
+        
+        print(f"⏪ Workspace rolled back to before step {index + 1}: "
+              f"{len(result['restored'])} restored, {len(result['deleted'])} deleted")
+        if result['unrestorable']:
+            print(f"⚠️ Could not restore: {', '.join(result['unrestorable'][:10])}")
+        if not result['restored'] and not result['deleted']:
+            return ""
+        return f"\n(The workspace was rolled back to its state before step {index + 1}; changes made since then are undone.)"
+
     def run_task(self, task):
         """Main agent loop"""
         print(f"\n🚀 Starting task: {task}")
+        self.journal.start(task)
+        self.journaled_messages = 0  # first record of a run carries the whole conversation
+        self.step_snapshots = {}
         
         # Add task to conversation
-        self.conversation.append({'role': 'user', 'content': task})
+        self.add_message({'role': 'user', 'content': task})
+        
+        try:
+            # PHASE 1: PLANNING
+            print("\n📝 PHASE 1: Creating plan...")
+            plan, current_step = self.plan_and_start(task)
+            if not plan:
+                print("❌ Failed to create plan")
+                return
+            
+            print(f"✅ Plan created with {len(plan.get('steps', []))} steps")
+            self.checkpoint('plan', plan=plan, next_step=current_step)
+            
+            return self.execute_plan(task, plan, current_step=current_step)
+        finally:
+            # One task is one training session
+            self.training_logger.end_session()
+
+    def plan_and_start(self, task):
+        """
+        Create the plan while executing its leading steps as they stream in
+        
+        Returns (plan, steps_done). Early execution stops at the first step that
+        fails or doesn't verify; execute_plan then picks that step up with the
+        usual recovery logic once the whole plan is available.
+        """
+        # A verified plan of a near-identical task is used without planning
+        self.plan_match = self.plan_library.match(task, self.workspace) if self.plan_library else None
+        if self.plan_match and self.plan_match['kind'] == 'reuse':
+            print(f"📚 Reusing verified plan of \"{self.plan_match['task']}\" (similarity {self.plan_match['score']})")
+            plan = self.plan_match['plan']
+            self.save_plan(plan)
+            return plan, 0
+        reference = self.plan_match
+        if reference:
+            print(f"📚 Adapting verified plan of \"{reference['task']}\" (similarity {reference['score']})")
         
-        # PHASE 1: PLANNING
-        print("\n📝 PHASE 1: Creating plan...")
-        plan = self.create_plan(task)
+        ready = queue.Queue()
+        outcome = {}
+        
+        def planner():
+            try:
+                outcome['plan'] = self.create_plan(task, on_step=ready.put, reference=reference)
+            finally:
+                ready.put(None)
+        
+        threading.Thread(target=planner, daemon=True).start()
+        
+        executed = []
+        stopped = False
+        while (step := ready.get()) is not None:
+            if stopped:
+                continue
+            self.snapshot_step(len(executed), step)
+            result = self.execute_step(step)
+            if result['success'] and result['verification']['verified']:
+                print(f"✅ Step {step['step']} completed (while planning)")
+                executed.append(step)
+            else:
+                stopped = True
+        
+        plan = outcome.get('plan')
         if not plan:
-            print("❌ Failed to create plan")
-            return
+            return None, 0
+        
+        # Only count early steps that made it into the final plan unchanged
+        done = 0
+        for early, final in zip(executed, plan.get('steps', [])):
+            if early.get('tool') != final.get('tool') or early.get('arguments') != final.get('arguments'):
+                break
+            final['status'] = 'completed'
+            done += 1
+        
+        # Undo early work the final plan doesn't keep (or a step that failed)
+        if stopped or done < len(executed):
+            self.rollback_to(done)
+        return plan, done
+
+    def resume_task(self):
+        """Continue the most recent run_task from its last completed step"""
+        state = self.journal.load()
+        if not state or not state['plan']:
+            print("❌ No checkpointed task to resume")
+            return None
+        if state['finished']:
+            print(f"✅ Last task already finished: {state['task']}")
+            return state['plan']
+        
+        print(f"\n♻️ Resuming task: {state['task']}")
+        print(f"   Continuing at step {state['next_step'] + 1} of {len(state['plan'].get('steps', []))}")
         
-        print(f"✅ Plan created with {len(plan.get('steps', []))} steps")
+        # Pick the journal back up where it left off. The restored messages go
+        # through add_message, so this session's store rows, training log and
+        # memory have everything from before the crash; the system prompt is
+        # this agent's (already stored), the checkpoint's only if it has none
+        self.journal.run_id = state['run_id']
+        system = [m for m in self.conversation if m.get('role') == 'system']
+        self.conversation = list(system)
+        for message in state['conversation']:
+            if message.get('role') != 'system' or not system:
+                self.add_message(message)
+        self.journaled_messages = len(self.conversation)
+        self.tool_cache.clear()
+        self.plan_match = None
         
+        try:
+            return self.execute_plan(state['task'], state['plan'], current_step=state['next_step'])
+        finally:
+            self.training_logger.end_session()
+
+    def execute_plan(self, task, plan, current_step=0):
+        """Run plan steps from current_step, then verify the final result"""
         # PHASE 2 & 3: EXECUTION & VERIFICATION
         print("\n⚙️ PHASE 2: Executing plan...")
         
         steps = plan.get('steps', [])
-        current_step = 0
+        speculation = {}  # read-only step started while the LLM verified the one before it
         
         while current_step < len(steps):
             step = steps[current_step]
             
+            # Use the speculative run only if the plan still has that exact step here
+            prefetched, prefetched_id = None, None
+            if speculation.get('index') == current_step and speculation.get('tool') == step.get('tool') \
+                    and speculation.get('arguments') == step.get('arguments'):
+                prefetched, prefetched_id = speculation['future'], speculation['call_id']
+            elif speculation:
+                # Never shown to the model: later reads must not point back at it
+                speculation['future'].add_done_callback(lambda _, cid=speculation['call_id']: self.tool_cache.forget(cid))
+            speculation = {}
+            
+            start_next = None
+            if self.speculative and current_step + 1 < len(steps) and steps[current_step + 1].get('tool') in SPECULATIVE_TOOLS:
+                def start_next(index=current_step + 1):
+                    # Read-only, so running it early is harmless if the plan changes
+                    nxt, call_id = steps[index], self.new_call_id()
+                    speculation.update(index=index, tool=nxt['tool'], arguments=nxt.get('arguments'), call_id=call_id,
+                                       future=self.background.submit(self.run_tool, nxt['tool'], nxt.get('arguments', {}), call_id))
+            
             # Execute step
-            result = self.execute_step(step)
+            self.snapshot_step(current_step, step)
+            result = self.execute_step(step, prefetched=prefetched, before_llm_verify=start_next, call_id=prefetched_id)
             
             if result['success']:
                 print(f"✅ Step {step['step']} completed")
@@ -568,54 +877,78 @@ class Agent:
                 if result['verification']['verified']:
                     # Move to next step
                     steps[current_step]['status'] = 'completed'
+                    self.checkpoint('step', index=current_step, status='completed',
+                                    result=result['result'], next_step=current_step + 1)
                     current_step += 1
                 else:
                     # Step executed but verification failed
                     print(f"⚠️ Step {step['step']} executed but verification failed")
-                    # Ask model what to do
+                    # Undo the step, then ask model what to do
+                    note = self.rollback_to(current_step)
+                    if note:
+                        result = {**result, 'result': result['result'] + note}
                     steps = self.handle_verification_failure(step, result, steps, current_step)
+                    plan['steps'] = steps
+                    self.checkpoint('plan', plan=plan, next_step=current_step)
             else:
                 # Step failed
                 print(f"❌ Step {step['step']} failed: {result['error']}")
-                # Update plan based on failure
-                new_plan = self.update_plan(step, result['error'])
+                self.checkpoint('step', index=current_step, status='failed',
+                                result=result['error'], next_step=current_step)
+                # Restore the pre-step workspace, then update plan based on failure
+                note = self.rollback_to(current_step)
+                new_plan = self.update_plan(step, result['error'] + note, current_plan=plan)
                 if new_plan:
+                    plan = new_plan
                     steps = new_plan.get('steps', [])
                     # Reset to appropriate step
                     current_step = max(0, current_step - 1)  # Go back one step
+                    self.rollback_to(current_step)  # the re-run step starts from its own snapshot
+                    self.checkpoint('plan', plan=plan, next_step=current_step)
                 else:
                     print("❌ Cannot recover from failure")
                     break
-            
-            # Save progress
-            self.save_plan(plan)
         
         # PHASE 4: FINAL VERIFICATION
         print("\n🔍 PHASE 4: Verifying final result...")
         final_verification = self.verify_final_result(plan)
+        self.last_verification = final_verification
+        print(f"   Step checks: {self.verification_stats['rule']} by rule, {self.verification_stats['llm']} by the model")
         
         if final_verification['verified']:
             print("\n🎉 TASK COMPLETED SUCCESSFULLY!")
             print(f"   {final_verification['explanation']}")
             
             # Add completion to conversation
-            self.conversation.append({
+            self.add_message({
                 'role': 'assistant',
                 'content': f"Task completed: {final_verification['explanation']}"
             })
         else:
             print("\n⚠️ TASK COMPLETED BUT VERIFICATION FAILED")
             print(f"   {final_verification['explanation']}")
-            
-            # Ask if user wants to iterate
-            response = input("\n🔄 Try to fix? (y/n): ")
-            if response.lower() == 'y':
-                # Start over with new plan based on failure
-                new_task = f"Fix the issues with previous attempt: {task}\nPrevious attempt failed because: {final_verification['explanation']}"
-                self.run_task(new_task)
+        
+        self.checkpoint('done', verification=final_verification)
+        self.remember_plan(task, plan, final_verification['verified'])
+        
+        # Ask if user wants to iterate (headless runs just report the failure)
+        if not final_verification['verified'] and self.interactive and input("\n🔄 Try to fix? (y/n): ").lower() == 'y':
+            # Start over with new plan based on failure
+            new_task = f"Fix the issues with previous attempt: {task}\nPrevious attempt failed because: {final_verification['explanation']}"
+            self.run_task(new_task)
         
         return plan
     
+    def remember_plan(self, task, plan, verified):
+        """Keep a verified plan in the plan library; score a reused one either way"""
+        if not self.plan_library:
+            return
+        if self.plan_match and self.plan_match['kind'] == 'reuse':
+            self.plan_library.record(self.plan_match['id'], verified)
+        elif verified and all(step.get('tool') for step in plan.get('steps', [])):
+            self.plan_library.add(task, plan, self.workspace)
+        self.plan_match = None
+    
     def handle_verification_failure(self, step, result, steps, current_step):
         """Handle case where step executed but verification failed"""
         prompt = f"""
@@ -632,39 +965,226 @@ class Agent:
 
         Provide updated steps array.
         """
-        response = ollama.chat(
-            model=self.model,
-            messages=self.conversation + [{'role': 'user', 'content': prompt}]
+        response = self.chat(
+            'planning',
+            messages=self.conversation + [{'role': 'user', 'content': prompt}],
+            format=STEPS_SCHEMA
         )
         
         # Parse response and return updated steps
-        try:
-            json_match = re.search(r'\[.*\]', response.message.content, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-        except Exception as e:
-            print(f"Error parsing verification failure response: {e}")
+        updated = parse_json(response.message.content)
+        if isinstance(updated, dict):
+            updated = updated.get('steps')
+        if isinstance(updated, list) and updated:
+            return updated
+        print("Error parsing verification failure response: no steps returned")
         
         # Default: continue but mark as completed
         steps[current_step]['status'] = 'completed_with_issues'
         return steps
 
-    def process_message(self, user_input):
-        """Process a message with automatic tool use - no intent detection needed"""
+    def model_options(self):
+        """num_ctx/num_predict tuned from the model catalog (empty -> Ollama defaults)"""
+        if not self.options:
+            self.options = self.catalog.tuned_options(self.model)  # retried until the server answers
+            self.profile_options = {}
+        return self.options
+
+    def generation_options(self, profile):
+        """Options of a generation profile (profiles.py) for this agent's model"""
+        tuned = self.model_options()
+        if profile not in self.profile_options:
+            self.profile_options[profile] = build_options(profile, tuned)
+        return self.profile_options[profile]
+
+    def usage_report(self):
+        """Calls, tokens and truncation rate per generation profile"""
+        with self.usage_lock:
+            return usage_report(self.usage)
+
+    def emit(self, event, **data):
+        """Forward an event to the on_event callback (if any)"""
+        if self.on_event:
+            try:
+                self.on_event(event, data)
+            except Exception as e:
+                print(f"Error in event handler: {e}")
+
+    def chat(self, call_type, profile=None, **kwargs):
+        """
+        chat() on this agent's model and server, routed through the shared scheduler.
+        call_type ('interactive', 'planning', 'verification') picks the priority
+        class unless the agent has a fixed scheduling_class (batch runs), and
+        the generation profile unless one is given.
+        """
+        profile = profile or call_type
+        kwargs.setdefault('model', self.model)
+        kwargs.setdefault('options', self.generation_options(profile))
+        slot_args = dict(
+            model=kwargs['model'],
+            priority=self.scheduling_class or call_type,
+            session_id=self.session_id
+        )
+        slot = self.scheduler.slot(**slot_args)
         
+        if kwargs.get('stream'):
+            if self.hedger:
+                # Hedged on time to first token: the copy that starts answering first is streamed
+                def primary_stream(started, cancelled):
+                    return self.start_stream(self.client, kwargs, cancelled, slot_args, started)
+
+                started_stream = self.hedger.call((kwargs['model'], call_type, 'first_token'), primary_stream,
+                                                  lambda started, cancelled: self.hedge_chat(call_type, kwargs, profile, cancelled, stream=True),
+                                                  discard=lambda loser: loser.close())
+
+            # Hold the slot until the stream has been fully consumed
+            def stream():
+                chunk = None
+                if self.hedger:
+                    try:
+                        for chunk in started_stream:
+                            yield chunk
+                    finally:
+                        started_stream.close()
+                else:
+                    with slot:
+                        for chunk in self.client.chat(**kwargs):
+                            yield chunk
+                self.record_usage(profile, chunk)  # the last chunk carries the counts
+            return stream()
         
-        # Add user message to conversation
-        self.conversation.append({'role': 'user', 'content': user_input})
+        if self.hedger:
+            def primary(started, cancelled):
+                with self.scheduler.slot(**slot_args, cancelled=cancelled):
+                    started()  # the hedge timer starts once we're past the queue
+                    return self.cancellable_chat(self.client, kwargs, cancelled)
+            
+            response = self.hedger.call((kwargs['model'], call_type), primary,
+                                        lambda started, cancelled: self.hedge_chat(call_type, kwargs, profile, cancelled))
+        else:
+            with slot:
+                response = self.client.chat(**kwargs)
+        return self.record_usage(profile, response)
+
+    def cancellable_chat(self, client, kwargs, cancelled):
+        """
+        chat() that gives up once cancelled is set (the other hedged copy won):
+        streamed internally so dropping the connection stops the generation
+        and frees the server, merged into one response like a non-streamed call
+        """
+        content, tool_calls, last_chunk = "", [], None
+        chunks = client.chat(**dict(kwargs, stream=True))
+        try:
+            for chunk in chunks:
+                if cancelled.is_set():
+                    raise RequestCancelled(f"{kwargs['model']} request cancelled")
+                last_chunk = chunk
+                content += chunk.message.content or ""
+                tool_calls.extend(chunk.message.tool_calls or [])
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        last_chunk.message.content = content
+        last_chunk.message.tool_calls = tool_calls or None
+        return last_chunk
+
+    def start_stream(self, client, kwargs, cancelled, slot_args=None, started=None) -> StreamStart:
+        """
+        Streamed chat() read up to its first token (content or a tool call),
+        for hedging on time to first token. The scheduler slot (if slot_args)
+        and the connection stay open until the StreamStart is consumed or closed.
+        """
+        resources = ExitStack()
+        try:
+            if slot_args:
+                resources.enter_context(self.scheduler.slot(**slot_args, cancelled=cancelled))
+            if started:
+                started()
+            chunks = iter(client.chat(**kwargs))
+            if hasattr(chunks, 'close'):
+                resources.callback(chunks.close)
+            head = []
+            for chunk in chunks:
+                if cancelled.is_set():
+                    break
+                head.append(chunk)
+                if chunk.message.content or chunk.message.tool_calls:
+                    break
+            else:
+                resources.close()  # ended without a token: nothing left to hold
+            if cancelled.is_set():
+                raise RequestCancelled(f"{kwargs['model']} request cancelled")
+            return StreamStart(head, chunks, resources.close)
+        except BaseException:
+            resources.close()
+            raise
+
+    def record_usage(self, profile, response):
+        """Add a response's token counts to self.usage[profile]; returns the response"""
+        with self.usage_lock:
+            stats = self.usage.setdefault(profile, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'truncated': 0})
+            stats['calls'] += 1
+            stats['prompt_tokens'] += getattr(response, 'prompt_eval_count', None) or 0
+            stats['completion_tokens'] += getattr(response, 'eval_count', None) or 0
+            stats['truncated'] += truncated(response)
+        return response
+
+    def hedge_chat(self, call_type, kwargs, profile=None, cancelled=None, stream=False):
+        """Backup copy of a slow request, sent to the fallback server and/or model (a StreamStart if stream)"""
+        cancelled = cancelled or threading.Event()
+        hedge_kwargs = dict(kwargs, model=HEDGE_FALLBACK_MODEL or kwargs['model'])
+        if HEDGE_FALLBACK_HOST:
+            # A different server: our scheduler doesn't manage its capacity
+            if stream:
+                return self.start_stream(self.hedge_client, hedge_kwargs, cancelled)
+            return self.cancellable_chat(self.hedge_client, hedge_kwargs, cancelled)
         
+        tuned = self.catalog.tuned_options(hedge_kwargs['model'])
+        hedge_kwargs['options'] = build_options(profile or call_type, tuned) if tuned else kwargs['options']
+        slot_args = dict(model=hedge_kwargs['model'], priority=self.scheduling_class or call_type, session_id=self.session_id)
+        if stream:
+            return self.start_stream(self.client, hedge_kwargs, cancelled, slot_args)
+        with self.scheduler.slot(**slot_args, cancelled=cancelled):
+            return self.cancellable_chat(self.client, hedge_kwargs, cancelled)
+
+    def stream_chat(self, call_type, **kwargs):
+        """Streaming chat that emits tokens and returns the merged final response"""
+        content = ""
+        tool_calls = []
+        last_chunk = None
+
+        for chunk in self.chat(call_type, stream=True, **kwargs):
+            last_chunk = chunk
+            if chunk.message.content:
+                content += chunk.message.content
+                self.emit('token', content=chunk.message.content)
+            if chunk.message.tool_calls:
+                tool_calls.extend(chunk.message.tool_calls)
+
+        # The final chunk carries the stats, give it the accumulated message
+        last_chunk.message.content = content
+        last_chunk.message.tool_calls = tool_calls or None
+        return last_chunk
+
+    def process_message(self, user_input):
+        """Process a message with automatic tool use - no intent detection needed"""
+
+
+        # Add user message to conversation
+        self.add_message({'role': 'user', 'content': user_input})
+
         iteration = 0
         max_iterations = 10
-        
+        detector = LoopDetector()
+
         while iteration < max_iterations:
             iteration += 1
-            
+
             # Get LLM response with tools always available
-            response = ollama.chat(
-                model=self.model,
+            # (streamed when someone is listening for tokens)
+            chat = self.stream_chat if self.on_event else self.chat
+            response = chat(
+                'interactive',
                 messages=self.conversation,
                 tools=tools
             )
@@ -673,7 +1193,7 @@ class Agent:
             if not response.message.tool_calls:
                 final_response = response.message.content
                 # Add assistant response to conversation
-                self.conversation.append({'role': 'assistant', 'content': final_response})
+                self.add_message({'role': 'assistant', 'content': final_response})
                 return final_response
             
             # Handle tool calls - ONE AT A TIME to ensure proper format
@@ -686,13 +1206,15 @@ class Agent:
             
             print(f"\n🔧 Using tool: {first_tool.function.name}")
             print(f"   Arguments: {first_tool.function.arguments}")
-            
+            self.emit('tool_call', name=first_tool.function.name, arguments=first_tool.function.arguments)
+
             # Add assistant message with tool call to conversation
-            self.conversation.append({
+            call_id = self.new_call_id()
+            self.add_message({
                 'role': 'assistant',
                 'content': response.message.content,
                 'tool_calls': [{
-                    "id": f"call_{iteration}",
+                    "id": call_id,
                     "type": "function",
                     "function": {
                         "name": first_tool.function.name,
@@ -702,65 +1224,90 @@ class Agent:
             })
             
             # Execute the tool
-            if function_to_call := available_functions.get(first_tool.function.name):
+            if first_tool.function.name in available_functions:
                 try:
-                    result = function_to_call(**first_tool.function.arguments)
-                    result_str = str(result)
+                    result_str = self.run_tool(first_tool.function.name, first_tool.function.arguments, call_id)
                     
                     # Add tool result to conversation
-                    self.conversation.append({
+                    self.add_message({
                         'role': 'tool',
                         'name': first_tool.function.name,
                         'content': result_str,
-                        'tool_call_id':f"call_{iteration}"
+                        'tool_call_id': call_id
                     })
                     
-                    for n in result_str:
-                        if n == "\n":
-                            print("\n")
-                        else:
-                            print("n")
+                    preview = result_str[:300] + ("..." if len(result_str) > 300 else "")
+                    print(f"   Result: {preview}")
                     
                 except Exception as e:
                     error_msg = f"Error executing tool: {str(e)}"
                     
                     # Add error to conversation
-                    self.conversation.append({
+                    self.add_message({
                         'role': 'tool',
                         'name': first_tool.function.name,
                         'content': f"ERROR: {error_msg}",
-                        'tool_call_id': f"call_{iteration}"
+                        'tool_call_id': call_id
                     })
                     
                     print(f"   [x]   ERROR: {error_msg}")
             else:
                 error_msg = f"Tool {first_tool.function.name} not found"
                 
-                # Log error for training
-                self.training_logger.log_error(error_msg, first_tool.function.name)
-                
-                # Add error to conversation
-                self.conversation.append({
+                # Add error to conversation (and the training log)
+                self.add_message({
                     'role': 'tool',
                     'name': first_tool.function.name,
                     'content': f"ERROR: {error_msg}",
-                    'tool_call_id': f"call_{iteration}"
+                    'tool_call_id': call_id
                 })
                 
                 print(f"   [x] {error_msg}")
-            
+
+            self.emit('tool_result', name=first_tool.function.name, content=self.conversation[-1]['content'])
+
+            # Same calls and results as the round before: nudge the model, then stop it
+            wasted = detector.wasted
+            verdict = detector.observe(first_tool.function.name, first_tool.function.arguments, self.conversation[-1]['content'])
+            self.loop_stats['iterations'] += 1
+            self.loop_stats['wasted'] += detector.wasted - wasted
+            if verdict == 'hint':
+                self.loop_stats['hints'] += 1
+                print(f"[x]    Loop detected: model {detector.describe()}")
+                self.add_message({'role': 'system', 'content': detector.hint()})
+            elif verdict == 'stop':
+                self.loop_stats['stopped'] += 1
+                print(f"[x]    Still looping after a hint, asking for a final answer")
+                return self.answer_without_tools(detector)
+
             # Loop continues with tool result added to conversation
             # The model will see the result and decide next action
         
         # If we hit max iterations
         timeout_msg = f"⚠️ Maximum iterations ({max_iterations}) reached without completing task"
-        self.conversation.append({'role': 'assistant', 'content': timeout_msg})
+        self.add_message({'role': 'assistant', 'content': timeout_msg})
         return timeout_msg
     
+    def answer_without_tools(self, detector):
+        """End a tool loop: one last call without tools, so the model has to answer"""
+        response = self.chat(
+            'interactive',
+            messages=self.conversation + [{'role': 'user', 'content': f"You {detector.describe()}. "
+                                           "Stop calling tools and answer with what you have found so far."}]
+        )
+        final_response = response.message.content
+        self.add_message({'role': 'assistant', 'content': final_response})
+        return final_response
+
     def run(self):
         # =====================================================================
         #       Necessary Information Print Section
         # =====================================================================
+        # Load the model while the header renders, and keep it loaded while idle
+        warm_up_models([self.model], host=self.host)
+        pinger = KeepAlivePinger([self.model], host=self.host)
+        pinger.start()
+        
         print(colored("\n\n","green"))
         """Main interactive loop"""
         """Print a nice header for the agent"""
@@ -770,17 +1317,13 @@ class Agent:
         print("╚════════════════════════════════════╝")
         print(colored("\n\n","green"))
         
-        # Track if we're in an active session
-        in_session = False
-        
         try:
             while True:
                 user_input = input(colored("┌─You       : ","green"))
                 
                 if user_input.lower() in ['exit', 'quit', 'bye']:
                     # End current session before exiting
-                    if in_session:
-                        self.training_logger.end_session()
+                    self.training_logger.end_session()
                     print("👋 Goodbye!")
                     break
                 
@@ -798,7 +1341,8 @@ class Agent:
                 # You could add logic here to detect when a task is complete
         
         except KeyboardInterrupt:
-            if in_session:
-                self.training_logger.end_session()
+            self.training_logger.end_session()
             print(colored("Goodbye...","green"))
+        finally:
+            pinger.stop()
 
@@ -0,0 +1,429 @@
+# =====================================================
+#          AGENT TESTS (pytest, or run this file directly)
+# =====================================================
+# Plain asserts against the real modules. AGENT_ROOT is pointed at a fresh
+# temp dir before config is imported, so every store, index and library
+# lives there: nothing under the real ALLOWED_ROOT is read or written, and
+# the tests run on any OS. No Ollama server is needed.
+import os
+import tempfile
+
+os.environ["AGENT_ROOT"] = tempfile.mkdtemp(prefix="agent_test_")
+
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict
+import numpy as np
+import memory
+import search
+import store
+import tools as agent_tools
+from config import ALLOWED_ROOT, RESULT_PREVIEW_CHARS, RESULT_PAGE_CHARS
+from convert import canonicalize, convert_files, plan_shards, render
+from dataset import PackedDataset, ShardWriter
+from dedup import deduplicate
+from hedge import HedgedChat, LatencyTracker, RequestCancelled
+from loop_detector import LoopDetector
+from plan_parser import MAX_DECODE_ATTEMPTS, StreamingPlanParser, parse_json
+from results import TRUNCATION_NOTICE, default_store, read_result
+from scheduler import LLMScheduler, SlotCancelled, Ticket
+from snapshot import SnapshotManager
+
+
+def make_workspace(files: Dict[str, str], root: str = ALLOWED_ROOT) -> str:
+    workspace = tempfile.mkdtemp(prefix="ws_", dir=root)
+    for name, content in files.items():
+        path = os.path.join(workspace, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    return workspace
+
+
+def read(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the condition"
+        time.sleep(0.01)
+
+
+def test_config_follows_agent_root():
+    assert ALLOWED_ROOT == os.environ["AGENT_ROOT"]
+    from config import CONVERSATION_DB_PATH, PLAN_LIBRARY_PATH
+    assert os.path.dirname(PLAN_LIBRARY_PATH) == ALLOWED_ROOT
+    assert os.path.dirname(CONVERSATION_DB_PATH) == ALLOWED_ROOT
+
+
+# -------------------------------------------------
+#   tools
+# -------------------------------------------------
+def test_read_files():
+    root = make_workspace({"a.txt": "alpha", "notes.txt": "Error: this file really starts with Error"})
+    out = agent_tools.read_files(["a.txt", "notes.txt", "missing.txt"], root=root)
+    assert out.startswith("Read 2 of 3 files (1 failed)"), out
+    assert "===== notes.txt (41 chars) =====\nError: this file" in out, out
+    assert "===== missing.txt (failed) =====" in out, out
+    assert "Read 0 of 1 files (1 failed)" in agent_tools.read_files(["../outside.txt"], root=root)
+    assert agent_tools.read_files('["a.txt"]', root=root).endswith("alpha")  # JSON string from the model
+
+
+def test_write_files():
+    root = make_workspace({"keep.txt": "old"})
+    out = agent_tools.write_files([{"file_path": "pkg/__init__.py", "content": ""},
+                                   {"file_path": "pkg/mod.py", "content": "x = 1\n"}], root=root)
+    assert out.startswith("✅ Wrote 2 files"), out
+    assert read(os.path.join(root, "pkg", "mod.py")) == "x = 1\n"
+    assert f"pkg/mod.py ({os.path.getsize(os.path.join(root, 'pkg', 'mod.py'))} bytes)" in out, out
+
+    # Rollback: "keep.txt/sub" can't be created (keep.txt is a file), so the
+    # directory made for the first file and every written file are undone
+    out = agent_tools.write_files([{"file_path": "fresh/new.txt", "content": "new"},
+                                   {"file_path": "keep.txt", "content": "overwritten"},
+                                   {"file_path": "keep.txt/sub/c.txt", "content": "c"}], root=root)
+    assert "No files were changed" in out, out
+    assert not os.path.exists(os.path.join(root, "fresh")), "directory created before the error was left behind"
+    assert read(os.path.join(root, "keep.txt")) == "old"
+    assert not [n for n in os.listdir(root) if n.endswith(".tmp")], os.listdir(root)
+
+    out = agent_tools.write_files([{"file_path": "../escape.txt", "content": "x"}], root=root)
+    assert out.startswith("Error: Access denied"), out
+
+
+def test_search_workspace():
+    root = make_workspace({"one/app.py": "def frobnicate():\n    return 42\n", "two/lib.py": "frobnicate = None\n"})
+    out = agent_tools.search_workspace("frobnicate", root=root)
+    assert "app.py" in out and "lib.py" in out, out
+    out = agent_tools.search_workspace("frobnicate", root=os.path.join(root, "one"))
+    assert "app.py" in out and "lib.py" not in out, out  # a session only searches its own workspace
+    other = make_workspace({"elsewhere.py": "frobnicate()\n"}, root=None)  # outside ALLOWED_ROOT: own index
+    out = agent_tools.search_workspace("frobnicate", root=other)
+    assert "elsewhere.py" in out and "app.py" not in out, out
+    assert search.get_index(other) is not search.get_index()
+    assert agent_tools.search_workspace("  ").startswith("Error")
+
+
+def test_recall():
+    root = make_workspace({})
+    conversations = store.get_store()
+    conversations.append("earlier", {"role": "user", "content": "the frobnicator settings live in settings.toml"})
+    conversations.append("earlier", {"role": "assistant", "content": "", "tool_calls": [
+        {"id": "call_1", "function": {"name": "recall", "arguments": {"query": "frobnicator"}}}]})
+    conversations.append("earlier", {"role": "tool", "name": "recall", "tool_call_id": "call_1",
+                                     "content": "1 memories for 'frobnicator': an older recall result"})
+    conversations.append("live", {"role": "user", "content": "where are the frobnicator settings?"})
+    conversations.append("tenant", {"role": "user", "content": "frobnicator settings of another user"})
+    for session_id, workspace in (("earlier", root), ("live", root), ("tenant", root + "-other")):
+        conversations.set_owner(session_id, workspace)
+    memory.get_memory().refresh(force=True)
+
+    out = memory.recall("frobnicator settings", session_id="live", root=root)
+    assert "settings.toml" in out, out
+    assert "older recall result" not in out and "recall {" not in out, "recall output was indexed"
+    assert "session:live" not in out, "the asking session recalled itself"
+    assert "session:tenant" not in out, "another workspace's session was recalled"
+    assert "session:live" in memory.recall("frobnicator settings", root=root)
+    assert memory.recall("").startswith("Error")
+
+
+def test_agent_result_paging():
+    """read_result pages come back as is, and big results are bounded once, in or out of a worker"""
+    from agent import Agent
+    agent = Agent(model="llama3.2", workspace=make_workspace({}), interactive=False)
+
+    content = "".join(f"line {i}\n" for i in range(3000))
+    handle = TRUNCATION_NOTICE.search(default_store.bounded(content)).group(1)
+    page = agent.run_tool("read_result", {"handle": handle, "offset": RESULT_PREVIEW_CHARS})
+    assert page == read_result(handle, RESULT_PREVIEW_CHARS), "read_result page was changed by run_tool"
+    assert page.startswith(content[RESULT_PREVIEW_CHARS:RESULT_PREVIEW_CHARS + RESULT_PAGE_CHARS])
+    assert "[truncated:" not in page, "read_result page was spilled again"
+    assert read_result("0" * 32).startswith("Error: No stored result")
+
+    big = "x" * (RESULT_PREVIEW_CHARS * 3)
+    with open(os.path.join(agent.workspace, "big.txt"), "w", encoding="utf-8") as f:
+        f.write(big)
+    for isolate in (False, True):
+        agent.isolate_tools = isolate
+        agent.tool_cache.clear()
+        result = agent.run_tool("read_file", {"file_path": "big.txt"})
+        assert result.count("[truncated:") == 1, f"bounded {result.count('[truncated:')} times (isolate_tools={isolate})"
+        assert default_store.expand(result) == big, f"stored result is not the tool's output (isolate_tools={isolate})"
+
+
+# -------------------------------------------------
+#   LLM request scheduling and hedging
+# -------------------------------------------------
+def test_scheduler_priority_and_cancel():
+    scheduler = LLMScheduler(max_concurrent=1, per_model_limit=1, aging=0)
+    order = []
+
+    def request(priority, session_id):
+        with scheduler.slot("m", priority, session_id):
+            order.append(priority)
+
+    def queued():
+        return sum(len(q) for q in scheduler.waiting.values())
+
+    with scheduler.slot("m", "interactive", "holder"):
+        threads = []
+        for n, (priority, session_id) in enumerate((("batch", "b"), ("interactive", "i"))):
+            threads.append(threading.Thread(target=request, args=(priority, session_id)))
+            threads[-1].start()
+            wait_for(lambda: queued() == n + 1)
+
+        cancelled = threading.Event()
+        cancelled.set()
+        try:
+            with scheduler.slot("m", "planning", "c", cancelled=cancelled):
+                raise AssertionError("a cancelled request got a slot")
+        except SlotCancelled:
+            pass
+        assert queued() == 2, "the cancelled ticket stayed queued"
+
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ["interactive", "batch"], order  # queued later but a higher class
+    assert not scheduler.running and not scheduler.waiting
+
+    ticket = Ticket(0, "m", "batch", "s")
+    assert ticket.effective_priority(ticket.enqueued + 3 * 30, 30) == 0  # aged up to interactive
+
+
+def test_hedge():
+    def response(text):
+        return SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=None))
+
+    hedger = HedgedChat(LatencyTracker(min_samples=1), min_delay=0.05, default_delay=0.05)
+    lost = threading.Event()
+
+    def slow(started, cancelled):
+        started()
+        if cancelled.wait(5):
+            lost.set()
+            raise RequestCancelled()
+        return response("primary")
+
+    assert hedger.call("k", slow, lambda started, cancelled: response("hedge")).message.content == "hedge"
+    assert lost.wait(5), "the losing primary was not cancelled"
+    assert hedger.stats["hedged"] == 1 and hedger.stats["hedge_won"] == 1
+
+    def queued_then_fast(started, cancelled):
+        time.sleep(0.2)  # waiting for a slot: not latency, must not trigger a hedge
+        started()
+        return response("primary")
+
+    def never(started, cancelled):
+        raise AssertionError("hedged a request that was only queued")
+
+    hedger.tracker = LatencyTracker(min_samples=1)
+    assert hedger.call("q", queued_then_fast, never).message.content == "primary"
+    assert hedger.stats["hedged"] == 1
+    assert hedger.tracker.p95("q") < 0.2
+
+
+def test_hedged_stream():
+    """A stream slow to its first token is hedged; the loser's stream is closed and its slot freed"""
+    from agent import Agent
+    closed = []
+
+    def chunk(text, done=False):
+        return SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=None), done=done)
+
+    class Client:
+        calls = 0
+
+        def chat(self, **kwargs):
+            Client.calls += 1
+            delay, name = (0.5, "slow") if Client.calls == 1 else (0, "fast")
+            try:
+                time.sleep(delay)
+                yield chunk(name)
+                yield chunk(" answer", done=True)
+            finally:
+                closed.append(name)
+
+    agent = Agent(model="llama3.2", workspace=make_workspace({}), interactive=False)
+    agent.client = Client()
+    agent.scheduler = LLMScheduler(max_concurrent=2, per_model_limit=2)
+    agent.hedger = HedgedChat(LatencyTracker(min_samples=1), min_delay=0.05, default_delay=0.05)
+
+    response = agent.stream_chat("interactive", messages=[{"role": "user", "content": "hi"}])
+    assert response.message.content == "fast answer", response.message.content
+    assert agent.hedger.stats["hedge_won"] == 1
+    wait_for(lambda: sorted(closed) == ["fast", "slow"])
+    wait_for(lambda: not agent.scheduler.running)
+
+
+# -------------------------------------------------
+#   tool loop detection and plan parsing
+# -------------------------------------------------
+def test_loop_detector():
+    detector = LoopDetector(max_period=3, hint_after=1, stop_after=2)
+    actions = [detector.observe("read_file", {"file_path": "a"}, "same") for _ in range(4)]
+    assert actions == [None, "hint", None, "stop"], actions
+    assert "read_file" in detector.hint()
+
+    detector = LoopDetector(max_period=3, hint_after=1, stop_after=2)
+    actions = [detector.observe(name, {}, "r") for name in ("list", "read", "list", "read")]
+    assert actions == [None, None, None, "hint"], actions
+    assert "list -> read" in detector.describe()
+
+    detector = LoopDetector()
+    assert all(detector.observe("run", {}, str(i)) is None for i in range(6)), "changing results are not a loop"
+    assert detector.wasted == 0
+
+
+def test_parse_json():
+    assert parse_json('{"a": 1}') == {"a": 1}
+    assert parse_json('Here is the plan:\n```json\n{"steps": [1, 2]}\n```\nDone.') == {"steps": [1, 2]}
+    assert parse_json("no json here") is None
+    assert parse_json("") is None
+    assert parse_json("[x] " * (MAX_DECODE_ATTEMPTS + 1) + '{"late": true}') is None  # past the attempt cap
+    start = time.perf_counter()
+    assert parse_json("{" * 200000) is None
+    assert time.perf_counter() - start < 1.0
+
+
+def test_streaming_plan_parser():
+    plan = {"task": "t", "steps": [
+        {"step": 1, "description": "write {braces} and \"quotes\"", "tool": "write_file",
+         "arguments": {"file_path": "a.py", "content": "x = {}\n"}, "expected_outcome": "ok"},
+        {"step": 2, "description": "run", "tool": None, "arguments": {}, "expected_outcome": "ok"},
+    ], "verification": {"final_check": "ok"}}
+    text = json.dumps(plan)
+    parser = StreamingPlanParser()
+    seen = []
+    for i in range(0, len(text), 7):
+        seen.extend(step["step"] for step in parser.feed(text[i:i + 7]))
+    assert seen == [1, 2], seen
+    assert parser.result() == plan
+
+
+# -------------------------------------------------
+#   workspace snapshots
+# -------------------------------------------------
+def test_snapshot_rollback():
+    root = make_workspace({"a.txt": "a", "b.txt": "b", "sub/c.txt": "c", "agent_checkpoint.jsonl": "1\n"})
+    snapshots = SnapshotManager(root, keep=2)
+    snapshot_id = snapshots.take("before")
+    assert snapshot_id
+
+    with open(os.path.join(root, "a.txt"), "a", encoding="utf-8") as f:
+        f.write(" changed in place")  # must not reach the snapshot's copy
+    os.remove(os.path.join(root, "b.txt"))
+    os.makedirs(os.path.join(root, "new", "deep"))
+    with open(os.path.join(root, "new", "deep", "d.txt"), "w", encoding="utf-8") as f:
+        f.write("d")
+    with open(os.path.join(root, "agent_checkpoint.jsonl"), "a", encoding="utf-8") as f:
+        f.write("2\n")
+
+    result = snapshots.rollback(snapshot_id)
+    assert sorted(result["restored"]) == ["a.txt", "b.txt"], result
+    assert result["deleted"] == [os.path.join("new", "deep", "d.txt")], result
+    assert read(os.path.join(root, "a.txt")) == "a" and read(os.path.join(root, "b.txt")) == "b"
+    assert read(os.path.join(root, "sub", "c.txt")) == "c"
+    assert not os.path.exists(os.path.join(root, "new")), "directory created after the snapshot survived"
+    assert read(os.path.join(root, "agent_checkpoint.jsonl")) == "1\n2\n", "excluded file was rolled back"
+
+    for _ in range(3):
+        snapshots.take()
+    assert len(os.listdir(snapshots.root)) == 2, os.listdir(snapshots.root)
+    assert snapshots.rollback(snapshot_id) is None  # pruned
+
+
+# -------------------------------------------------
+#   training data: packing, dedup, conversion
+# -------------------------------------------------
+def test_shard_writer_packing():
+    out_dir = make_workspace({})
+    writer = ShardWriter(out_dir, seq_len=4, dtype=np.uint16, pad_id=0, first_shard=0, shard_rows=2)
+    first, second = np.arange(1, 6, dtype=np.uint16), np.arange(11, 17, dtype=np.uint16)
+    writer.add(first, np.ones(5, dtype=np.uint8))
+    writer.add(second, np.zeros(6, dtype=np.uint8))  # 11 tokens: the second session spills into shard 1
+    writer.flush()
+
+    assert [(s["rows"], s["tokens"], s["sessions"], s["continued"]) for s in writer.shards] == \
+        [(2, 8, 2, False), (1, 3, 0, True)], writer.shards
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"tokenizer": "t", "seq_len": 4, "dtype": "uint16", "pad_id": 0, "shards": writer.shards}, f)
+
+    dataset = PackedDataset(out_dir)
+    assert len(dataset) == 3
+    tokens = np.concatenate([dataset[i][0] for i in range(len(dataset))])
+    masks = np.concatenate([dataset[i][1] for i in range(len(dataset))])
+    assert tokens.tolist() == list(range(1, 6)) + list(range(11, 17)) + [0]  # last row padded
+    assert masks.tolist() == [1] * 5 + [0] * 7
+    assert dataset.offsets(0).tolist() == [0, 5] and dataset.offsets(1).tolist() == [0]
+
+
+def session_line(content: str) -> str:
+    return json.dumps({"format": "canonical", "version": 1, "messages": [
+        {"role": "system", "content": "You are an agent."},
+        {"role": "user", "content": content},
+        {"role": "assistant", "content": "done"},
+    ]})
+
+
+def test_deduplicate():
+    words = " ".join(f"word{i}" for i in range(200))
+    root = make_workspace({"training_data_canonical.jsonl": "\n".join([
+        session_line("create hello.py " + words),
+        session_line("create hello.py " + words + " please"),  # near-duplicate of the first
+        session_line(" ".join(f"other{i}" for i in range(200))),
+    ]) + "\n"})
+
+    report = deduplicate(os.path.join(root, "training_data_canonical.jsonl"), workers=2)
+    assert (report["sessions"], report["kept"], report["removed"], report["clusters"]) == (3, 2, 1, 1), report
+    with open(report["output"], "r", encoding="utf-8") as f:
+        kept = [json.loads(line)["messages"][1]["content"] for line in f]
+    assert not kept[0].endswith("please") and kept[1].startswith("other0"), "the oldest session of a cluster is kept"
+    assert os.path.basename(report["output"]).startswith("dedup_")
+
+
+def test_convert():
+    session = {"format": "canonical", "version": 1, "messages": [
+        {"role": "user", "content": "list files"},
+        {"role": "assistant", "content": "", "tool_calls": [{"id": "c1", "name": "run_shell", "arguments": {"command": "ls"}}]},
+        {"role": "tool", "tool_call_id": "c1", "name": "run_shell", "content": "a.txt"},
+        {"role": "assistant", "content": "a.txt"},
+    ]}
+    openai = render(session, "openai")
+    assert json.loads(openai["messages"][1]["tool_calls"][0]["function"]["arguments"]) == {"command": "ls"}
+    assert openai["messages"][2]["tool_call_id"] == "c1"
+    sharegpt = render(session, "sharegpt")
+    assert [t["from"] for t in sharegpt["conversations"]] == ["human", "function_call", "observation", "gpt"]
+    assert "<tool_call>" in render(session, "chatml")["text"]
+    back = canonicalize(sharegpt)["messages"]
+    assert back[1]["tool_calls"][0]["arguments"] == {"command": "ls"}  # ShareGPT keeps tool calls
+    assert canonicalize(openai)["messages"][1]["tool_calls"][0]["name"] == "run_shell"
+
+    root = make_workspace({})
+    source = os.path.join(root, "sessions.jsonl")
+    with open(source, "w", encoding="utf-8") as f:
+        for i in range(50):
+            f.write(json.dumps(dict(session, session_id=i)) + "\n")
+        f.write("not json\n")
+    shards = plan_shards([source], shard_bytes=1000)
+    assert len(shards) > 1 and shards[0][1] == 0 and shards[-1][2] == os.path.getsize(source)
+    assert all(a[2] == b[1] for a, b in zip(shards, shards[1:])), "shards overlap or leave gaps"
+    with open(source, "rb") as f:
+        data = f.read()
+    assert all(data[end - 1:end] == b"\n" for _, _, end in shards), "a shard ends mid-line"
+
+    report = convert_files([source], os.path.join(root, "out.json"), "canonical", workers=2, json_array=True)
+    assert (report["sessions"], report["errors"]) == (50, 1), report
+    with open(report["output"], "r", encoding="utf-8") as f:
+        assert [s["session_id"] for s in json.load(f)] == list(range(50)), "conversion changed the order"
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"{name[5:]}: OK")
@@ -0,0 +1,234 @@
+# =====================================================
+#          TRAINING LOG ANALYTICS (columnar, vectorized)
+# =====================================================
+# Answers "which tools dominate latency", "how long are sessions" etc.
+# without loading whole logs as Python objects:
+#
+#   1. the JSONL files are cut into newline-aligned byte ranges (the same
+#      shards convert.py uses) and scanned in a process pool
+#   2. each worker turns its sessions into flat NumPy columns: one row per
+#      message (session, role, chars, tool code, duration_ms, error, ts) and
+#      one row per session (messages, start, end)
+#   3. the columns are concatenated (tool names re-coded against one shared
+#      vocabulary) and every aggregate is a bincount / sort / histogram
+#
+# Writes a JSON report and prints the headline numbers.
+import json
+import os
+import time
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from termcolor import colored
+from config import ANALYTICS_HIST_BINS
+from convert import canonicalize, iter_range, plan_shards
+
+ROLES = ["system", "user", "assistant", "tool", "other"]
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+MESSAGE_COLUMNS = {
+    'session'       :   np.int64,
+    'role'          :   np.int8,
+    'chars'         :   np.int32,
+    'tool'          :   np.int32,     # code into the tool vocabulary, -1 if not a tool result
+    'duration_ms'   :   np.float32,   # NaN when not recorded
+    'error'         :   np.bool_,
+    'ts'            :   np.float64,   # NaN when not recorded
+}
+SESSION_COLUMNS = {
+    'messages'      :   np.int32,
+    'started'       :   np.float64,
+    'ended'         :   np.float64,
+}
+
+
+# -------------------------------------------------
+#   worker side: one byte range -> columns
+# -------------------------------------------------
+def number(value) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+
+def scan_shard(job: Tuple[str, int, int]) -> Dict:
+    """Columns of one byte range; tool codes refer to the returned local vocabulary"""
+    path, start, end = job
+    rows = {name: [] for name in MESSAGE_COLUMNS}
+    sessions = {name: [] for name in SESSION_COLUMNS}
+    vocabulary: Dict[str, int] = {}
+    errors = 0
+
+    for line in iter_range(path, start, end):
+        if not line.strip():
+            continue
+        try:
+            session = canonicalize(json.loads(line))
+            messages = session["messages"]
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            errors += 1
+            continue
+
+        index = len(sessions['messages'])
+        call_names = {}
+        for message in messages:
+            role = message.get("role")
+            name = None
+            if role == "assistant":
+                for call in message.get("tool_calls") or []:
+                    call_names[call.get("id")] = call.get("name")
+            elif role == "tool":
+                name = message.get("name") or call_names.get(message.get("tool_call_id")) or "unknown"
+            rows['session'].append(index)
+            rows['role'].append(ROLE_CODES.get(role, ROLE_CODES["other"]))
+            rows['chars'].append(len(str(message.get("content") or "")))
+            rows['tool'].append(vocabulary.setdefault(name, len(vocabulary)) if name else -1)
+            rows['duration_ms'].append(number(message.get("duration_ms")))
+            rows['error'].append(bool(message.get("error")))
+            rows['ts'].append(number(message.get("ts")))
+
+        stamps = [t for t in rows['ts'][-len(messages):] if t == t] if messages else []
+        sessions['messages'].append(len(messages))
+        sessions['started'].append(number(session.get("started_at")) if session.get("started_at") else min(stamps, default=np.nan))
+        sessions['ended'].append(number(session.get("ended_at")) if session.get("ended_at") else max(stamps, default=np.nan))
+
+    return {
+        'messages': {name: np.asarray(values, dtype=MESSAGE_COLUMNS[name]) for name, values in rows.items()},
+        'sessions': {name: np.asarray(values, dtype=SESSION_COLUMNS[name]) for name, values in sessions.items()},
+        'vocabulary': list(vocabulary),
+        'errors': errors,
+    }
+
+
+def merge(parts: List[Dict]) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray], List[str], int]:
+    """Concatenate shard columns in order, re-coding tools against one vocabulary"""
+    vocabulary: Dict[str, int] = {}
+    messages = {name: [] for name in MESSAGE_COLUMNS}
+    sessions = {name: [] for name in SESSION_COLUMNS}
+    offset = 0
+    for part in parts:
+        remap = np.array([vocabulary.setdefault(name, len(vocabulary)) for name in part['vocabulary']] + [-1], dtype=np.int32)
+        for name, column in part['messages'].items():
+            if name == 'session':
+                column = column + offset
+            elif name == 'tool':
+                column = remap[column]  # -1 indexes the trailing -1
+            messages[name].append(column)
+        for name, column in part['sessions'].items():
+            sessions[name].append(column)
+        offset += len(part['sessions']['messages'])
+    return ({name: np.concatenate(c) if c else np.empty(0, MESSAGE_COLUMNS[name]) for name, c in messages.items()},
+            {name: np.concatenate(c) if c else np.empty(0, SESSION_COLUMNS[name]) for name, c in sessions.items()},
+            list(vocabulary), sum(part['errors'] for part in parts))
+
+
+# -------------------------------------------------
+#   aggregates
+# -------------------------------------------------
+def describe(values: np.ndarray) -> Dict:
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return {'count': 0}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {'count': int(len(values)), 'mean': round(float(values.mean()), 3), 'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3), 'max': round(float(values.max()), 3), 'total': round(float(values.sum()), 3)}
+
+
+def histogram(values: np.ndarray, bins: int = ANALYTICS_HIST_BINS) -> Dict:
+    """Log-spaced histogram (lengths and timings are heavy-tailed)"""
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return {'edges': [], 'counts': []}
+    top = max(float(values.max()), 1.0)
+    edges = np.concatenate(([0.0], np.geomspace(1.0, top + 1, bins)))
+    counts, edges = np.histogram(values, bins=edges)
+    return {'edges': [round(float(e), 1) for e in edges], 'counts': counts.tolist()}
+
+
+def tool_table(tool: np.ndarray, duration: np.ndarray, error: np.ndarray, chars: np.ndarray, vocabulary: List[str]) -> List[Dict]:
+    """Per-tool calls, errors, result size and latency, sorted by total time"""
+    mask = tool >= 0
+    tool, duration, error, chars = tool[mask], duration[mask], error[mask], chars[mask]
+    n = len(vocabulary)
+    timed = ~np.isnan(duration)
+    calls = np.bincount(tool, minlength=n)
+    errors = np.bincount(tool, weights=error, minlength=n)
+    result_chars = np.bincount(tool, weights=chars, minlength=n)
+    timed_calls = np.bincount(tool[timed], minlength=n)
+    total_ms = np.bincount(tool[timed], weights=duration[timed], minlength=n)
+
+    # Percentiles per tool: sort by (tool, duration) once, then slice each group
+    order = np.lexsort((duration[timed], tool[timed]))
+    grouped = duration[timed][order]
+    bounds = np.concatenate(([0], np.cumsum(timed_calls)))
+    all_ms = max(float(total_ms.sum()), 1e-9)
+
+    table = []
+    for code in np.argsort(-total_ms, kind='stable'):
+        group = grouped[bounds[code]:bounds[code + 1]]
+        table.append({
+            'tool': vocabulary[code],
+            'calls': int(calls[code]),
+            'error_rate': round(float(errors[code] / max(calls[code], 1)), 3),
+            'mean_result_chars': int(result_chars[code] / max(calls[code], 1)),
+            'total_ms': round(float(total_ms[code]), 1),
+            'share_of_tool_time': round(float(total_ms[code]) / all_ms, 3),
+            'p50_ms': round(float(np.percentile(group, 50)), 1) if len(group) else None,
+            'p95_ms': round(float(np.percentile(group, 95)), 1) if len(group) else None,
+        })
+    return table
+
+
+def analyze(paths: List[str], output_path: Optional[str] = None, workers: Optional[int] = None) -> Dict:
+    """Scan training logs into columns and write the aggregate report"""
+    if not paths:
+        print(colored("[ x ]    ", "red"), "No training logs to analyze")
+        return {}
+    start = time.perf_counter()
+    shards = plan_shards(paths)
+    with Pool(processes=min(workers or os.cpu_count(), max(len(shards), 1))) as pool:
+        parts = pool.map(scan_shard, shards, chunksize=1)
+    messages, sessions, vocabulary, errors = merge(parts)
+    scanned = time.perf_counter() - start
+
+    role, chars, ts, session = messages['role'], messages['chars'], messages['ts'], messages['session']
+    # Time since the previous message of the same session: for assistant
+    # messages this is roughly model latency, for tool messages tool latency
+    gap = np.full(len(ts), np.nan)
+    if len(ts) > 1:
+        same = session[1:] == session[:-1]
+        gap[1:][same] = (ts[1:] - ts[:-1])[same]
+
+    report = {
+        'inputs': paths,
+        'sessions': int(len(sessions['messages'])),
+        'messages': int(len(role)),
+        'parse_errors': int(errors),
+        'messages_per_session': describe(sessions['messages'].astype(np.float64)),
+        'session_duration_s': describe(sessions['ended'] - sessions['started']),
+        'tool_calls_per_session': describe(np.bincount(session[messages['tool'] >= 0], minlength=len(sessions['messages'])).astype(np.float64)),
+        'roles': {
+            name: {'messages': int(count), 'chars': int(total)}
+            for name, count, total in zip(ROLES, np.bincount(role, minlength=len(ROLES)),
+                                          np.bincount(role, weights=chars, minlength=len(ROLES)))
+            if count
+        },
+        'assistant_gap_s': describe(gap[role == ROLE_CODES["assistant"]]),
+        'tools': tool_table(messages['tool'], messages['duration_ms'], messages['error'], chars, vocabulary),
+        'histograms': {
+            'messages_per_session': histogram(sessions['messages']),
+            'content_chars': histogram(chars),
+            'tool_duration_ms': histogram(messages['duration_ms']),
+        },
+        'scan_s': round(scanned, 3),
+        'duration_s': round(time.perf_counter() - start, 3),
+    }
+
+    output_path = output_path or os.path.join(os.path.dirname(os.path.abspath(paths[0])), "training_analytics.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(colored("[ x ]    ", "green"), f"{report['sessions']} sessions, {report['messages']} messages "
+                                         f"in {report['duration_s']}s -> {output_path}")
+    for row in report['tools'][:10]:
+        print(f"    {row['tool']:<24} {row['calls']:>8} calls  {row['share_of_tool_time']:>6.1%} of tool time  "
+              f"p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  errors {row['error_rate']:.1%}")
+    return report
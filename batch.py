@@ -0,0 +1,178 @@
+# =====================================================
+#          HEADLESS BATCH TASK RUNNER
+# =====================================================
+# Runs Agent.run_task over a JSONL task file on a pool of workers.
+#
+# Task file, one JSON object per line:
+#   {"id": "task-001", "task": "Create hello.py that prints hi", "model": "qwen2.5:7b"}
+# "id" defaults to the line number and "model" to the runner's model.
+#
+# Each task gets a fresh Agent (own conversation) and its own workspace
+# under <output_dir>/<id> (id made filesystem-safe); its tools cannot reach
+# outside that directory. --resume re-runs every task that has not passed
+# yet. Results are appended to <output_dir>/results.jsonl
+# as soon as each task finishes, so an interrupted run keeps what it did.
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+from termcolor import colored
+from agent import Agent
+from config import ALLOWED_ROOT
+from profiles import merge_usage, usage_report
+from tool_pool import size_tool_pool
+
+DEFAULT_MODEL = "qwen2.5:7b"
+
+
+def load_tasks(task_file: str) -> List[Dict]:
+    """Read tasks from a JSONL file, skipping blank and comment lines"""
+    tasks = []
+    with open(task_file, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                task = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(colored("[ x ]    ", "red"), f"Skipping line {line_no}: {e}")
+                continue
+            if not task.get('task'):
+                print(colored("[ x ]    ", "red"), f"Skipping line {line_no}: missing 'task'")
+                continue
+            task.setdefault('id', f"task-{line_no:05d}")
+            tasks.append(task)
+    return tasks
+
+
+def completed_task_ids(results_file: str) -> set:
+    """Ids of tasks that passed in a results file (--resume retries failed and errored ones)"""
+    done = set()
+    if os.path.exists(results_file):
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record.get('status') == 'passed':
+                        done.add(record['id'])
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    continue
+    return done
+
+
+def task_dir_name(task_id) -> str:
+    """A single safe path component for a task id ("../x" can't escape the output dir)"""
+    task_id = str(task_id)
+    safe = re.sub(r"[^\w.-]", "_", task_id).strip(".")
+    if safe != task_id or not safe:
+        # keep ids that only differ in unsafe characters apart
+        safe = f"{safe or 'task'}-{hashlib.sha1(task_id.encode('utf-8')).hexdigest()[:8]}"
+    return safe
+
+
+class BatchRunner:
+    def __init__(self, output_dir=None, model=DEFAULT_MODEL, workers=2):
+        self.output_dir = output_dir or os.path.join(ALLOWED_ROOT, "batch", datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self.model = model
+        self.workers = workers
+        self.results_file = os.path.join(self.output_dir, "results.jsonl")
+        self.write_lock = threading.Lock()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def run_one(self, task: Dict) -> Dict:
+        """Run a single task in its own workspace and return a result record"""
+        workspace = os.path.join(self.output_dir, task_dir_name(task['id']))
+        os.makedirs(workspace, exist_ok=True)
+
+        record = {
+            'id': task['id'],
+            'task': task['task'],
+            'model': task.get('model', self.model),
+            'workspace': workspace,
+            'started_at': datetime.now().isoformat(),
+        }
+        start = time.perf_counter()
+
+        try:
+            agent = Agent(model=record['model'], workspace=workspace, interactive=False)
+            agent.scheduling_class = 'batch'  # yield to interactive sessions on the shared server
+            plan = agent.run_task(task['task']) or {}
+            steps = plan.get('steps', [])
+            verification = agent.last_verification or {}
+
+            record.update({
+                'status': 'passed' if verification.get('verified') else 'failed',
+                'steps_total': len(steps),
+                'steps_completed': sum(1 for s in steps if str(s.get('status', '')).startswith('completed')),
+                'verification': verification.get('explanation'),
+                'usage': agent.usage_report(),
+                'verification_stats': dict(agent.verification_stats),
+            })
+        except Exception as e:
+            record.update({
+                'status': 'error',
+                'error': str(e),
+                'traceback': traceback.format_exc(),
+            })
+
+        record['duration_s'] = round(time.perf_counter() - start, 3)
+        record['finished_at'] = datetime.now().isoformat()
+        self.write_result(record)
+        return record
+
+    def write_result(self, record: Dict):
+        with self.write_lock:
+            with open(self.results_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+
+    def run(self, tasks: List[Dict], resume=False) -> Dict:
+        """Run all tasks on the worker pool and return a summary"""
+        if resume:
+            done = completed_task_ids(self.results_file)
+            tasks = [t for t in tasks if t['id'] not in done]
+            print(colored("[ x ]    ", "green"), f"Resuming: {len(done)} tasks already passed")
+
+        print(colored("[ x ]    ", "green"), f"Running {len(tasks)} tasks on {self.workers} workers -> {self.results_file}")
+        size_tool_pool(self.workers)
+
+        # Nothing in a batch may wait for a human: any stray input() gets EOF
+        stdin, sys.stdin = sys.stdin, open(os.devnull, 'r')
+        counts = {'passed': 0, 'failed': 0, 'error': 0}
+        records = []
+        start = time.perf_counter()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self.run_one, t): t for t in tasks}
+                for n, future in enumerate(as_completed(futures), 1):
+                    record = future.result()
+                    records.append(record)
+                    counts[record['status']] += 1
+                    color = "green" if record['status'] == 'passed' else "red"
+                    print(colored(f"[ {n}/{len(tasks)} ]  ", color), f"{record['id']}: {record['status']} ({record['duration_s']}s)")
+        finally:
+            sys.stdin.close()
+            sys.stdin = stdin
+
+        summary = {
+            'tasks': len(tasks),
+            **counts,
+            'usage': usage_report(merge_usage(r.get('usage') for r in records)),
+            'step_checks': {kind: sum((r.get('verification_stats') or {}).get(kind, 0) for r in records) for kind in ('rule', 'llm')},
+            'duration_s': round(time.perf_counter() - start, 3),
+            'results_file': self.results_file,
+        }
+        with open(os.path.join(self.output_dir, "summary.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+        print(colored("[ x ]    ", "green"), f"Done: {counts['passed']} passed, {counts['failed']} failed, {counts['error']} errors in {summary['duration_s']}s")
+        return summary
@@ -0,0 +1,155 @@
+# =====================================================
+#          MODEL CATALOG (Ollama HTTP API)
+# =====================================================
+# One place to ask "which models are installed and what are they?".
+# /api/tags is polled at most every MODEL_CATALOG_TTL seconds and reduced to
+# a digest. /api/show is called once per model and its metadata is cached in
+# memory and on disk until that digest changes (a model pulled, removed or
+# updated).
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import requests
+from config import (
+    OLLAMA_BASE_URL,
+    MODEL_CATALOG_PATH,
+    MODEL_CATALOG_TTL,
+    NUM_CTX_CAP,
+    NUM_PREDICT_CAP,
+)
+
+
+class ModelCatalog:
+    def __init__(self, base_url=OLLAMA_BASE_URL, cache_path=MODEL_CATALOG_PATH, ttl=MODEL_CATALOG_TTL):
+        self.base_url = base_url
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.digest = None
+        self.tags: List[Dict] = []        # raw /api/tags entries
+        self.details: Dict[str, Dict] = {}  # model name -> parsed /api/show
+        self.load_cache()
+
+    # -------------------------------------------------
+    #   disk cache
+    # -------------------------------------------------
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            self.digest = cache.get("digest")
+            self.tags = cache.get("tags", [])
+            self.details = cache.get("details", {})
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp = self.cache_path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"digest": self.digest, "tags": self.tags, "details": self.details}, f)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass  # cache is only an optimisation
+
+    # -------------------------------------------------
+    #   API
+    # -------------------------------------------------
+    def refresh(self, force=False):
+        """Re-read /api/tags (at most every ttl seconds); drops cached details if it changed"""
+        with self.lock:
+            if not force and self.checked_at and time.time() - self.checked_at < self.ttl:
+                return
+            r = requests.get(f"{self.base_url}/api/tags", timeout=60)
+            r.raise_for_status()
+            tags = r.json().get("models", [])
+            digest = hashlib.sha256(json.dumps(
+                sorted((m.get("name", ""), m.get("digest", "")) for m in tags)
+            ).encode()).hexdigest()
+
+            if digest != self.digest:
+                self.digest = digest
+                self.tags = tags
+                self.details = {}
+                self.save_cache()
+            self.checked_at = time.time()
+
+    def models(self) -> List[str]:
+        self.refresh()
+        return [m.get("name", "") for m in self.tags]
+
+    def resolve(self, model: str) -> Optional[str]:
+        """Installed name for model ('qwen2.5' matches 'qwen2.5:latest'), or None"""
+        names = self.models()
+        if model in names:
+            return model
+        base = model.split(":")[0]
+        return next((n for n in names if n.startswith(base)), None)
+
+    def info(self, model: str) -> Dict:
+        """
+        Metadata for an installed model:
+            {"name", "family", "parameter_size", "quantization", "context_length", "size"}
+        Empty dict if the model isn't installed.
+        """
+        name = self.resolve(model)
+        if not name:
+            return {}
+
+        with self.lock:
+            if name in self.details:
+                return self.details[name]
+
+        r = requests.post(f"{self.base_url}/api/show", json={"model": name}, timeout=60)
+        r.raise_for_status()
+        show = r.json()
+        details = show.get("details", {})
+        model_info = show.get("model_info", {})
+        context_length = next((v for k, v in model_info.items() if k.endswith(".context_length")), None)
+        tag = next((m for m in self.tags if m.get("name") == name), {})
+
+        info = {
+            "name": name,
+            "family": details.get("family"),
+            "parameter_size": details.get("parameter_size"),
+            "quantization": details.get("quantization_level"),
+            "context_length": context_length,
+            "size": tag.get("size"),
+        }
+        with self.lock:
+            self.details[name] = info
+            self.save_cache()
+        return info
+
+    def tuned_options(self, model: str) -> Dict:
+        """
+        num_ctx / num_predict sized to the model. num_ctx is fixed per model on
+        purpose: changing it between calls makes Ollama reload the model.
+        """
+        try:
+            context_length = self.info(model).get("context_length")
+        except requests.exceptions.RequestException:
+            return {}
+        if not context_length:
+            return {}
+        num_ctx = min(int(context_length), NUM_CTX_CAP)
+        return {"num_ctx": num_ctx, "num_predict": min(NUM_PREDICT_CAP, num_ctx // 4)}
+
+
+_catalogs: Dict[str, ModelCatalog] = {}
+
+
+def get_catalog(base_url: str = OLLAMA_BASE_URL) -> ModelCatalog:
+    """Process-wide catalog per Ollama server, shared by every Agent"""
+    if base_url not in _catalogs:
+        cache_path = MODEL_CATALOG_PATH
+        if base_url != OLLAMA_BASE_URL:
+            root, ext = os.path.splitext(MODEL_CATALOG_PATH)
+            cache_path = f"{root}_{hashlib.sha1(base_url.encode()).hexdigest()[:8]}{ext}"
+        _catalogs[base_url] = ModelCatalog(base_url=base_url, cache_path=cache_path)
+    return _catalogs[base_url]
@@ -4,45 +4,32 @@ import sys
 import os 
 import subprocess
 import time 
+import threading
 from ollama import chat
 from termcolor import colored
+from config import OLLAMA_BASE_URL
+from catalog import get_catalog
 
-OLLAMA_BASE_URL = "http://localhost:11434"
 OLLAMA_API_URL  = f"{OLLAMA_BASE_URL}/v1/chat/completions"
 MODEL           = "deepseek-r1:8b" # default model to use for the agent. You can change this to any model you have available in Ollama, or pull new models as needed.
 
+KEEP_ALIVE          = "30m"   # how long Ollama keeps a model loaded after a request
+KEEP_ALIVE_INTERVAL = 600     # seconds between keep-alive pings in long idle sessions
+
 # Getting model names for reference of the current installation of ollama.
 def get_available_models():
-    # Running "Ollama list" command in terminal and capturing the output to see what mdeols are there
+    """Installed models from the catalog (HTTP /api/tags, cached) with their metadata printed"""
     try:
-        models_list = subprocess.run(["ollama","list"], capture_output=True, text=True)
-        if models_list.returncode == 0:
-            print(colored("[ x ]    ","green"), "Available models in Ollama:")
-            print(models_list.stdout)
-            lines = models_list.stdout.strip().split("\n")
-            models = []
-            for line in lines[1:]:
-                if line.strip():
-                    model_name = line.split()[0]
-                    models.append(model_name)
-            # print(colored("[ x ]    ","green"), f"Parsed models: {models}")
-            return models   
-        elif models_list.returncode != 0:
-            print(colored("[ x ]    ","red"), f"Error running 'ollama list': {models_list.stderr}")
-            return []
-        
-        # Parse the output to extract model names
-        lines = models_list.strip().split("\n")
-        models = []
-        # Skip header line (first line) and process the rest
-        for line in lines[1:]:
-            if line.strip(): # Skip empty lines
-                # Split by whitespaces and get the first column as mdoel name
-                model_name = line.split()[0]
-                models.append(model_name)
-        return 
-    except FileNotFoundError:
-        print(colored("[ x ]    ","red"), "Ollama command not found. Please Ensure Ollama is installaed")
+        catalog = get_catalog()
+        models = catalog.models()
+        print(colored("[ x ]    ","green"), "Available models in Ollama:")
+        for name in models:
+            info = catalog.info(name)
+            print(f"    {name:<30} {info.get('parameter_size') or '?':>8}  {info.get('quantization') or '?':<8}  ctx {info.get('context_length') or '?'}")
+        return models
+    except requests.exceptions.ConnectionError:
+        print(colored("[ x ]    ","red"), "Ollama server is not running. Please start the Ollama server and try again.")
+        return []
     except Exception as e:
         print(colored("[ x ]    ","red"), f"Error getting models list from Ollama: {e}")
         return []
@@ -80,14 +67,10 @@ def select_model_from_list(models):
 def check_ollama_ready(selected_model="deepseek-r1:8b"):
     """Check if Ollama is running and the required mdoel is available."""
     try:
-        # Check server health
-        r = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=60)
-        r.raise_for_status()
-        models = r.json().get("models",[])
-        model_names = [m.get("name","") for m in models]
-        model_exists = selected_model in model_names or any(
-            name.startswith(selected_model.split(":")[0]) for name in model_names
-        )
+        # Check server health (shares the cached catalog, no second round trip)
+        catalog = get_catalog()
+        model_names = catalog.models()
+        model_exists = catalog.resolve(selected_model) is not None
         if not model_exists:
             print(colored("[ x ]    ","red"),f"Model '{selected_model}' not found in Ollama. Available models: {model_names}")
             pull_model = input(colored("[ x ]    ","green"), f"Pull {selected_model}??: (y/N) ").strip().lower()
@@ -96,6 +79,7 @@ def check_ollama_ready(selected_model="deepseek-r1:8b"):
                     print(colored("[ x ]    ","green"),f"Pulling model {selected_model} from Ollama...This may take some time.")
                     pull = subprocess.run(["ollama", "pull", selected_model], capture_output=True, text=True)
                     if pull.returncode == 0:
+                        catalog.refresh(force=True)
                         print(colored("[ x ]    ","green"),f"Model {selected_model} pulled successfully.")
                         return True
                     else:
@@ -178,3 +162,98 @@ def stream_generate(model, messages,tools, think=False, stream=True, num_predict
         "content": content,
         "tool_calls":tool_calls_detected
     }   
+
+
+# =====================================================
+#          MODEL PRELOAD / WARM-UP
+# =====================================================
+def load_options(model, host=None):
+    """
+    The num_ctx the agent will use for this model: a load or ping with another
+    num_ctx (or none) makes Ollama reload the model on the next real call
+    """
+    num_ctx = get_catalog(host or OLLAMA_BASE_URL).tuned_options(model).get("num_ctx")
+    return {"num_ctx": num_ctx} if num_ctx else {}
+
+
+def preload_model(model, keep_alive=KEEP_ALIVE, host=None):
+    """
+    Load a model into memory and run a one-token warm-up generation.
+    host: the Ollama server the agent talks to (default OLLAMA_BASE_URL)
+    Returns timings in seconds: {"model", "load_s", "warmup_s", "total_s"} or {"model", "error"}
+    """
+    base_url = host or OLLAMA_BASE_URL
+    start = time.perf_counter()
+    try:
+        options = load_options(model, base_url)
+        # An empty prompt only loads the model (and pins it for keep_alive)
+        r = requests.post(f"{base_url}/api/generate",
+                          json={"model": model, "keep_alive": keep_alive, "options": options},
+                          timeout=600)
+        r.raise_for_status()
+        load_s = r.json().get("load_duration", 0) / 1e9
+        loaded = time.perf_counter()
+
+        # Tiny generation so the first real chat doesn't pay for graph/kv-cache setup
+        r = requests.post(f"{base_url}/api/generate",
+                          json={"model": model, "prompt": "Hi", "stream": False,
+                                "keep_alive": keep_alive, "options": dict(options, num_predict=1)},
+                          timeout=600)
+        r.raise_for_status()
+        done = time.perf_counter()
+        return {
+            "model": model,
+            "load_s": round(load_s or loaded - start, 2),
+            "warmup_s": round(done - loaded, 2),
+            "total_s": round(done - start, 2),
+        }
+    except requests.exceptions.RequestException as e:
+        return {"model": model, "error": str(e)}
+
+
+def warm_up_models(models, keep_alive=KEEP_ALIVE, host=None):
+    """Preload models in a background thread, printing load times as they finish"""
+    def worker():
+        for model in models:
+            timing = preload_model(model, keep_alive, host=host)
+            if "error" in timing:
+                print(colored("\n[ x ]    ","red"), f"Warm-up of {model} failed: {timing['error']}")
+            else:
+                print(colored("\n[ x ]    ","green"), f"{model} ready: loaded in {timing['load_s']}s, warm-up {timing['warmup_s']}s")
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    return thread
+
+
+class KeepAlivePinger:
+    """Periodically re-arms keep_alive so a model stays loaded through long idle periods"""
+
+    def __init__(self, models, interval=KEEP_ALIVE_INTERVAL, keep_alive=KEEP_ALIVE, host=None):
+        self.models = list(models)
+        self.base_url = host or OLLAMA_BASE_URL
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def ping(self):
+        for model in self.models:
+            try:
+                requests.post(f"{self.base_url}/api/generate",
+                              json={"model": model, "keep_alive": self.keep_alive,
+                                    "options": load_options(model, self.base_url)},
+                              timeout=600)
+            except requests.exceptions.RequestException:
+                pass  # server down or busy, try again next interval
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.ping()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,91 @@
+# =====================================================
+#          APPEND-ONLY CHECKPOINT JOURNAL
+# =====================================================
+# One JSON record per line, never rewritten. A run looks like:
+#
+#   {"type": "task",  "run_id": ..., "task": ...}
+#   {"type": "plan",  "plan": {...}, "next_step": 0, "messages": [...]}
+#   {"type": "step",  "index": 0, "status": "completed", "result": ..., "next_step": 1, "messages": [...]}
+#   ...
+#   {"type": "done",  "verification": {...}, "messages": [...]}
+#
+# "messages" holds only the conversation messages appended since the previous
+# record, so replaying a run rebuilds the conversation exactly.
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class CheckpointJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self.run_id = None
+
+    def append(self, record: Dict):
+        """Append one record and make sure it hits the disk"""
+        record.setdefault("run_id", self.run_id)
+        record.setdefault("ts", datetime.now().isoformat())
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, task: str) -> str:
+        """Begin a new run; returns its id"""
+        self.run_id = uuid.uuid4().hex[:12]
+        self.append({"type": "task", "task": task})
+        return self.run_id
+
+    def records(self) -> List[Dict]:
+        """All records of the most recent run"""
+        if not os.path.exists(self.path):
+            return []
+
+        run = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash mid-write
+                if record.get("type") == "task":
+                    run = []
+                run.append(record)
+        return run
+
+    def load(self) -> Optional[Dict]:
+        """
+        Rebuild the state of the most recent run
+
+        Returns None if there is no run, otherwise:
+            {"run_id", "task", "plan", "next_step", "conversation", "finished"}
+        """
+        records = self.records()
+        if not records or records[0].get("type") != "task":
+            return None
+
+        state = {
+            "run_id": records[0]["run_id"],
+            "task": records[0]["task"],
+            "plan": None,
+            "next_step": 0,
+            "conversation": [],
+            "finished": False,
+        }
+        for record in records:
+            state["conversation"].extend(record.get("messages", []))
+
+            if record["type"] == "plan":
+                state["plan"] = record["plan"]
+                state["next_step"] = record.get("next_step", 0)
+            elif record["type"] == "step" and state["plan"]:
+                steps = state["plan"].get("steps", [])
+                if record["index"] < len(steps):
+                    steps[record["index"]]["status"] = record["status"]
+                state["next_step"] = record["next_step"]
+            elif record["type"] == "done":
+                state["finished"] = True
+
+        return state
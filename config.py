@@ -1,5 +1,130 @@
 # config.py
 import os
 
-ALLOWED_ROOT = r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-# Add any other configuration variables here
\ No newline at end of file
+# Every path below lives under ALLOWED_ROOT; AGENT_ROOT overrides it (tests point it at a temp dir)
+ALLOWED_ROOT = os.environ.get("AGENT_ROOT", r"C:\Users\Administrator\Desktop\code\swstk\workspace")
+# Add any other configuration variables here
+
+# Server mode (server.py)
+SERVER_HOST             = "127.0.0.1"
+SERVER_PORT             = 8765
+SESSIONS_ROOT           = os.path.join(ALLOWED_ROOT, "sessions")  # one workspace per session
+MAX_SESSIONS            = 64        # oldest idle session is evicted past this
+SESSION_IDLE_TIMEOUT    = 60 * 60   # seconds before an idle session is dropped
+MAX_CONCURRENT_REQUESTS = 2         # concurrent process_message calls hitting Ollama
+QUEUE_TIMEOUT           = 30        # seconds a request waits for a slot before a 'Server busy' error event
+MAX_MESSAGE_BYTES       = 1 << 20   # largest request body / WebSocket message the server accepts
+
+# Large tool results (results.py)
+RESULTS_ROOT            = os.path.join(ALLOWED_ROOT, ".results")  # content-addressed blob store
+RESULT_PREVIEW_CHARS    = 2000      # results longer than this are spilled to disk
+RESULT_PAGE_CHARS       = 4000      # default page size for read_result (pages are never re-spilled)
+RESULT_RETENTION_DAYS   = 7         # stored results untouched for this long are deleted
+
+# Workspace code search (search.py)
+SEARCH_INDEX_PATH       = os.path.join(ALLOWED_ROOT, ".search_index.db")
+SEARCH_SKIP_DIRS        = {".git", ".results", ".snapshots", "__pycache__", "node_modules", "venv", ".venv"}
+SEARCH_MAX_FILE_BYTES   = 1024 * 1024   # bigger files are not indexed
+SEARCH_REFRESH_INTERVAL = 2.0           # seconds between incremental rescans
+
+# Ollama server and model catalog (catalog.py)
+OLLAMA_BASE_URL         = "http://localhost:11434"
+MODEL_CATALOG_PATH      = os.path.join(ALLOWED_ROOT, ".model_catalog.json")
+MODEL_CATALOG_TTL       = 30        # seconds before /api/tags is checked again
+NUM_CTX_CAP             = 8192      # never ask for more context than this (VRAM)
+NUM_PREDICT_CAP         = 2048
+
+# Generation options per LLM call type (profiles.py). num_ctx always comes
+# from the catalog and is the same for every profile (changing it reloads
+# the model); num_predict is fixed or a share of num_ctx, capped at NUM_PREDICT_CAP
+GENERATION_PROFILES     = {
+    'interactive'       :   {'num_predict_share': 0.25},
+    'planning'          :   {'num_predict_share': 0.5, 'temperature': 0.2},
+    'verification'      :   {'num_predict': 48, 'temperature': 0.0, 'stop': ["\n\n"]},  # YES/NO + one sentence
+}
+
+# Shared LLM request scheduler (scheduler.py)
+SCHED_MAX_CONCURRENT    = 2         # chat requests in flight against the server (match OLLAMA_NUM_PARALLEL)
+SCHED_PER_MODEL_LIMIT   = 2         # ... of which at most this many for one model
+SCHED_AGING_S           = 30        # a waiting request moves up one priority class per this many seconds
+SCHED_HOT_STREAK        = 8         # max consecutive same-model grants while other models wait
+
+# Hedged / speculative LLM requests (hedge.py)
+HEDGE_ENABLED           = False
+HEDGE_FALLBACK_MODEL    = None      # e.g. "qwen2.5:3b"; None = same model
+HEDGE_FALLBACK_HOST     = None      # e.g. "http://gpu-box-2:11434"; None = same server
+HEDGE_SAME_SERVER       = False     # without a fallback host, hedge on the same server anyway (doubles its load)
+HEDGE_MIN_DELAY         = 2.0       # never hedge sooner than this (seconds)
+HEDGE_DEFAULT_DELAY     = 30.0      # hedge delay until enough latencies are known (streamed calls: until the first token)
+HEDGE_MIN_SAMPLES       = 10        # latencies needed before the p95 is trusted
+SPECULATIVE_STEPS       = False     # run the next read-only plan step while the LLM verifies this one
+
+# Persistent conversations (store.py)
+CONVERSATION_DB_PATH    = os.path.join(ALLOWED_ROOT, ".conversations.db")
+CHARS_PER_TOKEN         = 4         # rough estimate used to fit a resumed tail into num_ctx
+
+# Long-term memory over past sessions (memory.py)
+MEMORY_INDEX_PATH       = os.path.join(ALLOWED_ROOT, ".memory_index.db")
+MEMORY_EMBED_MODEL      = None      # e.g. "nomic-embed-text" to rerank BM25 hits with local embeddings
+MEMORY_CHUNK_CHARS      = 1500      # long messages are indexed in chunks of this size
+MEMORY_REFRESH_INTERVAL = 5.0       # seconds between incremental re-indexing
+
+# Workspace snapshots before plan steps (snapshot.py)
+SNAPSHOTS_ENABLED       = True
+SNAPSHOT_DIR_NAME       = ".snapshots"
+SNAPSHOT_KEEP           = 5         # older snapshots are deleted
+SNAPSHOT_SKIP_DIRS      = SEARCH_SKIP_DIRS | {      # other agents' workspaces and tool output dirs are never rolled back
+    "sessions", "batch", "replay", "datasets",
+}
+SNAPSHOT_EXCLUDE        = [         # agent bookkeeping and data tool output that must survive a rollback
+    "agent_checkpoint.jsonl", "agent_plan.json", "training_data_*", "dedup_*", "training_analytics*.json",
+    ".*.db", ".*.db-*", ".model_catalog*.json", "*.rollback.tmp", ".write_*.tmp",
+]
+
+# Packed fine-tuning dataset (dataset.py)
+DATASET_ROOT            = os.path.join(ALLOWED_ROOT, "datasets", "packed")
+DATASET_TOKENIZER       = "Qwen/Qwen2.5-7B-Instruct"   # Hugging Face tokenizer with a chat template
+DATASET_SEQ_LEN         = 4096      # tokens per packed row
+DATASET_SHARD_ROWS      = 4096      # rows per shard file
+
+# Near-duplicate session removal (dedup.py)
+DEDUP_THRESHOLD         = 0.85      # estimated Jaccard similarity at which sessions count as duplicates
+DEDUP_NUM_PERM          = 128       # MinHash permutations per signature
+DEDUP_SHINGLE           = 5         # words per shingle
+
+# Training log conversion (convert.py)
+CONVERT_SHARD_BYTES     = 32 * 1024 * 1024  # input bytes per parallel conversion job
+
+# Training log analytics (analytics.py)
+ANALYTICS_HIST_BINS     = 20        # log-spaced histogram buckets
+
+# Reuse of verified plans for similar tasks (plan_library.py)
+PLAN_LIBRARY_ENABLED    = True
+PLAN_LIBRARY_PATH       = os.path.join(ALLOWED_ROOT, ".plan_library.db")
+PLAN_REUSE_THRESHOLD    = 0.9       # task similarity at which a stored plan is reused without a planning call
+PLAN_ADAPT_THRESHOLD    = 0.6       # similarity at which the model adapts a stored plan instead of planning anew
+
+# Tool loop detection in process_message (loop_detector.py)
+LOOP_MAX_PERIOD         = 3         # longest cycle of tool calls recognised (A, A-B, A-B-C)
+LOOP_HINT_AFTER         = 1         # wasted iterations before the model is told it is looping
+LOOP_STOP_AFTER         = 2         # wasted iterations after the hint before the loop is cut
+
+# Isolated tool worker processes (tool_pool.py)
+TOOL_POOL_ENABLED       = True
+TOOL_POOL_SIZE          = 2         # workers per concurrently running agent (a tool call plus a speculative read);
+                                    # the server and batch runs size the pool for their concurrency
+TOOL_POOL_WAIT          = 60        # seconds a call waits for a free worker before it fails
+TOOL_TIMEOUT            = 120       # wall-clock seconds per call before the worker is killed and replaced
+TOOL_CPU_SECONDS        = 60        # CPU seconds per call (RLIMIT_CPU, POSIX only)
+TOOL_LONG_TIMEOUTS      = {         # tools that legitimately run longer: (wall-clock, CPU) seconds
+    "create_and_setup_venv": (900, 600),   # venv + pip installs
+}
+TOOL_MEMORY_MB          = 4096      # address space per worker (RLIMIT_AS, POSIX only); lifted for the commands
+                                    # tools start, as Node/JVM reserve more address space than that at startup
+TOOL_WORKER_MAX_CALLS   = 200       # calls before a worker is replaced by a fresh one
+TOOL_POOL_IN_PROCESS    = {         # tools that use the agent's in-memory indexes stay in process
+    "read_result", "search_workspace", "recall",
+}
+
+# Bulk read_files / write_files tools
+BULK_IO_WORKERS         = 8         # files read or staged concurrently
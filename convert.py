@@ -0,0 +1,243 @@
+# =====================================================
+#          TRAINING LOG FORMAT CONVERTER
+# =====================================================
+# TrainingDataLogger always writes one lossless "canonical" session per
+# line (training_data_canonical.jsonl):
+#
+#   {"format": "canonical", "version": 1, "session_id": ..., "started_at": ..., "ended_at": ...,
+#    "messages": [
+#      {"role": "system" | "user" | "assistant" | "tool", "content": ..., "ts": ...,
+#       "tool_calls": [{"id", "name", "arguments": {...}}],          # assistant
+#       "tool_call_id": ..., "name": ..., "duration_ms": ..., "error": bool}  # tool
+#    ]}
+#
+# Every other format is rendered from it on demand. Old OpenAI/ShareGPT
+# logs are accepted as input too (they stay as lossy as they were written).
+# Large inputs are cut into newline-aligned byte ranges ("shards") that a
+# process pool converts in parallel; the output keeps the input order.
+import json
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from termcolor import colored
+from config import CONVERT_SHARD_BYTES
+
+CANONICAL_VERSION = 1
+
+SHAREGPT_TO_ROLE = {
+    "human": "user",
+    "gpt": "assistant",
+    "system": "system",
+    "observation": "tool",
+    "function_call": "assistant",
+}
+
+
+def parse_arguments(arguments):
+    if isinstance(arguments, str):
+        try:
+            return json.loads(arguments)
+        except json.JSONDecodeError:
+            return arguments
+    return arguments
+
+
+# -------------------------------------------------
+#   any format -> canonical
+# -------------------------------------------------
+def canonicalize(example: Dict) -> Dict:
+    """Canonical session from a canonical, OpenAI or ShareGPT example"""
+    if example.get("format") == "canonical":
+        return example
+
+    messages = []
+    if "messages" in example:
+        for message in example["messages"]:
+            message = dict(message)
+            if message.get("tool_calls"):
+                message["tool_calls"] = [{
+                    "id": call.get("id"),
+                    "name": call.get("function", {}).get("name"),
+                    "arguments": parse_arguments(call.get("function", {}).get("arguments")),
+                } for call in message["tool_calls"]]
+            messages.append(message)
+    else:
+        if example.get("system"):
+            messages.append({"role": "system", "content": example["system"]})
+        for turn in example.get("conversations", []):
+            role = SHAREGPT_TO_ROLE.get(turn.get("from"), "user")
+            if turn.get("from") == "function_call":
+                call = parse_arguments(turn.get("value", ""))
+                call = call if isinstance(call, dict) else {"name": None, "arguments": call}
+                messages.append({"role": "assistant", "content": "", "tool_calls": [
+                    {"id": call.get("id"), "name": call.get("name"), "arguments": parse_arguments(call.get("arguments"))}]})
+            else:
+                messages.append({"role": role, "content": turn.get("value", "")})
+
+    return {"format": "canonical", "version": CANONICAL_VERSION, "messages": messages}
+
+
+# -------------------------------------------------
+#   canonical -> other formats
+# -------------------------------------------------
+def to_openai(session: Dict) -> Dict:
+    messages = []
+    for message in session["messages"]:
+        out = {"role": message["role"], "content": message.get("content")}
+        if message.get("tool_calls"):
+            out["tool_calls"] = [{
+                "id": call.get("id"),
+                "type": "function",
+                "function": {
+                    "name": call.get("name"),
+                    "arguments": call["arguments"] if isinstance(call.get("arguments"), str)
+                    else json.dumps(call.get("arguments"), ensure_ascii=False),
+                },
+            } for call in message["tool_calls"]]
+        if message["role"] == "tool":
+            out["tool_call_id"] = message.get("tool_call_id")
+        messages.append(out)
+    return {"messages": messages}
+
+
+def to_sharegpt(session: Dict) -> Dict:
+    """ShareGPT with function_call/observation turns; nothing is truncated"""
+    conversations, system = [], None
+    for message in session["messages"]:
+        role = message["role"]
+        if role == "system":
+            system = message.get("content")
+        elif role == "user":
+            conversations.append({"from": "human", "value": message.get("content") or ""})
+        elif role == "assistant":
+            if message.get("content"):
+                conversations.append({"from": "gpt", "value": message["content"]})
+            for call in message.get("tool_calls") or []:
+                conversations.append({"from": "function_call", "value": json.dumps(
+                    {"name": call.get("name"), "arguments": call.get("arguments")}, ensure_ascii=False)})
+        elif role == "tool":
+            conversations.append({"from": "observation", "value": message.get("content") or ""})
+    example = {"conversations": conversations}
+    if system:
+        example["system"] = system
+    return example
+
+
+def to_chatml(session: Dict) -> Dict:
+    """Single ChatML text, tool calls in <tool_call> tags (Qwen/Hermes style)"""
+    parts = []
+    for message in session["messages"]:
+        content = message.get("content") or ""
+        if message["role"] == "assistant":
+            for call in message.get("tool_calls") or []:
+                content += "\n<tool_call>\n" + json.dumps(
+                    {"name": call.get("name"), "arguments": call.get("arguments")}, ensure_ascii=False) + "\n</tool_call>"
+        elif message["role"] == "tool":
+            content = f"<tool_response>\n{content}\n</tool_response>"
+        parts.append(f"<|im_start|>{message['role']}\n{content.strip()}<|im_end|>\n")
+    return {"text": "".join(parts)}
+
+
+renderers                   :   Dict[str, Callable] = {
+    'canonical'             :   lambda session: session,
+    'openai'                :   to_openai,
+    'sharegpt'              :   to_sharegpt,
+    'chatml'                :   to_chatml,
+}
+
+
+def render(example: Dict, fmt: str) -> Dict:
+    return renderers[fmt](canonicalize(example))
+
+
+# -------------------------------------------------
+#   sharded, parallel file conversion
+# -------------------------------------------------
+def plan_shards(paths: List[str], shard_bytes: int = CONVERT_SHARD_BYTES) -> List[Tuple[str, int, int]]:
+    """(path, start, end) byte ranges, each ending on a line boundary"""
+    shards = []
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                f.seek(min(start + shard_bytes, size))
+                f.readline()  # move to the end of the line we landed in
+                end = min(f.tell(), size)
+                shards.append((path, start, end))
+                start = end
+    return shards
+
+
+def iter_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def convert_shard(job: Tuple[str, int, int, str, str]) -> Tuple[int, int]:
+    """Render one byte range to a temp file; returns (sessions, errors)"""
+    path, start, end, fmt, out_path = job
+    count = errors = 0
+    with open(out_path, 'w', encoding='utf-8') as out:
+        for line in iter_range(path, start, end):
+            if not line.strip():
+                continue
+            try:
+                out.write(json.dumps(render(json.loads(line), fmt), ensure_ascii=False) + "\n")
+                count += 1
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                errors += 1
+    return count, errors
+
+
+def convert_files(paths: List[str], output_path: str, fmt: str, workers: Optional[int] = None,
+                  json_array: bool = False) -> Dict:
+    """Convert JSONL session files into one output file (JSONL, or a JSON array)"""
+    if fmt not in renderers:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {sorted(renderers)}")
+    start = time.perf_counter()
+    shards = plan_shards(paths)
+    tmp_dir = tempfile.mkdtemp(prefix="convert_", dir=os.path.dirname(os.path.abspath(output_path)))
+    jobs = [(path, lo, hi, fmt, os.path.join(tmp_dir, f"{i:06d}.jsonl")) for i, (path, lo, hi) in enumerate(shards)]
+
+    try:
+        with Pool(processes=min(workers or os.cpu_count(), max(len(jobs), 1))) as pool:
+            results = pool.map(convert_shard, jobs, chunksize=1)
+
+        # Stitch the shards together in input order
+        with open(output_path, 'w', encoding='utf-8') as out:
+            if json_array:
+                out.write("[\n")
+                first = True
+                for job in jobs:
+                    with open(job[4], 'r', encoding='utf-8') as part:
+                        for line in part:
+                            out.write(("" if first else ",\n") + line.rstrip("\n"))
+                            first = False
+                out.write("\n]\n")
+            else:
+                for job in jobs:
+                    with open(job[4], 'r', encoding='utf-8') as part:
+                        shutil.copyfileobj(part, out)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        'format': fmt,
+        'output': output_path,
+        'shards': len(jobs),
+        'sessions': sum(r[0] for r in results),
+        'errors': sum(r[1] for r in results),
+        'duration_s': round(time.perf_counter() - start, 3),
+    }
+    print(colored("[ x ]    ", "green"), f"Converted {report['sessions']} sessions to {fmt} "
+                                         f"({report['shards']} shards, {report['errors']} errors) -> {output_path}")
+    return report
@@ -0,0 +1,349 @@
+# =====================================================
+#          PACKED TRAINING DATASET BUILDER
+# =====================================================
+# Turns the training_data_*.jsonl written by TrainingDataLogger into
+# fixed-length, tokenized NumPy shards that a trainer can memory-map:
+#
+#   <out>/manifest.json            tokenizer, seq_len, dtype, shard list
+#   <out>/sessions.txt             content hash of every session already built
+#   <out>/shard_00000.tokens.bin   (rows, seq_len) token ids
+#   <out>/shard_00000.mask.bin     (rows, seq_len) uint8, 1 = assistant token (loss)
+#   <out>/shard_00000.offsets.npy  start offset of each session segment in the flat shard
+#
+# Sessions are streamed and tokenized with the model's chat template in a
+# process pool (each worker loads the tokenizer once). Their tokens are
+# concatenated and cut into rows of seq_len, so a session may span two
+# rows, or two shards: the next shard then starts with the rest of it at
+# offset 0 and is marked "continued" in the manifest. A rebuild only
+# tokenizes sessions whose hash is not in sessions.txt (identical sessions
+# within one build are packed once), and writes them to new shards.
+import hashlib
+import json
+import os
+from collections import deque
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from termcolor import colored
+from convert import to_openai
+from config import (
+    ALLOWED_ROOT,
+    SEARCH_SKIP_DIRS,
+    DATASET_ROOT,
+    DATASET_TOKENIZER,
+    DATASET_SEQ_LEN,
+    DATASET_SHARD_ROWS,
+)
+
+SHAREGPT_ROLES = {
+    "human": "user",
+    "user": "user",
+    "gpt": "assistant",
+    "assistant": "assistant",
+    "system": "system",
+    "tool": "tool",
+    "observation": "tool",
+    "function_call": "assistant",
+}
+
+
+def training_files(root: str = ALLOWED_ROOT) -> List[str]:
+    """Every training_data_*.jsonl under root, in a stable order"""
+    found = []
+    for current, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in SEARCH_SKIP_DIRS]
+        found.extend(os.path.join(current, f) for f in files
+                     if f.startswith("training_data_") and f.endswith(".jsonl"))
+    return sorted(found)
+
+
+def iter_sessions(paths: List[str]) -> Iterator[Tuple[str, str]]:
+    """(content_hash, raw_line) for every session line in the files"""
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield hashlib.sha1(line).hexdigest(), line.decode('utf-8', errors='replace')
+
+
+def to_chat_messages(example: Dict) -> List[Dict]:
+    """OpenAI-style messages from a canonical, OpenAI or ShareGPT training example"""
+    if example.get("format") == "canonical":
+        example = to_openai(example)
+    if "messages" in example:
+        messages = []
+        for message in example["messages"]:
+            message = dict(message)
+            calls = []
+            for call in message.get("tool_calls") or []:
+                function = dict(call.get("function", {}))
+                # Chat templates render arguments themselves and expect a dict
+                if isinstance(function.get("arguments"), str):
+                    try:
+                        function["arguments"] = json.loads(function["arguments"])
+                    except json.JSONDecodeError:
+                        pass
+                calls.append({**call, "function": function})
+            if calls:
+                message["tool_calls"] = calls
+            messages.append(message)
+        return messages
+
+    return [{"role": SHAREGPT_ROLES.get(turn.get("from"), "user"), "content": turn.get("value", "")}
+            for turn in example.get("conversations", [])]
+
+
+# -------------------------------------------------
+#   worker side (one tokenizer per process)
+# -------------------------------------------------
+_tokenizer = None
+
+
+def init_worker(tokenizer_name: str):
+    global _tokenizer
+    from transformers import AutoTokenizer  # heavy import, only in dataset workers
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def render(messages: List[Dict], add_generation_prompt=False) -> str:
+    return _tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+
+
+def encode(text: str) -> List[int]:
+    return _tokenizer(text, add_special_tokens=False)["input_ids"] if text else []
+
+
+def tokenize_session(line: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (token_ids, loss_mask) for one session, or None if it can't be templated
+
+    Each message is tokenized as the text it adds to the rendered prefix, so
+    the whole conversation is templated once per turn, not re-tokenized.
+    For assistant turns the generation prompt (role header) is kept out of
+    the loss, so only the assistant's own tokens are trained on.
+    """
+    try:
+        messages = to_chat_messages(json.loads(line))
+        if not any(m.get("role") == "assistant" for m in messages):
+            return None
+
+        ids, mask = [], []
+        rendered = ""
+        for i, message in enumerate(messages):
+            text = render(messages[:i + 1])
+            if not text.startswith(rendered):
+                return None  # template rewrites earlier turns; no clean per-turn split
+
+            if message.get("role") == "assistant":
+                header = render(messages[:i], add_generation_prompt=True) if i else ""
+                if not (header.startswith(rendered) and text.startswith(header)):
+                    header = rendered
+                head_ids = encode(header[len(rendered):])
+                body_ids = encode(text[len(header):])
+                ids += head_ids + body_ids
+                mask += [0] * len(head_ids) + [1] * len(body_ids)
+            else:
+                delta = encode(text[len(rendered):])
+                ids += delta
+                mask += [0] * len(delta)
+            rendered = text
+
+        ids.append(_tokenizer.eos_token_id if _tokenizer.eos_token_id is not None else 0)
+        mask.append(0)
+        return np.asarray(ids, dtype=np.int64), np.asarray(mask, dtype=np.uint8)
+    except Exception:
+        return None
+
+
+# -------------------------------------------------
+#   main process: packing and shards
+# -------------------------------------------------
+class ShardWriter:
+    """Packs token streams into rows of seq_len and flushes full shards to disk"""
+
+    def __init__(self, out_dir: str, seq_len: int, dtype, pad_id: int, first_shard: int, shard_rows: int = DATASET_SHARD_ROWS):
+        self.out_dir = out_dir
+        self.seq_len = seq_len
+        self.dtype = dtype
+        self.pad_id = pad_id
+        self.shard_rows = shard_rows
+        self.next_shard = first_shard
+        self.shards: List[Dict] = []
+        self.reset()
+
+    def reset(self):
+        self.tokens: List[np.ndarray] = []
+        self.masks: List[np.ndarray] = []
+        self.offsets: List[int] = []
+        self.length = 0
+        self.continued = False  # the first segment is the rest of a session from the previous shard
+
+    def add(self, ids: np.ndarray, mask: np.ndarray):
+        self.offsets.append(self.length)
+        self.tokens.append(ids)
+        self.masks.append(mask)
+        self.length += len(ids)
+        if self.length >= self.shard_rows * self.seq_len:
+            self.flush()
+
+    def flush(self):
+        if not self.tokens:
+            return
+        tokens = np.concatenate(self.tokens)
+        masks = np.concatenate(self.masks)
+        capacity = self.shard_rows * self.seq_len
+        carry_tokens, carry_masks = tokens[capacity:], masks[capacity:]
+        tokens, masks = tokens[:capacity], masks[:capacity]
+
+        rows = -(-len(tokens) // self.seq_len)  # ceil; the last row is padded
+        name = f"shard_{self.next_shard:05d}"
+        token_map = np.memmap(os.path.join(self.out_dir, f"{name}.tokens.bin"), dtype=self.dtype, mode='w+', shape=(rows, self.seq_len))
+        mask_map = np.memmap(os.path.join(self.out_dir, f"{name}.mask.bin"), dtype=np.uint8, mode='w+', shape=(rows, self.seq_len))
+        token_map.reshape(-1)[:len(tokens)] = tokens
+        token_map.reshape(-1)[len(tokens):] = self.pad_id
+        mask_map.reshape(-1)[:len(masks)] = masks
+        mask_map.reshape(-1)[len(masks):] = 0
+        token_map.flush()
+        mask_map.flush()
+
+        offsets = np.asarray([o for o in self.offsets if o < capacity], dtype=np.int64)
+        carry_offsets = [o - capacity for o in self.offsets if o >= capacity]
+        np.save(os.path.join(self.out_dir, f"{name}.offsets.npy"), offsets)
+        self.shards.append({
+            'name': name,
+            'rows': rows,
+            'tokens': int(len(tokens)),
+            'loss_tokens': int(masks.sum()),
+            'sessions': int(len(offsets)) - int(self.continued),  # sessions that start here
+            'continued': self.continued,
+        })
+        self.next_shard += 1
+
+        # A session cut at the shard boundary continues in the next shard,
+        # where its remaining tokens form the first segment
+        self.reset()
+        if len(carry_tokens):
+            self.tokens, self.masks, self.length = [carry_tokens], [carry_masks], len(carry_tokens)
+            self.continued = not carry_offsets or carry_offsets[0] != 0
+            self.offsets = [0] + carry_offsets if self.continued else carry_offsets
+            if self.length >= capacity:
+                self.flush()
+
+
+def load_manifest(out_dir: str) -> Dict:
+    try:
+        with open(os.path.join(out_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def build_dataset(out_dir: str = DATASET_ROOT, tokenizer: str = DATASET_TOKENIZER, seq_len: int = DATASET_SEQ_LEN,
+                  paths: Optional[List[str]] = None, workers: Optional[int] = None) -> Dict:
+    """Tokenize and pack every session not yet in the dataset; returns the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    if manifest and (manifest.get('tokenizer') != tokenizer or manifest.get('seq_len') != seq_len):
+        raise ValueError(f"{out_dir} was built with {manifest.get('tokenizer')} / seq_len {manifest.get('seq_len')}; use a new output directory")
+
+    sessions_file = os.path.join(out_dir, "sessions.txt")
+    done = set()
+    if os.path.exists(sessions_file):
+        with open(sessions_file, 'r', encoding='utf-8') as f:
+            done = {line.strip() for line in f if line.strip()}
+
+    paths = paths if paths is not None else training_files()
+
+    def pending():
+        """Sessions not built yet; a session logged twice is packed once"""
+        queued = set()
+        for h, line in iter_sessions(paths):
+            if h not in done and h not in queued:
+                queued.add(h)
+                yield h, line
+
+    init_worker(tokenizer)  # main process needs vocab size and pad id too
+    vocab = len(_tokenizer)
+    dtype = np.uint16 if vocab <= np.iinfo(np.uint16).max else np.uint32
+    pad_id = _tokenizer.pad_token_id if _tokenizer.pad_token_id is not None else (_tokenizer.eos_token_id or 0)
+
+    writer = ShardWriter(out_dir, seq_len, dtype, pad_id, first_shard=len(manifest.get('shards', [])))
+    stats = {'sessions': 0, 'skipped': 0}
+    hashes = deque()
+    # Hashes are committed to sessions.txt only after the manifest lists their
+    # shards, so an interrupted build is simply redone
+    partial_file = sessions_file + ".partial"
+
+    print(colored("[ x ]    ", "green"), f"Building dataset in {out_dir} from {len(paths)} files ({len(done)} sessions already built)")
+    with Pool(processes=workers or os.cpu_count(), initializer=init_worker, initargs=(tokenizer,)) as pool, \
+            open(partial_file, 'w', encoding='utf-8') as seen:
+
+        def lines():
+            for h, line in pending():
+                hashes.append(h)
+                yield line
+
+        # imap keeps input order, so the oldest queued hash belongs to each result
+        for result in pool.imap(tokenize_session, lines(), chunksize=16):
+            if result is None:
+                stats['skipped'] += 1
+            else:
+                writer.add(*result)
+                stats['sessions'] += 1
+            seen.write(hashes.popleft() + "\n")
+        writer.flush()
+
+    manifest = {
+        'tokenizer': tokenizer,
+        'seq_len': seq_len,
+        'dtype': np.dtype(dtype).name,
+        'pad_id': int(pad_id),
+        'shards': manifest.get('shards', []) + writer.shards,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    with open(partial_file, 'r', encoding='utf-8') as src, open(sessions_file, 'a', encoding='utf-8') as dst:
+        for line in src:
+            dst.write(line)
+    os.remove(partial_file)
+
+    print(colored("[ x ]    ", "green"), f"Packed {stats['sessions']} new sessions into {len(writer.shards)} shards "
+                                         f"({stats['skipped']} skipped: no assistant turn or unusable template)")
+    return manifest
+
+
+class PackedDataset:
+    """Zero-copy, read-only view of a built dataset: item i is (tokens, loss_mask) of row i"""
+
+    def __init__(self, out_dir: str = DATASET_ROOT):
+        self.out_dir = out_dir
+        self.manifest = load_manifest(out_dir)
+        if not self.manifest:
+            raise FileNotFoundError(f"No dataset manifest in {out_dir}")
+        seq_len, dtype = self.manifest['seq_len'], np.dtype(self.manifest['dtype'])
+
+        self.tokens, self.masks = [], []
+        for shard in self.manifest['shards']:
+            base = os.path.join(out_dir, shard['name'])
+            self.tokens.append(np.memmap(f"{base}.tokens.bin", dtype=dtype, mode='r', shape=(shard['rows'], seq_len)))
+            self.masks.append(np.memmap(f"{base}.mask.bin", dtype=np.uint8, mode='r', shape=(shard['rows'], seq_len)))
+        self.row_starts = np.cumsum([0] + [shard['rows'] for shard in self.manifest['shards']])
+
+    def __len__(self):
+        return int(self.row_starts[-1])
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        if index < 0:
+            index += len(self)
+        shard = int(np.searchsorted(self.row_starts, index, side='right')) - 1
+        row = index - self.row_starts[shard]
+        return self.tokens[shard][row], self.masks[shard][row]
+
+    def offsets(self, shard: int) -> np.ndarray:
+        """
+        Start of each session segment within a shard's flattened tokens (for
+        document masking); in a "continued" shard the segment at 0 is the end
+        of the previous shard's last session
+        """
+        return np.load(os.path.join(self.out_dir, f"{self.manifest['shards'][shard]['name']}.offsets.npy"), mmap_mode='r')
@@ -0,0 +1,236 @@
+# =====================================================
+#          NEAR-DUPLICATE SESSION DEDUPLICATION (MinHash/LSH)
+# =====================================================
+# Agents repeat similar tasks, so training logs fill up with sessions that
+# differ only in a path or a number. This pass:
+#
+#   1. streams the JSONL and computes a MinHash signature of each session's
+#      word shingles in a process pool; signatures go to a memmap on disk
+#   2. LSH: per band, sorts the band hashes and takes equal neighbours as
+#      candidate pairs (no all-pairs comparison)
+#   3. keeps the candidate pairs whose estimated Jaccard similarity is at
+#      least the threshold, and clusters them with union-find
+#   4. streams the input again and keeps the first (oldest) session of each
+#      cluster, then writes <output> and <output>.report.json
+#
+# Memory is O(sessions x bands) for the band hashes; the signatures stay
+# on disk.
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from termcolor import colored
+from config import DEDUP_NUM_PERM, DEDUP_THRESHOLD, DEDUP_SHINGLE
+from dataset import to_chat_messages
+
+MERSENNE_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+SEED = 1
+trapezoid = getattr(np, "trapezoid", None) or np.trapz  # renamed in NumPy 2.0
+
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) minimizing false positive + false negative probability mass"""
+    xs = np.linspace(0, 1, 201)
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        if rows == 0:
+            break
+        candidate = 1 - (1 - xs ** rows) ** bands  # P(pair becomes a candidate)
+        below, above = xs < threshold, xs >= threshold
+        error = trapezoid(candidate[below], xs[below]) + trapezoid(1 - candidate[above], xs[above])
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(SEED)  # fixed so signatures are comparable across runs
+    a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def session_text(line: str) -> str:
+    """Normalized text of a session: message contents and tool calls, lowercased"""
+    try:
+        messages = to_chat_messages(json.loads(line))
+    except (json.JSONDecodeError, AttributeError):
+        return line.lower()
+    parts = []
+    for message in messages:
+        if message.get("role") == "system":
+            continue  # identical in every session, would make everything look alike
+        parts.append(str(message.get("content") or ""))
+        for call in message.get("tool_calls") or []:
+            parts.append(json.dumps(call.get("function", {}), sort_keys=True, default=str))
+    return re.sub(r"\s+", " ", " ".join(parts).lower()).strip()
+
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE) -> np.ndarray:
+    words = text.split()
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    # crc32 is stable across processes (unlike hash()) and fast
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64)
+
+
+# -------------------------------------------------
+#   worker side
+# -------------------------------------------------
+_perm = None
+_bands = None
+
+
+def init_worker(num_perm: int, bands: int, rows: int):
+    global _perm, _bands
+    _perm = permutations(num_perm)
+    _bands = (bands, rows)
+
+
+def signature(line: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(minhash uint32[num_perm], band hashes uint64[bands]) of one session"""
+    a, b = _perm
+    hashes = shingle_hashes(session_text(line))
+    sig = np.full(len(a), 0xFFFFFFFF, dtype=np.uint64)
+    # a, b, x < 2**32, so a*x + b cannot overflow uint64; chunked to bound memory
+    for start in range(0, len(hashes), 4096):
+        x = hashes[start:start + 4096, None]
+        np.minimum(sig, ((x * a + b) % MERSENNE_PRIME).min(axis=0), out=sig)
+    sig = (sig & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    bands, rows = _bands
+    band_hashes = np.empty(bands, dtype=np.uint64)
+    for i in range(bands):
+        digest = hashlib.blake2b(sig[i * rows:(i + 1) * rows].tobytes(), digest_size=8).digest()
+        band_hashes[i] = int.from_bytes(digest, "little")
+    return sig, band_hashes
+
+
+# -------------------------------------------------
+#   clustering
+# -------------------------------------------------
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # path halving
+            x = parent[x]
+        return int(x)
+
+    def union(self, x: int, y: int):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            # The older session (lower index) stays the root and is the one kept
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def deduplicate(input_path: str, output_path: Optional[str] = None, threshold: float = DEDUP_THRESHOLD,
+                num_perm: int = DEDUP_NUM_PERM, workers: Optional[int] = None) -> Dict:
+    """Write input_path without near-duplicate sessions; returns the report"""
+    # "dedup_" prefix: the output must not match the training_data_*.jsonl
+    # pattern the dataset builder, memory indexer and analytics pick up
+    output_path = output_path or os.path.join(os.path.dirname(input_path), "dedup_" + os.path.basename(input_path))
+    bands, rows = optimal_bands(threshold, num_perm)
+    start = time.perf_counter()
+    print(colored("[ x ]    ", "green"), f"Deduplicating {input_path} (Jaccard >= {threshold}, {bands} bands x {rows} rows)")
+
+    # Pass 1: signatures to a temporary file, band hashes in memory
+    sig_file = tempfile.NamedTemporaryFile(prefix="minhash_", suffix=".bin", dir=os.path.dirname(os.path.abspath(output_path)), delete=False)
+    band_chunks: List[np.ndarray] = []
+    try:
+        with Pool(processes=workers or os.cpu_count(), initializer=init_worker, initargs=(num_perm, bands, rows)) as pool:
+            pending = []
+            for sig, band_hashes in pool.imap(signature, iter_lines(input_path), chunksize=64):
+                sig_file.write(sig.tobytes())
+                pending.append(band_hashes)
+                if len(pending) >= 65536:
+                    band_chunks.append(np.stack(pending))
+                    pending = []
+            if pending:
+                band_chunks.append(np.stack(pending))
+        sig_file.close()
+
+        total = sum(len(chunk) for chunk in band_chunks)
+        if total == 0:
+            open(output_path, 'w').close()
+            return {'input': input_path, 'output': output_path, 'sessions': 0, 'kept': 0, 'removed': 0}
+        band_table = np.concatenate(band_chunks)
+        del band_chunks
+        signatures = np.memmap(sig_file.name, dtype=np.uint32, mode='r', shape=(total, num_perm))
+
+        # LSH: equal band hashes end up adjacent after sorting
+        uf = UnionFind(total)
+        candidates = verified = 0
+        for band in range(bands):
+            order = np.argsort(band_table[:, band], kind='stable')
+            column = band_table[order, band]
+            same = column[1:] == column[:-1]
+            left, right = order[:-1][same], order[1:][same]
+            candidates += len(left)
+            for lo in range(0, len(left), 65536):
+                l, r = left[lo:lo + 65536], right[lo:lo + 65536]
+                similarity = (signatures[l] == signatures[r]).mean(axis=1)
+                for x, y in zip(l[similarity >= threshold], r[similarity >= threshold]):
+                    uf.union(int(x), int(y))
+                    verified += 1
+        del signatures
+    finally:
+        if not sig_file.closed:
+            sig_file.close()
+        os.remove(sig_file.name)
+
+    roots = np.fromiter((uf.find(i) for i in range(total)), dtype=np.int64, count=total)
+    keep = roots == np.arange(total)
+    sizes = np.bincount(roots, minlength=total)
+
+    # Pass 2: stream the input again, keeping one session per cluster
+    previews = {}
+    largest = [int(r) for r in np.argsort(-sizes)[:10] if sizes[r] > 1]
+    with open(output_path, 'w', encoding='utf-8') as out:
+        for i, line in enumerate(iter_lines(input_path)):
+            if keep[i]:
+                out.write(line if line.endswith("\n") else line + "\n")
+            if i in largest:
+                previews[i] = session_text(line)[:200]
+
+    report = {
+        'input': input_path,
+        'output': output_path,
+        'threshold': threshold,
+        'num_perm': num_perm,
+        'bands': bands,
+        'rows': rows,
+        'sessions': int(total),
+        'kept': int(keep.sum()),
+        'removed': int(total - keep.sum()),
+        'clusters': int((sizes > 1).sum()),
+        'candidate_pairs': int(candidates),
+        'verified_pairs': int(verified),
+        'largest_clusters': [{'kept_index': r, 'size': int(sizes[r]), 'preview': previews.get(r, "")} for r in largest],
+        'duration_s': round(time.perf_counter() - start, 3),
+    }
+    with open(output_path + ".report.json", 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(colored("[ x ]    ", "green"), f"Kept {report['kept']} of {report['sessions']} sessions "
+                                         f"({report['removed']} near-duplicates in {report['clusters']} clusters) -> {output_path}")
+    return report
@@ -0,0 +1,161 @@
+# =====================================================
+#          HEDGED LLM REQUESTS
+# =====================================================
+# A request that runs past the p95 latency seen for its (model, call type)
+# gets a second copy sent to a fallback server (and/or model). Whichever
+# returns a usable answer first wins; the loser is cancelled: its `cancelled`
+# event is set, so it leaves the scheduler queue or drops its connection and
+# frees the slot.
+#
+# Latency is measured from the moment the request got its scheduler slot
+# (the primary calls started()), so time spent queueing behind other
+# requests neither triggers hedges nor inflates the p95.
+#
+# Streamed requests are hedged on time to first token: each copy returns a
+# StreamStart as soon as it has produced a token, the first one is streamed
+# to the caller and the other is closed (discard), which frees its slot.
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+from config import HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES
+
+
+class LatencyTracker:
+    """Rolling window of recent latencies per key"""
+
+    def __init__(self, window=100, min_samples=HEDGE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self.samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds: float):
+        with self.lock:
+            self.samples[key].append(seconds)
+
+    def p95(self, key) -> Optional[float]:
+        with self.lock:
+            values = sorted(self.samples[key])
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+class RequestCancelled(Exception):
+    """Raised inside the losing request once the other one has won"""
+
+
+class StreamStart:
+    """
+    A streamed response that has produced its first token: the chunks read
+    so far and the rest of the stream. Iterating it yields all of them and
+    then calls close(), which ends the stream and frees its resources.
+    """
+
+    def __init__(self, head: List, chunks: Iterator, close: Callable):
+        self.head = head
+        self.chunks = chunks
+        self.close = close
+        self.message = head[-1].message if head else None
+
+    def __iter__(self):
+        try:
+            yield from self.head
+            yield from self.chunks
+        finally:
+            self.close()
+
+
+def usable(response) -> bool:
+    message = getattr(response, 'message', None)
+    return bool(message and (message.content or message.tool_calls))
+
+
+class HedgedChat:
+    def __init__(self, tracker: Optional[LatencyTracker] = None,
+                 min_delay=HEDGE_MIN_DELAY, default_delay=HEDGE_DEFAULT_DELAY):
+        self.tracker = tracker or LatencyTracker()
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+        self.stats = defaultdict(int)
+
+    def delay(self, key) -> float:
+        p95 = self.tracker.p95(key)
+        return max(self.min_delay, p95 if p95 is not None else self.default_delay)
+
+    def timed(self, key, fn: Callable, started: threading.Event, cancelled: threading.Event):
+        """Run fn(started, cancelled); only the time after it calls started() counts as latency"""
+        begin = []
+
+        def mark():
+            begin.append(time.perf_counter())
+            started.set()
+
+        try:
+            return fn(mark, cancelled)
+        finally:
+            started.set()  # fn failed before its request started: don't leave call() waiting
+            if begin:
+                self.tracker.record(key, time.perf_counter() - begin[0])
+
+    def call(self, key, primary: Callable, hedge: Callable, discard: Optional[Callable] = None):
+        """
+        Result of primary, or of hedge if primary is slower than the p95 and
+        hedge answers first. Both are called as fn(started, cancelled): started()
+        once the request is actually sent, cancelled is set when the other won.
+        discard(response) is called on a losing copy's response if it still
+        produced one (e.g. to close a stream).
+        """
+        started, cancel_first, cancel_second = threading.Event(), threading.Event(), threading.Event()
+        first = self.pool.submit(self.timed, key, primary, started, cancel_first)
+        started.wait()  # waiting for a scheduler slot is not server latency
+        try:
+            return first.result(timeout=self.delay(key))
+        except FutureTimeout:
+            pass
+
+        self.stats['hedged'] += 1
+        second = self.pool.submit(hedge, lambda: None, cancel_second)
+        cancels = {first: cancel_first, second: cancel_second}
+        pending = {first, second}
+        error = None
+        fallback = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if usable(response):
+                    self.stats['hedge_won' if future is second else 'primary_won'] += 1
+                    for loser in pending:
+                        cancels[loser].set()
+                        self.stats['cancelled'] += 1
+                    if discard:
+                        for loser in (pending | done) - {future}:
+                            loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+                    return response
+                fallback = response
+
+        if fallback is not None:
+            return fallback
+        raise error
+
+
+_hedger: Optional[HedgedChat] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> HedgedChat:
+    """Process-wide hedger so latency history is shared by every Agent"""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = HedgedChat()
+        return _hedger
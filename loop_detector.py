@@ -0,0 +1,83 @@
+# =====================================================
+#          TOOL LOOP / STALL DETECTION
+# =====================================================
+# process_message lets the model call tools until it answers. Small models
+# often get stuck: the same call with the same arguments over and over, or
+# two (three) calls alternating, each time getting the same result back.
+#
+# Every iteration is fingerprinted as (tool, arguments, result). When the
+# newest p fingerprints repeat the p before them (p = 1..LOOP_MAX_PERIOD),
+# nothing has changed since the last round, and every iteration that goes
+# round the cycle again is counted as wasted. After LOOP_HINT_AFTER wasted
+# iterations the agent injects a hint; after LOOP_STOP_AFTER more the loop
+# is cut and the model has to answer with what it has.
+import hashlib
+import json
+from typing import Dict, List, Optional
+from config import LOOP_MAX_PERIOD, LOOP_HINT_AFTER, LOOP_STOP_AFTER
+
+
+def fingerprint(name: str, arguments, result: str) -> str:
+    payload = json.dumps([name, arguments], sort_keys=True, default=str) + "\x00" + (result or "")
+    return hashlib.sha1(payload.encode("utf-8", errors="replace")).hexdigest()
+
+
+class LoopDetector:
+    """Per-message detector; observe() is called once per tool iteration"""
+
+    def __init__(self, max_period: int = LOOP_MAX_PERIOD, hint_after: int = LOOP_HINT_AFTER, stop_after: int = LOOP_STOP_AFTER):
+        self.max_period = max_period
+        self.hint_after = hint_after
+        self.stop_after = stop_after
+        self.history: List[str] = []
+        self.calls: List[str] = []
+        self.repeats = 0        # consecutive iterations that repeated the cycle
+        self.period = 0
+        self.wasted = 0
+        self.hinted = False
+
+    def find_period(self) -> int:
+        """Smallest period p whose last p fingerprints repeat the p before them, 0 if none"""
+        for period in range(1, self.max_period + 1):
+            if len(self.history) >= 2 * period and self.history[-period:] == self.history[-2 * period:-period]:
+                return period
+        return 0
+
+    def observe(self, name: str, arguments, result: str) -> Optional[str]:
+        """None, 'hint' (inject hint()) or 'stop' (end the tool loop)"""
+        self.history.append(fingerprint(name, arguments, result))
+        self.calls.append(name)
+
+        if self.period and self.history[-1] == self.history[-1 - self.period]:
+            self.repeats += 1  # still going round the same cycle
+            self.wasted += 1
+        elif (period := self.find_period()):
+            self.period, self.repeats = period, period  # the whole second round was wasted
+            self.wasted += period
+        else:
+            self.period, self.repeats = 0, 0
+            return None
+
+        if self.hinted and self.repeats >= self.stop_after:
+            return 'stop'
+        if not self.hinted and self.repeats >= self.hint_after:
+            self.hinted = True
+            self.repeats = 0  # after the hint the model gets stop_after more repeats
+            return 'hint'
+        return None
+
+    def describe(self) -> str:
+        cycle = self.calls[-self.period:] if self.period else self.calls[-1:]
+        if len(set(cycle)) == 1 and self.period == 1:
+            return f"called {cycle[0]} with the same arguments and got the same result again"
+        return f"alternated between {' -> '.join(cycle)} with the same arguments and results"
+
+    def hint(self) -> str:
+        return (f"You have {self.describe()}. Repeating it will not change the result. "
+                f"Use the results you already have: try a different tool or different arguments, "
+                f"or give your final answer now.")
+
+
+def loop_rate(stats: Dict) -> float:
+    """Share of tool iterations that only repeated an earlier cycle"""
+    return round(stats.get('wasted', 0) / max(stats.get('iterations', 0), 1), 3)
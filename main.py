@@ -1,4 +1,5 @@
 import os
+import argparse
 from agent import Agent
 from agent import TrainingDataLogger
 
@@ -10,13 +11,112 @@ from agent import TrainingDataLogger
 # =====================================================
 
 if __name__ == "__main__":
-    # Create an instance of the Agent
-    agent = Agent(
-        model='qwen2.5:7b',  # or whatever model you want to use
-        workspace=r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-    )
-    
-    # Run the agent (this starts the interactive loop)
-    agent.run()
-    
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the agent")
+    parser.add_argument("--session", default=None, help="Chat mode: continue a stored conversation by session id")
+    subparsers = parser.add_subparsers(dest="mode")
+
+    # python main.py serve  -> HTTP/WebSocket server with one Agent per session
+    serve_parser = subparsers.add_parser("serve", help="Host agent sessions over HTTP/WebSocket")
+    serve_parser.add_argument("--host", default=None)
+    serve_parser.add_argument("--port", type=int, default=None)
+
+    # python main.py batch tasks.jsonl  -> headless run_task over a task file
+    batch_parser = subparsers.add_parser("batch", help="Run tasks from a JSONL file without a terminal")
+    batch_parser.add_argument("task_file")
+    batch_parser.add_argument("--output-dir", default=None)
+    batch_parser.add_argument("--model", default="qwen2.5:7b")
+    batch_parser.add_argument("--workers", type=int, default=2)
+    batch_parser.add_argument("--resume", action="store_true", help="Skip tasks already in results.jsonl")
+
+    # python main.py resume  -> continue the last checkpointed run_task
+    resume_parser = subparsers.add_parser("resume", help="Resume the last interrupted task from its checkpoint")
+    resume_parser.add_argument("--model", default="qwen2.5:7b")
+
+    # python main.py dataset  -> tokenize + pack training logs into memmap shards
+    dataset_parser = subparsers.add_parser("dataset", help="Build a packed, tokenized dataset from training_data_*.jsonl")
+    dataset_parser.add_argument("--output-dir", default=None)
+    dataset_parser.add_argument("--tokenizer", default=None, help="Hugging Face tokenizer with a chat template")
+    dataset_parser.add_argument("--seq-len", type=int, default=None)
+    dataset_parser.add_argument("--workers", type=int, default=None)
+
+    # python main.py dedup training_data_openai.jsonl  -> drop near-duplicate sessions
+    dedup_parser = subparsers.add_parser("dedup", help="Remove near-duplicate sessions from a training JSONL file")
+    dedup_parser.add_argument("input")
+    dedup_parser.add_argument("--output", default=None, help="Defaults to dedup_<input> next to the input")
+    dedup_parser.add_argument("--threshold", type=float, default=None, help="Jaccard similarity for duplicates")
+    dedup_parser.add_argument("--workers", type=int, default=None)
+
+    # python main.py convert training_data_canonical.jsonl --format sharegpt
+    convert_parser = subparsers.add_parser("convert", help="Render training logs in another format")
+    convert_parser.add_argument("inputs", nargs="+")
+    convert_parser.add_argument("--format", required=True, choices=["canonical", "openai", "sharegpt", "chatml"])
+    convert_parser.add_argument("--output", required=True)
+    convert_parser.add_argument("--workers", type=int, default=None)
+
+    # python main.py analytics  -> tool latency, session length, ... over all training logs
+    analytics_parser = subparsers.add_parser("analytics", help="Aggregate statistics over training logs")
+    analytics_parser.add_argument("inputs", nargs="*", help="Defaults to every training_data_*.jsonl in the workspace")
+    analytics_parser.add_argument("--output", default=None, help="Report path (JSON)")
+    analytics_parser.add_argument("--workers", type=int, default=None)
+
+    # python main.py replay training_data_canonical.jsonl --mock  -> latency regression run
+    replay_parser = subparsers.add_parser("replay", help="Replay recorded sessions and report per-turn latency")
+    replay_parser.add_argument("inputs", nargs="+")
+    replay_parser.add_argument("--model", default="qwen2.5:7b")
+    replay_parser.add_argument("--host", default=None, help="Ollama server to replay against")
+    replay_parser.add_argument("--mock", action="store_true", help="Answer with the recorded assistant messages instead of a model")
+    replay_parser.add_argument("--mock-tps", type=float, default=0.0, help="Simulated generation speed of the mock server (tokens/s)")
+    replay_parser.add_argument("--limit", type=int, default=None, help="Replay at most this many sessions")
+    replay_parser.add_argument("--output-dir", default=None)
+
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        from server import serve
+        from config import SERVER_HOST, SERVER_PORT
+        serve(host=args.host or SERVER_HOST, port=args.port or SERVER_PORT)
+    elif args.mode == "batch":
+        from batch import BatchRunner, load_tasks
+        runner = BatchRunner(output_dir=args.output_dir, model=args.model, workers=args.workers)
+        runner.run(load_tasks(args.task_file), resume=args.resume)
+    elif args.mode == "dataset":
+        from dataset import build_dataset
+        from config import DATASET_ROOT, DATASET_TOKENIZER, DATASET_SEQ_LEN
+        build_dataset(out_dir=args.output_dir or DATASET_ROOT,
+                      tokenizer=args.tokenizer or DATASET_TOKENIZER,
+                      seq_len=args.seq_len or DATASET_SEQ_LEN,
+                      workers=args.workers)
+    elif args.mode == "dedup":
+        from dedup import deduplicate
+        from config import DEDUP_THRESHOLD
+        deduplicate(args.input, output_path=args.output,
+                    threshold=args.threshold or DEDUP_THRESHOLD, workers=args.workers)
+    elif args.mode == "convert":
+        from convert import convert_files
+        convert_files(args.inputs, args.output, args.format, workers=args.workers)
+    elif args.mode == "analytics":
+        from analytics import analyze
+        from dataset import training_files
+        analyze(args.inputs or training_files(), output_path=args.output, workers=args.workers)
+    elif args.mode == "replay":
+        from replay import Replayer
+        Replayer(model=args.model, host=args.host, mock=args.mock, output_dir=args.output_dir,
+                 mock_tokens_per_second=args.mock_tps).run(args.inputs, limit=args.limit)
+    elif args.mode == "resume":
+        agent = Agent(
+            model=args.model,
+            workspace=r"C:\Users\Administrator\Desktop\code\swstk\workspace"
+        )
+        agent.resume_task()
+    else:
+        # Create an instance of the Agent
+        agent = Agent(
+            model='qwen2.5:7b',  # or whatever model you want to use
+            workspace=r"C:\Users\Administrator\Desktop\code\swstk\workspace",
+            session_id=args.session  # continue the stored session under its own id
+        )
+        if args.session:
+            agent.resume_session()
+
+        # Run the agent (this starts the interactive loop)
+        agent.run()
@@ -0,0 +1,406 @@
+# =====================================================
+#          LONG-TERM MEMORY (BM25 over past sessions)
+# =====================================================
+# Indexes what earlier sessions said and what their tools returned, so a
+# new Agent can recall project facts instead of exploring again. There are
+# two sources, both read incrementally:
+#
+#   * the conversation store (store.py), read past the last indexed row id
+#   * training_data_*.jsonl files under ALLOWED_ROOT, read past the last byte offset
+#
+# Chunks are ranked with BM25 from an inverted index in SQLite. When
+# MEMORY_EMBED_MODEL is set, the top BM25 hits are reranked by cosine
+# similarity of local Ollama embeddings.
+#
+# Results of recall itself are never indexed (they would be recalled again
+# and again), and a query skips the session that is asking. Every chunk
+# keeps the workspace that owns its session (store owners, or the folder of
+# the training file), and a recall only sees chunks of the caller's
+# workspace and workspaces below it: server sessions don't see each other.
+# The index is built in the background, once per process from the first
+# Agent: until it finishes a recall searches whatever is indexed so far.
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import ollama
+from config import (
+    ALLOWED_ROOT,
+    SEARCH_SKIP_DIRS,
+    MEMORY_INDEX_PATH,
+    MEMORY_EMBED_MODEL,
+    MEMORY_CHUNK_CHARS,
+    MEMORY_REFRESH_INTERVAL,
+)
+from store import get_store
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RERANK_CANDIDATES = 50
+
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "was", "one",
+    "our", "has", "had", "this", "that", "with", "from", "have", "they", "will", "what",
+    "your", "into", "then", "than", "them", "there", "their", "which", "would", "about",
+    "is", "it", "to", "of", "in", "on", "a", "an", "be", "as", "at", "by", "or", "if", "do",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9_]+", text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def message_text(message: Dict) -> str:
+    """Searchable text of a canonical, OpenAI or ShareGPT message, tool calls (but not recall calls) included"""
+    parts = [str(message.get("content") or message.get("value") or "")]
+    for call in message.get("tool_calls") or []:
+        # OpenAI nests name/arguments under "function"; canonical logs don't
+        function = call.get("function", call) if isinstance(call, dict) else {}
+        if function.get("name") == "recall":
+            continue
+        arguments = function.get("arguments", "")
+        parts.append(f"{function.get('name', '')} {arguments if isinstance(arguments, str) else json.dumps(arguments, default=str)}")
+    return "\n".join(p for p in parts if p.strip())
+
+
+def recall_call_ids(message: Dict) -> List[str]:
+    return [call.get("id") for call in message.get("tool_calls") or []
+            if isinstance(call, dict) and call.get("function", call).get("name") == "recall"]
+
+
+def is_recall_result(message: Dict, recall_ids: set) -> bool:
+    return message.get("role") == "tool" and (message.get("name") == "recall" or message.get("tool_call_id") in recall_ids)
+
+
+def scope(path: Optional[str]) -> str:
+    """Workspace key for comparisons (absolute, case-folded where the OS is)"""
+    return os.path.normcase(os.path.abspath(path)) if path else ""
+
+
+def chunks(text: str, size: int = MEMORY_CHUNK_CHARS) -> Iterator[str]:
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+class MemoryIndex:
+    def __init__(self, db_path: str = MEMORY_INDEX_PATH, root: str = ALLOWED_ROOT, embed_model: Optional[str] = MEMORY_EMBED_MODEL):
+        self.db_path = db_path
+        self.root = os.path.abspath(root)
+        self.embed_model = embed_model
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+        self.built = threading.Event()  # set once the first full build is done
+
+        with self.connect() as db:
+            columns = [row[1] for row in db.execute("PRAGMA table_info(docs)")]
+            if columns and "workspace" not in columns:
+                # Index from before owner scoping: rebuild it from the sources
+                db.executescript("DROP TABLE docs; DROP TABLE IF EXISTS postings; "
+                                 "DROP TABLE IF EXISTS embeddings; DROP TABLE IF EXISTS progress;")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    id INTEGER PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    workspace TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    session_id TEXT,
+                    role TEXT,
+                    ts REAL,
+                    length INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    UNIQUE (hash, workspace)
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, doc_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    doc_id INTEGER PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS progress (
+                    source TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL
+                );
+            """)
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # -------------------------------------------------
+    #   indexing
+    # -------------------------------------------------
+    def add(self, db, text: str, source: str, workspace: str, session_id=None, role=None, ts=None) -> int:
+        """Index one message as one or more chunks; identical chunks are stored once per workspace"""
+        added = 0
+        for chunk in chunks(text.strip()):
+            terms = Counter(tokenize(chunk))
+            if not terms:
+                continue
+            digest = hashlib.sha1(chunk.encode("utf-8", "replace")).hexdigest()
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO docs (hash, workspace, source, session_id, role, ts, length, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, workspace, source, session_id, role, ts, sum(terms.values()), chunk)
+            )
+            if cursor.rowcount:
+                db.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                               ((term, cursor.lastrowid, tf) for term, tf in terms.items()))
+                added += 1
+        return added
+
+    def position(self, db, source: str) -> int:
+        row = db.execute("SELECT position FROM progress WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else 0
+
+    def set_position(self, db, source: str, position: int):
+        db.execute("INSERT OR REPLACE INTO progress (source, position) VALUES (?, ?)", (source, position))
+
+    def index_store(self, db) -> int:
+        """New messages from the conversation store"""
+        store, added, recall_ids, owners = get_store(), 0, set(), {}
+        last_id = self.position(db, "store")
+        while rows := store.since(last_id):
+            for row_id, session_id, ts, message in rows:
+                recall_ids.update(recall_call_ids(message))
+                if session_id not in owners:
+                    owners[session_id] = scope(store.owner(session_id))
+                if message.get("role") != "system" and not is_recall_result(message, recall_ids):
+                    added += self.add(db, message_text(message), f"session:{session_id}", owners[session_id],
+                                      session_id, message.get("role"), ts)
+                last_id = row_id
+            self.set_position(db, "store", last_id)
+        return added
+
+    def training_files(self) -> Iterator[str]:
+        for current, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in SEARCH_SKIP_DIRS]
+            for name in files:
+                if name.startswith("training_data_") and name.endswith(".jsonl"):
+                    yield os.path.join(current, name)
+
+    def index_training_file(self, db, path: str) -> int:
+        """New lines of an append-only training JSONL file"""
+        source = f"jsonl:{os.path.relpath(path, self.root)}"
+        offset, added = self.position(db, source), 0
+        store, folder = get_store(), scope(os.path.dirname(path))  # logs are written into their workspace
+        try:
+            if os.path.getsize(path) < offset:
+                offset = 0  # file was rewritten, start over (duplicates are ignored)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partial line still being written
+                    offset += len(line)
+                    try:
+                        example = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    ts, recall_ids = os.path.getmtime(path), set()
+                    session_id = example.get("session_id")
+                    owner = store.owner(session_id) if session_id else None
+                    workspace = scope(owner) if owner else folder
+                    for message in example.get("messages") or example.get("conversations") or []:
+                        role = message.get("role") or message.get("from")
+                        recall_ids.update(recall_call_ids(message))
+                        if role != "system" and not is_recall_result(message, recall_ids):
+                            added += self.add(db, message_text(message), source, workspace, session_id, role, message.get("ts") or ts)
+        except OSError:
+            return added
+        self.set_position(db, source, offset)
+        return added
+
+    def refresh(self, force=False) -> int:
+        """Index everything new since the last refresh; returns chunks added"""
+        with self.lock:
+            if not force and time.time() - self.last_refresh < MEMORY_REFRESH_INTERVAL:
+                return 0
+            with self.connect() as db:
+                added = self.index_store(db)
+                for path in self.training_files():
+                    added += self.index_training_file(db, path)
+            self.last_refresh = time.time()
+            self.built.set()
+            return added
+
+    def ensure_fresh(self):
+        """
+        (Re)index in the background; a query never waits for it, not even the
+        first one (it searches what is indexed so far, see self.built)
+        """
+        if self.lock.locked():
+            return
+        if not self.built.is_set():
+            threading.Thread(target=self.refresh, kwargs={'force': True}, daemon=True).start()
+        elif time.time() - self.last_refresh >= MEMORY_REFRESH_INTERVAL:
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    # -------------------------------------------------
+    #   querying
+    # -------------------------------------------------
+    def bm25(self, db, terms: List[str], limit: int, exclude_session: Optional[str] = None,
+             workspace: Optional[str] = None) -> List[Tuple[int, float]]:
+        n_docs, avg_len = db.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not n_docs:
+            return []
+
+        scores: Dict[int, float] = {}
+        key = scope(workspace)
+        for term in set(terms):
+            postings = db.execute(
+                "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id "
+                "WHERE p.term = ? AND d.session_id IS NOT ? "
+                "AND (? = '' OR d.workspace = ? OR substr(d.workspace, 1, ?) = ?)",
+                (term, exclude_session, key, key, len(key) + 1, key + os.sep)
+            ).fetchall()
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf, length in postings:
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+
+        return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+    def embed(self, texts: List[str]) -> List[array]:
+        response = ollama.embed(model=self.embed_model, input=texts)
+        return [array("f", vector) for vector in response["embeddings"]]
+
+    def vectors(self, db, doc_ids: List[int]) -> Dict[int, array]:
+        """Stored embeddings for doc_ids, computing the missing ones in one batch"""
+        placeholders = ",".join("?" * len(doc_ids))
+        found = {}
+        for doc_id, blob in db.execute(
+                f"SELECT doc_id, vector FROM embeddings WHERE model = ? AND doc_id IN ({placeholders})",
+                (self.embed_model, *doc_ids)):
+            vector = array("f")
+            vector.frombytes(blob)
+            found[doc_id] = vector
+
+        missing = [d for d in doc_ids if d not in found]
+        if missing:
+            texts = dict(db.execute(f"SELECT id, text FROM docs WHERE id IN ({','.join('?' * len(missing))})", missing))
+            for doc_id, vector in zip(missing, self.embed([texts[d] for d in missing])):
+                found[doc_id] = vector
+                db.execute("INSERT OR REPLACE INTO embeddings (doc_id, model, vector) VALUES (?, ?, ?)",
+                           (doc_id, self.embed_model, vector.tobytes()))
+        return found
+
+    def rerank(self, db, query: str, hits: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        """Blend normalized BM25 with embedding cosine similarity"""
+        try:
+            query_vector = self.embed([query])[0]
+            vectors = self.vectors(db, [doc_id for doc_id, _ in hits])
+        except Exception:
+            return hits  # embedding model unavailable, BM25 alone is still useful
+
+        def cosine(a, b):
+            dot = sum(x * y for x, y in zip(a, b))
+            norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+            return dot / norm if norm else 0.0
+
+        top = hits[0][1] or 1.0
+        blended = [(doc_id, 0.5 * score / top + 0.5 * cosine(query_vector, vectors[doc_id])) for doc_id, score in hits]
+        return sorted(blended, key=lambda item: -item[1])
+
+    def search(self, query: str, max_results: int = 5, exclude_session: Optional[str] = None,
+               workspace: Optional[str] = None) -> List[Dict]:
+        """
+        Best matching chunks: {"text", "source", "session_id", "role", "ts", "score"}
+        exclude_session: session whose own messages are left out (the caller's)
+        workspace: only chunks owned by this workspace or one below it (all if None)
+        """
+        self.ensure_fresh()
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self.connect() as db:
+            hits = self.bm25(db, terms, RERANK_CANDIDATES if self.embed_model else max_results, exclude_session, workspace)
+            if self.embed_model and hits:
+                hits = self.rerank(db, query, hits)
+            hits = hits[:max_results]
+            if not hits:
+                return []
+
+            rows = {row[0]: row for row in db.execute(
+                f"SELECT id, text, source, session_id, role, ts FROM docs WHERE id IN ({','.join('?' * len(hits))})",
+                [doc_id for doc_id, _ in hits])}
+
+        return [{
+            'text': rows[doc_id][1],
+            'source': rows[doc_id][2],
+            'session_id': rows[doc_id][3],
+            'role': rows[doc_id][4],
+            'ts': rows[doc_id][5],
+            'score': round(score, 3),
+        } for doc_id, score in hits]
+
+
+_default_memory: Optional[MemoryIndex] = None
+_memory_lock = threading.Lock()
+_warmed = False
+
+
+def get_memory() -> MemoryIndex:
+    global _default_memory
+    with _memory_lock:
+        if _default_memory is None:
+            _default_memory = MemoryIndex()
+        return _default_memory
+
+
+def warm_up_memory():
+    """Start the first background build; later calls in the process do nothing"""
+    global _warmed
+    with _memory_lock:
+        if _warmed:
+            return
+        _warmed = True
+    get_memory().ensure_fresh()
+
+
+def recall(query: str, max_results: int = 5, session_id: Optional[str] = None, root: Optional[str] = None) -> str:
+    """Search past sessions (conversations and tool results) for relevant facts
+    ARGS:
+        query (str): What to remember, in keywords (file names, errors, decisions)
+        max_results (int): Maximum number of snippets to return
+
+    RETURNS:
+        str: Ranked snippets from earlier sessions with their source
+    """
+    if not query or not query.strip():
+        return "Error: Empty recall query"
+
+    start = time.perf_counter()
+    memory = get_memory()
+    try:
+        hits = memory.search(query, max_results=int(max_results), exclude_session=session_id, workspace=root)
+    except sqlite3.Error as e:
+        return f"Error searching memory: {e}"
+    elapsed = (time.perf_counter() - start) * 1000
+    building = "" if memory.built.is_set() else ", memory index still being built: results may be incomplete"
+
+    if not hits:
+        return f"Nothing remembered about '{query}' ({elapsed:.0f} ms{building})"
+
+    out = [f"{len(hits)} memories for '{query}' ({elapsed:.0f} ms{building}):"]
+    for hit in hits:
+        when = datetime.fromtimestamp(hit['ts']).strftime("%Y-%m-%d %H:%M") if hit['ts'] else "?"
+        text = hit['text'] if len(hit['text']) <= 500 else hit['text'][:500] + "..."
+        out.append(f"\n[{hit['source']} | {hit['role']} | {when} | score {hit['score']}]\n{text}")
+    return "\n".join(out)
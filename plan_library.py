@@ -0,0 +1,218 @@
+# =====================================================
+#          PLAN LIBRARY (reuse verified plans)
+# =====================================================
+# Plans whose final verification passed are kept here, keyed by a
+# normalized task "template": quoted strings, paths, file names, URLs and
+# numbers in the task become slots, and the same values inside the plan's
+# arguments are replaced with {{slotN}} markers.
+#
+# A new task is normalized the same way and compared with the stored
+# templates (difflib ratio):
+#
+#   * close match, same number of slots and the same words outside the slots
+#     (filler words aside) -> the stored plan with the new slot values filled
+#     in is used as is, no planning call. Character similarity alone is not
+#     enough: "install" / "uninstall" or ".pyc" / ".log" score above 0.89
+#   * medium match -> create_plan gets the stored plan as a reference and a
+#     short "adapt this plan" prompt instead of planning from scratch
+#
+# The recording agent's workspace path (which the model gets in its system
+# prompt and often writes into arguments) is stored as a {{workspace}}
+# marker and filled with the current agent's workspace on match, so a plan
+# recorded in one task directory doesn't write into it from another.
+#
+# Plans that later fail verification when reused count against their entry
+# and stop being offered once they fail more often than they succeed.
+import copy
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import PLAN_LIBRARY_PATH, PLAN_REUSE_THRESHOLD, PLAN_ADAPT_THRESHOLD
+
+SLOT_PATTERN = re.compile(r"""
+      "[^"\n]+" | '[^'\n]+' | `[^`\n]+`              # quoted
+    | https?://\S+                                   # URLs
+    | [\w.~-]*[/\\][\w./\\~-]+                       # paths
+    | \b[\w-]+\.[A-Za-z][A-Za-z0-9]{0,4}\b           # file names
+    | \b\d+(?:\.\d+)?\b                              # numbers
+""", re.VERBOSE)
+SLOT = "<slot>"
+MARKER = re.compile(r"\{\{slot(\d+)\}\}")
+WORKSPACE = "{{workspace}}"
+# Words that don't change what a task does; ignored when comparing keywords
+FILLER_WORDS = {"a", "an", "the", "please", "in", "into", "inside", "to", "of", "for", "on", "at",
+                "my", "our", "this", "that", "then", "and"}
+
+
+def normalize(task: str) -> Tuple[str, List[str]]:
+    """(template, slot values): the task with its variable parts cut out"""
+    values = []
+
+    def cut(match):
+        value = match.group(0)
+        if value[0] in "\"'`":
+            value = value[1:-1]
+        values.append(value.rstrip(".,;:"))
+        return SLOT
+
+    template = SLOT_PATTERN.sub(cut, task.strip())
+    template = re.sub(r"\s+", " ", template.lower()).strip(" .!?")
+    return template, values
+
+
+def keywords(template: str) -> List[str]:
+    """The template's words and slots in order, filler words dropped"""
+    return [t for t in re.findall(r"<slot>|\w+", template) if t not in FILLER_WORDS]
+
+
+def map_strings(value, fn):
+    if isinstance(value, str):
+        return fn(value)
+    if isinstance(value, list):
+        return [map_strings(v, fn) for v in value]
+    if isinstance(value, dict):
+        return {k: map_strings(v, fn) for k, v in value.items()}
+    return value
+
+
+def templatize(plan: Dict, values: List[str], workspace: Optional[str] = None) -> Dict:
+    """
+    Plan with slot values replaced by {{slotN}} markers (longest values first),
+    then the workspace path (either slash style) by the {{workspace}} marker
+    """
+    plan = copy.deepcopy(plan)
+    for step in plan.get('steps', []):
+        step.pop('status', None)
+    order = sorted((i for i, v in enumerate(values) if v), key=lambda i: -len(values[i]))
+    patterns = [(re.compile(r"(?<!\w)" + re.escape(values[i]) + r"(?!\w)"), "{{slot%d}}" % i) for i in order]
+    if workspace:
+        workspace = os.path.normpath(workspace).rstrip("\\/")
+        for variant in sorted({workspace, workspace.replace("\\", "/")}, key=len, reverse=True):
+            # Windows paths are case-insensitive; the model doesn't always keep the case
+            patterns.append((re.compile(re.escape(variant) + r"(?![\w.-])", re.IGNORECASE), WORKSPACE))
+
+    def replace(text):
+        for pattern, marker in patterns:
+            text = pattern.sub(marker, text)
+        return text
+
+    return map_strings(plan, replace)
+
+
+def fill(template_plan: Dict, values: List[str], workspace: Optional[str] = None) -> Dict:
+    """Slot values and the workspace (relative "." when unknown) put back in"""
+    return map_strings(template_plan, lambda text: MARKER.sub(
+        lambda m: values[int(m.group(1))] if int(m.group(1)) < len(values) else m.group(0), text
+    ).replace(WORKSPACE, workspace or "."))
+
+
+class PlanLibrary:
+    def __init__(self, db_path: str = PLAN_LIBRARY_PATH):
+        self.db_path = db_path
+        self.local = threading.local()  # sqlite connections are per thread
+        self.lock = threading.Lock()
+        self.entries: Optional[List[Dict]] = None  # in-memory copy for matching
+
+        db = self.db()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                template TEXT UNIQUE NOT NULL,
+                task TEXT NOT NULL,
+                slots TEXT NOT NULL,
+                plan TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            );
+        """)
+        db.commit()
+
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    def load(self) -> List[Dict]:
+        with self.lock:
+            if self.entries is None:
+                rows = self.db().execute("SELECT id, template, task, slots, plan, successes, failures FROM plans")
+                self.entries = [{'id': i, 'template': t, 'task': task, 'slots': json.loads(s), 'plan': json.loads(p),
+                                 'successes': ok, 'failures': bad} for i, t, task, s, p, ok, bad in rows]
+            return self.entries
+
+    def add(self, task: str, plan: Dict, workspace: Optional[str] = None):
+        """
+        Store a plan that passed final verification (replaces the plan of the same template)
+        workspace: the recording agent's workspace, stored as a marker
+        """
+        template, values = normalize(task)
+        if not template or not plan.get('steps'):
+            return
+        db = self.db()
+        db.execute("""
+            INSERT INTO plans (template, task, slots, plan, successes, updated) VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT(template) DO UPDATE SET task = excluded.task, slots = excluded.slots, plan = excluded.plan,
+                                                successes = successes + 1, updated = excluded.updated
+        """, (template, task, json.dumps(values), json.dumps(templatize(plan, values, workspace), ensure_ascii=False), time.time()))
+        db.commit()
+        with self.lock:
+            self.entries = None
+
+    def record(self, entry_id: int, success: bool):
+        """Outcome of a run that started from a library plan"""
+        db = self.db()
+        db.execute(f"UPDATE plans SET uses = uses + 1, {'successes' if success else 'failures'} = "
+                   f"{'successes' if success else 'failures'} + 1, updated = ? WHERE id = ?", (time.time(), entry_id))
+        db.commit()
+        with self.lock:
+            self.entries = None
+
+    def match(self, task: str, workspace: Optional[str] = None) -> Optional[Dict]:
+        """
+        {"kind": "reuse" | "adapt", "score", "id", "task", "plan"} for the most
+        similar stored plan, or None below PLAN_ADAPT_THRESHOLD; the plan's
+        workspace paths point into `workspace`
+        """
+        template, values = normalize(task)
+        best, best_score = None, 0.0
+        for entry in self.load():
+            if entry['failures'] > entry['successes']:
+                continue
+            matcher = difflib.SequenceMatcher(None, template, entry['template'], autojunk=False)
+            if matcher.real_quick_ratio() < PLAN_ADAPT_THRESHOLD or matcher.quick_ratio() < PLAN_ADAPT_THRESHOLD:
+                continue
+            score = matcher.ratio()
+            if score > best_score:
+                best, best_score = entry, score
+        if best is None or best_score < PLAN_ADAPT_THRESHOLD:
+            return None
+
+        same_slots = len(values) == len(best['slots'])
+        same_words = keywords(template) == keywords(best['template'])
+        kind = "reuse" if best_score >= PLAN_REUSE_THRESHOLD and same_slots and same_words else "adapt"
+        plan = fill(best['plan'], values if same_slots else best['slots'], workspace)
+        if kind == "reuse":
+            plan['task'] = task
+        return {'kind': kind, 'score': round(best_score, 3), 'id': best['id'], 'task': best['task'], 'plan': plan}
+
+
+_library: Optional[PlanLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_plan_library() -> PlanLibrary:
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = PlanLibrary()
+        return _library
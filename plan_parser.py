@@ -0,0 +1,149 @@
+# =====================================================
+#          PLAN SCHEMAS & JSON PARSING
+# =====================================================
+# Plans are requested with Ollama's structured output (format=<schema>), so
+# the response body *is* the JSON. parse_json() is only a safety net for
+# models that still wrap it in prose, and StreamingPlanParser hands out each
+# step as soon as its closing brace arrives so run_task can start on step 1
+# while the rest of the plan is still generating.
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+
+OPENERS = re.compile(r"[\[{]")
+MAX_DECODE_ATTEMPTS = 16  # parse_json fallback: openers tried before giving up
+
+STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "step": {"type": "integer"},
+        "description": {"type": "string"},
+        "tool": {"type": ["string", "null"]},
+        "arguments": {"type": "object"},
+        "expected_outcome": {"type": "string"},
+    },
+    "required": ["step", "description", "tool", "arguments", "expected_outcome"],
+}
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "task": {"type": "string"},
+        "steps": {"type": "array", "items": STEP_SCHEMA},
+        "verification": {
+            "type": "object",
+            "properties": {
+                "final_check": {"type": "string"},
+                "test_command": {"type": "string"},
+            },
+        },
+    },
+    "required": ["task", "steps"],
+}
+
+# handle_verification_failure only needs the (possibly rewritten) steps
+STEPS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {"type": "array", "items": STEP_SCHEMA},
+    },
+    "required": ["steps"],
+}
+
+
+def parse_json(text: str) -> Optional[Any]:
+    """
+    Parse model output as JSON
+
+    Tries the whole text first (the structured-output case), then decodes from
+    each '{' or '[' in turn and ignores anything after the value. Every failed
+    attempt can scan to the end of the text, so only the first
+    MAX_DECODE_ATTEMPTS openers are tried: the cost stays linear in the
+    output length. Returns None if nothing parses.
+    """
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    decoder = json.JSONDecoder()
+    for attempt, match in enumerate(OPENERS.finditer(text)):
+        if attempt == MAX_DECODE_ATTEMPTS:
+            break
+        try:
+            return decoder.raw_decode(text, match.start())[0]
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+class StreamingPlanParser:
+    """
+    Incremental scanner over a streamed plan
+
+    feed() takes raw chunks and returns the step objects that completed in
+    them. Each character is looked at once, so the total cost is linear in
+    the response length no matter how it is chunked.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string = None
+        self.steps_depth = None    # depth inside the "steps" array
+        self.step_start = None     # buffer index of the current step's '{'
+        self.steps: List[Dict] = []
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.buffer += chunk
+        completed = []
+        buf = self.buffer
+
+        for i in range(self.pos, len(buf)):
+            c = buf[i]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    self.last_string = buf[self.string_start:i]
+                continue
+
+            if c == '"':
+                self.in_string = True
+                self.string_start = i + 1
+            elif c in '{[':
+                self.depth += 1
+                if c == '[' and self.steps_depth is None and self.depth == 2 and self.last_string == "steps":
+                    self.steps_depth = self.depth
+                elif c == '{' and self.steps_depth is not None and self.depth == self.steps_depth + 1:
+                    self.step_start = i
+            elif c in '}]':
+                if c == '}' and self.step_start is not None and self.depth == self.steps_depth + 1:
+                    try:
+                        step = json.loads(buf[self.step_start:i + 1])
+                        self.steps.append(step)
+                        completed.append(step)
+                    except json.JSONDecodeError:
+                        pass
+                    self.step_start = None
+                if self.steps_depth is not None and self.depth == self.steps_depth and c == ']':
+                    self.steps_depth = -1  # done with steps, never match again
+                self.depth -= 1
+
+        self.pos = len(buf)
+        return completed
+
+    def result(self) -> Optional[Any]:
+        """The complete plan once the stream has ended"""
+        return parse_json(self.buffer)
@@ -0,0 +1,61 @@
+# =====================================================
+#          GENERATION PROFILES (options per call type)
+# =====================================================
+# Each LLM call type gets its own generation options instead of one set for
+# everything: a step verification only needs "YES"/"NO" and a reason, so it
+# runs greedy with a few dozen tokens and stops at the first blank line,
+# while planning gets room for a whole JSON plan.
+#
+# Profiles live in config.GENERATION_PROFILES and are resolved against the
+# catalog's tuned options for the model (num_ctx), so the same profile fits
+# a 4k and a 32k model. Agent.usage counts responses that stopped on the
+# num_predict limit (done_reason == "length") per profile; a high rate
+# means the budget is too small.
+from typing import Dict
+from config import GENERATION_PROFILES, NUM_PREDICT_CAP
+
+DEFAULT_PROFILE = "interactive"
+
+
+def build_options(profile: str, tuned: Dict) -> Dict:
+    """Ollama options for a profile, given catalog.tuned_options() for the model"""
+    spec = GENERATION_PROFILES.get(profile) or GENERATION_PROFILES[DEFAULT_PROFILE]
+    options = dict(tuned)
+    num_ctx = tuned.get('num_ctx')
+
+    if 'num_predict' in spec:
+        options['num_predict'] = spec['num_predict']
+    elif num_ctx and 'num_predict_share' in spec:
+        options['num_predict'] = min(NUM_PREDICT_CAP, max(64, int(num_ctx * spec['num_predict_share'])))
+    if spec.get('temperature') is not None:
+        options['temperature'] = spec['temperature']
+    if spec.get('stop'):
+        options['stop'] = list(spec['stop'])
+    return options
+
+
+def truncated(response) -> bool:
+    return getattr(response, 'done_reason', None) == 'length'
+
+
+def usage_report(usage: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Agent.usage with per-profile averages and truncation rate"""
+    report = {}
+    for profile, stats in usage.items():
+        calls = max(stats.get('calls', 0), 1)
+        report[profile] = dict(stats,
+                               completion_tokens_per_call=round(stats.get('completion_tokens', 0) / calls, 1),
+                               truncation_rate=round(stats.get('truncated', 0) / calls, 3))
+    return report
+
+
+def merge_usage(usages) -> Dict[str, Dict]:
+    """Sum several Agent.usage dicts (batch / replay runs)"""
+    total: Dict[str, Dict] = {}
+    for usage in usages:
+        for profile, stats in (usage or {}).items():
+            into = total.setdefault(profile, {})
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and key in ('calls', 'prompt_tokens', 'completion_tokens', 'truncated'):
+                    into[key] = into.get(key, 0) + value
+    return total
@@ -0,0 +1,314 @@
+# =====================================================
+#          SESSION REPLAY (latency regression harness)
+# =====================================================
+# Re-runs recorded sessions through Agent.process_message:
+#
+#   * every recorded user turn is sent again, in order
+#   * tools are not executed; each call is answered with the result that
+#     was recorded for it (same tool + arguments, else the next unused
+#     result of that tool)
+#   * the model is the one given (--model/--host), or with --mock a local
+#     fake Ollama server that answers with the recorded assistant messages,
+#     which measures the agent's own overhead with the model taken out
+#
+# For each turn it reports latency, LLM iterations, tool calls served and
+# prompt/completion tokens. Results go to <output_dir>/turns.jsonl and
+# summary.json, so two runs (old vs new model or agent) can be compared.
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+from termcolor import colored
+from agent import Agent
+from config import ALLOWED_ROOT
+from convert import canonicalize
+from profiles import merge_usage, usage_report
+from store import ConversationStore
+
+DEFAULT_MODEL = "qwen2.5:7b"
+
+
+def argument_key(name: str, arguments) -> str:
+    return name + ":" + json.dumps(arguments, sort_keys=True, default=str)
+
+
+def iter_recorded(paths: List[str], limit: Optional[int] = None) -> Iterator[Dict]:
+    """Canonical sessions from training JSONL files (any format convert.py reads)"""
+    count = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    session = canonicalize(json.loads(line))
+                except (json.JSONDecodeError, AttributeError, TypeError):
+                    continue
+                session.setdefault('session_id', f"{os.path.basename(path)}:{line_no}")
+                yield session
+                count += 1
+                if limit and count >= limit:
+                    return
+
+
+def split_turns(session: Dict) -> List[Dict]:
+    """
+    [{"user": text, "assistant": [assistant messages], "tools": [(name, arguments, result)]}]
+    one entry per recorded user message
+    """
+    turns = []
+    calls = {}
+    for message in session['messages']:
+        role = message.get('role')
+        if role == 'user':
+            turns.append({'user': message.get('content') or "", 'assistant': [], 'tools': []})
+        elif not turns:
+            continue
+        elif role == 'assistant':
+            turns[-1]['assistant'].append(message)
+            for call in message.get('tool_calls') or []:
+                calls[call.get('id')] = call
+        elif role == 'tool':
+            call = calls.get(message.get('tool_call_id'), {})
+            turns[-1]['tools'].append((call.get('name') or message.get('name'), call.get('arguments'), message.get('content') or ""))
+    return turns
+
+
+class RecordedTools:
+    """Answers tool calls with recorded results instead of running tools"""
+
+    def __init__(self, recorded):
+        self.by_call = {}
+        self.by_name: Dict[str, List[str]] = {}
+        for name, arguments, result in recorded:
+            self.by_call.setdefault(argument_key(name, arguments), []).append(result)
+            self.by_name.setdefault(name, []).append(result)
+        self.served = 0
+        self.misses = 0
+
+    def __call__(self, name, arguments, call_id=None):
+        self.served += 1
+        exact = self.by_call.get(argument_key(name, arguments))
+        if exact:
+            result = exact.pop(0)
+            if result in self.by_name.get(name, []):
+                self.by_name[name].remove(result)
+            return result
+        if self.by_name.get(name):
+            return self.by_name[name].pop(0)
+        self.misses += 1
+        return f"Error: no recorded result for {name} (replay)"
+
+
+# -------------------------------------------------
+#   mock Ollama server
+# -------------------------------------------------
+class MockOllama:
+    """
+    Minimal /api/chat (non-streaming), /api/tags and /api/show that answers
+    with a script of recorded assistant messages, one per request
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, tokens_per_second: float = 0.0, context_length: int = 8192):
+        self.model = model
+        self.tokens_per_second = tokens_per_second
+        self.context_length = context_length
+        self.script: List[Dict] = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def set_script(self, messages: List[Dict]):
+        with self.lock:
+            self.script = list(messages)
+
+    def next_message(self) -> Dict:
+        with self.lock:
+            message = self.script.pop(0) if self.script else {'role': 'assistant', 'content': "(replay: no more recorded responses)"}
+        out = {'role': 'assistant', 'content': message.get('content') or ""}
+        if message.get('tool_calls'):
+            out['tool_calls'] = [{'function': {
+                'name': call.get('name'),
+                'arguments': call['arguments'] if isinstance(call.get('arguments'), dict) else {'input': call.get('arguments')},
+            }} for call in message['tool_calls']]
+        return out
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/api/tags"):
+                    return self.send_json({'models': [{'name': mock.model, 'model': mock.model, 'digest': 'replay', 'size': 0}]})
+                self.send_json({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.startswith("/api/show"):
+                    return self.send_json({'details': {'family': 'replay'},
+                                           'model_info': {'replay.context_length': mock.context_length}})
+
+                message = mock.next_message()
+                prompt_chars = sum(len(str(m.get('content') or "")) for m in request.get('messages', []))
+                eval_count = max(1, len(json.dumps(message)) // 4)
+                num_predict = (request.get('options') or {}).get('num_predict')
+                done_reason = 'stop'
+                if num_predict and eval_count > num_predict:
+                    eval_count, done_reason = num_predict, 'length'  # counts as truncated, content is kept
+                if mock.tokens_per_second:
+                    time.sleep(eval_count / mock.tokens_per_second)
+                self.send_json({
+                    'model': request.get('model', mock.model),
+                    'created_at': datetime.now().isoformat(),
+                    'message': message,
+                    'done': True,
+                    'done_reason': done_reason,
+                    'prompt_eval_count': prompt_chars // 4,
+                    'eval_count': eval_count,
+                })
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# -------------------------------------------------
+#   replay
+# -------------------------------------------------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Replayer:
+    def __init__(self, model=DEFAULT_MODEL, host: Optional[str] = None, mock=False, output_dir: Optional[str] = None,
+                 mock_tokens_per_second: float = 0.0):
+        self.model = model
+        self.output_dir = output_dir or os.path.join(ALLOWED_ROOT, "replay", datetime.now().strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.mock = MockOllama(model, tokens_per_second=mock_tokens_per_second).start() if mock else None
+        self.host = self.mock.host if self.mock else host
+        # Replayed conversations must not end up in the real store (and memory)
+        self.store = ConversationStore(os.path.join(self.output_dir, "replay_conversations.db"))
+        self.usages = []
+
+    def replay_session(self, session: Dict) -> List[Dict]:
+        workspace = tempfile.mkdtemp(prefix="replay_", dir=self.output_dir)
+        agent = Agent(model=self.model, workspace=workspace, interactive=False, host=self.host, store=self.store)
+        records = []
+
+        for index, turn in enumerate(split_turns(session)):
+            tools = RecordedTools(turn['tools'])
+            agent.run_tool = tools
+            if self.mock:
+                self.mock.set_script(turn['assistant'])
+
+            before = dict(agent.usage.get('interactive', {}))
+            loops = dict(agent.loop_stats)
+            start = time.perf_counter()
+            error = None
+            try:
+                response = agent.process_message(turn['user'])
+            except Exception as e:
+                response, error = "", str(e)
+            latency = time.perf_counter() - start
+            after = agent.usage.get('interactive', {})
+
+            records.append({
+                'session_id': session.get('session_id'),
+                'turn': index,
+                'latency_s': round(latency, 4),
+                'iterations': after.get('calls', 0) - before.get('calls', 0),
+                'recorded_iterations': len(turn['assistant']),
+                'tool_calls': tools.served,
+                'recorded_tool_calls': len(turn['tools']),
+                'tool_misses': tools.misses,
+                'wasted_iterations': agent.loop_stats['wasted'] - loops['wasted'],
+                'loop_hints': agent.loop_stats['hints'] - loops['hints'],
+                'prompt_tokens': after.get('prompt_tokens', 0) - before.get('prompt_tokens', 0),
+                'completion_tokens': after.get('completion_tokens', 0) - before.get('completion_tokens', 0),
+                'response_chars': len(response or ""),
+                'error': error,
+            })
+        agent.background.shutdown(wait=False)
+        self.usages.append(agent.usage)
+        return records
+
+    def run(self, paths: List[str], limit: Optional[int] = None) -> Dict:
+        turns_file = os.path.join(self.output_dir, "turns.jsonl")
+        print(colored("[ x ]    ", "green"), f"Replaying {', '.join(paths)} against {self.model} "
+                                             f"({'mock server' if self.mock else self.host or 'default server'}) -> {self.output_dir}")
+        records = []
+        start = time.perf_counter()
+        try:
+            with open(turns_file, 'w', encoding='utf-8') as out:
+                for n, session in enumerate(iter_recorded(paths, limit), 1):
+                    session_records = self.replay_session(session)
+                    for record in session_records:
+                        out.write(json.dumps(record) + "\n")
+                    records.extend(session_records)
+                    total = sum(r['latency_s'] for r in session_records)
+                    print(colored(f"[ {n} ]    ", "green"), f"{session.get('session_id')}: {len(session_records)} turns in {total:.2f}s")
+        finally:
+            if self.mock:
+                self.mock.stop()
+
+        latencies = [r['latency_s'] for r in records]
+        turns = max(len(records), 1)
+        summary = {
+            'model': self.model,
+            'host': 'mock' if self.mock else self.host,
+            'sessions': len({r['session_id'] for r in records}),
+            'turns': len(records),
+            'errors': sum(1 for r in records if r['error']),
+            'latency_s': {
+                'mean': round(sum(latencies) / turns, 4),
+                'p50': round(percentile(latencies, 50), 4),
+                'p95': round(percentile(latencies, 95), 4),
+                'max': round(max(latencies, default=0.0), 4),
+                'total': round(sum(latencies), 3),
+            },
+            'iterations_per_turn': round(sum(r['iterations'] for r in records) / turns, 3),
+            'recorded_iterations_per_turn': round(sum(r['recorded_iterations'] for r in records) / turns, 3),
+            'tool_misses': sum(r['tool_misses'] for r in records),
+            'wasted_iteration_rate': round(sum(r['wasted_iterations'] for r in records) /
+                                           max(sum(r['tool_calls'] for r in records), 1), 3),
+            'prompt_tokens': sum(r['prompt_tokens'] for r in records),
+            'completion_tokens': sum(r['completion_tokens'] for r in records),
+            'profiles': usage_report(merge_usage(self.usages)),
+            'wall_s': round(time.perf_counter() - start, 3),
+            'turns_file': turns_file,
+        }
+        with open(os.path.join(self.output_dir, "summary.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+        print(colored("[ x ]    ", "green"), f"{summary['turns']} turns: p50 {summary['latency_s']['p50']}s, "
+                                             f"p95 {summary['latency_s']['p95']}s, {summary['iterations_per_turn']} iterations/turn, "
+                                             f"{summary['prompt_tokens']}+{summary['completion_tokens']} tokens")
+        return summary
@@ -0,0 +1,140 @@
+# =====================================================
+#          TOOL RESULT BLOB STORE
+# =====================================================
+# Tool output larger than RESULT_PREVIEW_CHARS is written once to a
+# content-addressed store (<RESULTS_ROOT>/<ab>/<sha256>.txt). The conversation
+# only gets a preview plus a handle, and the model pages through the rest
+# with the read_result tool.
+#
+# Each blob starts with a "<length>\n" header so a page can be read without
+# loading the whole result. Blobs not written or read for
+# RESULT_RETENTION_DAYS are pruned (once per process, on the first put).
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from config import RESULTS_ROOT, RESULT_PREVIEW_CHARS, RESULT_PAGE_CHARS, RESULT_RETENTION_DAYS
+
+READ_CHUNK_CHARS = 1 << 20
+
+TRUNCATION_NOTICE = re.compile(r'\n\.\.\. \[truncated: showing \d+ of \d+ characters\. '
+                               r'Call read_result\(handle="([0-9a-f]{32})", offset=\d+\) for more\]$')
+
+
+class ResultStore:
+    def __init__(self, root: str = RESULTS_ROOT, retention_days: float = RESULT_RETENTION_DAYS):
+        self.root = root
+        self.retention_days = retention_days
+        self.pruned = False
+
+    def path(self, handle: str) -> str:
+        return os.path.join(self.root, handle[:2], f"{handle}.txt")
+
+    def put(self, content: str) -> str:
+        """Store content and return its handle (identical content is stored once)"""
+        if not self.pruned:
+            self.pruned = True
+            threading.Thread(target=self.prune, daemon=True).start()
+        handle = hashlib.sha256(content.encode("utf-8", "replace")).hexdigest()[:32]
+        path = self.path(handle)
+        if os.path.exists(path):
+            self.touch(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file then rename so readers never see half a blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8", errors="replace", newline="") as f:
+                f.write(f"{len(content)}\n")
+                f.write(content)
+            os.replace(tmp, path)
+        return handle
+
+    def read(self, handle: str, offset: int = 0, length: int = RESULT_PAGE_CHARS):
+        """Returns (page, total_length) or None for an unknown handle"""
+        if not re.fullmatch(r"[0-9a-f]{32}", handle or ""):
+            return None
+        path = self.path(handle)
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                total = int(f.readline())
+                # Text files can't seek to a character offset: skip in chunks
+                # instead of reading everything before the page into memory
+                skip = min(offset, total)
+                while skip > 0:
+                    skipped = len(f.read(min(skip, READ_CHUNK_CHARS)))
+                    if not skipped:
+                        break
+                    skip -= skipped
+                page = f.read(max(0, min(length, total - offset)))
+        except (FileNotFoundError, ValueError):
+            return None
+        self.touch(path)
+        return page, total
+
+    @staticmethod
+    def touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """Delete blobs not written or read within retention_days"""
+        cutoff = time.time() - self.retention_days * 86400
+        for current, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(current, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                except OSError:
+                    continue
+
+    def expand(self, text: str) -> str:
+        """The full result behind a bounded() preview; other text is returned as is"""
+        match = TRUNCATION_NOTICE.search(text)
+        if not match:
+            return text
+        try:
+            with open(self.path(match.group(1)), "r", encoding="utf-8", newline="") as f:
+                f.readline()
+                return f.read()
+        except FileNotFoundError:
+            return text
+
+    def bounded(self, content: str, limit: int = RESULT_PREVIEW_CHARS) -> str:
+        """content itself if small, otherwise a preview plus a read_result handle"""
+        if len(content) <= limit:
+            return content
+        handle = self.put(content)
+        return (f"{content[:limit]}\n"
+                f"... [truncated: showing {limit} of {len(content)} characters. "
+                f"Call read_result(handle=\"{handle}\", offset={limit}) for more]")
+
+
+default_store = ResultStore()
+
+
+def read_result(handle: str, offset: int = 0, length: int = RESULT_PAGE_CHARS) -> str:
+    """Read part of a large tool result that was truncated in the conversation
+    ARGS:
+        handle (str): The handle from the truncated result
+        offset (int): Character offset to start from
+        length (int): Number of characters to return
+
+    RETURNS:
+        str: The requested slice of the result
+    """
+    offset = max(0, int(offset))
+    length = max(1, min(int(length), RESULT_PAGE_CHARS))
+    page = default_store.read(handle, offset, length)
+    if page is None:
+        return f"Error: No stored result with handle {handle}"
+
+    text, total = page
+    end = offset + len(text)
+    if end < total:
+        return f"{text}\n... [characters {offset}-{end} of {total}. Call read_result(handle=\"{handle}\", offset={end}) for more]"
+    return f"{text}\n... [characters {offset}-{end} of {total}, end of result]"
@@ -0,0 +1,189 @@
+# =====================================================
+#          FAIR-SHARE LLM REQUEST SCHEDULER
+# =====================================================
+# Every Agent in the process takes a slot from one scheduler before talking
+# to Ollama. When a slot frees up, the next request is chosen by:
+#
+#   1. priority class  interactive < planning < verification < batch
+#      (a waiting request ages up one class every SCHED_AGING_S seconds)
+#   2. model affinity  within that class, prefer the model that is already
+#      running so loaded models stay hot (capped by SCHED_HOT_STREAK)
+#   3. fairness        round-robin between sessions, FIFO within a session
+#
+# and never more than SCHED_PER_MODEL_LIMIT requests per model at once.
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+from config import (
+    SCHED_MAX_CONCURRENT,
+    SCHED_PER_MODEL_LIMIT,
+    SCHED_AGING_S,
+    SCHED_HOT_STREAK,
+)
+
+PRIORITIES = {
+    'interactive': 0,
+    'planning': 1,
+    'verification': 2,
+    'batch': 3,
+}
+
+
+class SlotCancelled(Exception):
+    """The request gave up its place in the queue (see slot(cancelled=...))"""
+
+
+class Ticket:
+    def __init__(self, seq, model, priority, session_id):
+        self.seq = seq
+        self.model = model
+        self.priority = PRIORITIES[priority]
+        self.session_id = session_id
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+    def effective_priority(self, now, aging):
+        return max(0, self.priority - int((now - self.enqueued) / aging)) if aging else self.priority
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrent=SCHED_MAX_CONCURRENT, per_model_limit=SCHED_PER_MODEL_LIMIT,
+                 aging=SCHED_AGING_S, hot_streak=SCHED_HOT_STREAK):
+        self.max_concurrent = max_concurrent
+        self.per_model_limit = per_model_limit
+        self.aging = aging
+        self.hot_streak = hot_streak
+
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        self.waiting: Dict[str, Deque[Ticket]] = {}  # session -> FIFO of tickets
+        self.session_order: Deque[str] = deque()      # round-robin order of sessions
+        self.running = Counter()                      # model -> requests in flight
+        self.hot_model = None
+        self.streak = 0
+        self.stats = Counter()
+
+    @contextmanager
+    def slot(self, model: str, priority: str = 'interactive', session_id: Optional[str] = None,
+             cancelled: Optional[threading.Event] = None):
+        """
+        Block until this request may talk to Ollama; release the slot on exit.
+        Setting cancelled while waiting leaves the queue (raises SlotCancelled).
+        """
+        ticket = self.enqueue(model, priority, session_id or "default")
+        try:
+            with self.cond:
+                while not ticket.granted:
+                    if cancelled is not None and cancelled.is_set():
+                        raise SlotCancelled(f"{model} request cancelled while queued")
+                    self.cond.wait(timeout=0.1 if cancelled is not None else None)
+        except BaseException:
+            self.cancel(ticket)
+            raise
+        self.stats[f"wait_ms_{priority}"] += int((time.monotonic() - ticket.enqueued) * 1000)
+        self.stats[f"granted_{priority}"] += 1
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    # -------------------------------------------------
+    #   queue bookkeeping (all under self.cond)
+    # -------------------------------------------------
+    def enqueue(self, model, priority, session_id) -> Ticket:
+        ticket = Ticket(next(self.seq), model, priority, session_id)
+        with self.cond:
+            if session_id not in self.waiting:
+                self.waiting[session_id] = deque()
+                self.session_order.append(session_id)
+            self.waiting[session_id].append(ticket)
+            self.dispatch()
+        return ticket
+
+    def cancel(self, ticket: Ticket):
+        with self.cond:
+            if ticket.granted:
+                self.running[ticket.model] -= 1
+            else:
+                queue = self.waiting.get(ticket.session_id)
+                if queue and ticket in queue:
+                    queue.remove(ticket)
+                    self.drop_if_empty(ticket.session_id)
+            self.dispatch()
+
+    def release(self, ticket: Ticket):
+        with self.cond:
+            self.running[ticket.model] -= 1
+            if self.running[ticket.model] <= 0:
+                del self.running[ticket.model]
+            self.dispatch()
+
+    def drop_if_empty(self, session_id):
+        if not self.waiting.get(session_id):
+            self.waiting.pop(session_id, None)
+            if session_id in self.session_order:
+                self.session_order.remove(session_id)
+
+    def candidates(self) -> List[Ticket]:
+        """Head ticket of every session, in round-robin order"""
+        return [self.waiting[s][0] for s in self.session_order if self.waiting.get(s)]
+
+    def pick(self) -> Optional[Ticket]:
+        now = time.monotonic()
+        eligible = [t for t in self.candidates() if self.running[t.model] < self.per_model_limit]
+        if not eligible:
+            return None
+
+        best = min(t.effective_priority(now, self.aging) for t in eligible)
+        top = [t for t in eligible if t.effective_priority(now, self.aging) == best]
+
+        # Keep the loaded model busy, unless it has hogged the server long enough
+        others_waiting = any(t.model != self.hot_model for t in top)
+        if self.hot_model and not (others_waiting and self.streak >= self.hot_streak):
+            for t in top:
+                if t.model == self.hot_model:
+                    return t
+        return top[0]
+
+    def dispatch(self):
+        """Grant slots while capacity allows (caller holds self.cond)"""
+        granted = False
+        while sum(self.running.values()) < self.max_concurrent:
+            ticket = self.pick()
+            if ticket is None:
+                break
+
+            self.waiting[ticket.session_id].popleft()
+            # Rotate the session to the back for round-robin fairness
+            self.session_order.remove(ticket.session_id)
+            if self.waiting[ticket.session_id]:
+                self.session_order.append(ticket.session_id)
+            else:
+                del self.waiting[ticket.session_id]
+
+            self.streak = self.streak + 1 if ticket.model == self.hot_model else 1
+            if ticket.model != self.hot_model:
+                self.stats["model_switches"] += 1
+            self.hot_model = ticket.model
+            self.running[ticket.model] += 1
+            ticket.granted = True
+            granted = True
+
+        if granted:
+            self.cond.notify_all()
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Process-wide scheduler shared by every Agent"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
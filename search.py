@@ -0,0 +1,271 @@
+# =====================================================
+#          WORKSPACE CODE SEARCH (trigram index)
+# =====================================================
+# An on-disk SQLite index mapping every lowercase trigram to the files that
+# contain it. A query only opens the files that contain all of its
+# trigrams. The index is refreshed incrementally: a rescan compares
+# (mtime, size) per file and only re-reads files that changed.
+#
+# Workspaces under ALLOWED_ROOT share the index of ALLOWED_ROOT and are
+# searched by path prefix; a workspace elsewhere (batch --output-dir, replay)
+# gets its own index, stored inside it.
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from config import (
+    ALLOWED_ROOT,
+    SEARCH_INDEX_PATH,
+    SEARCH_SKIP_DIRS,
+    SEARCH_MAX_FILE_BYTES,
+    SEARCH_REFRESH_INTERVAL,
+)
+
+
+def trigrams(text: str) -> set:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class WorkspaceIndex:
+    def __init__(self, root: str = ALLOWED_ROOT, db_path: str = SEARCH_INDEX_PATH):
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+
+        with self.connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS trigrams (
+                    tri TEXT NOT NULL,
+                    file_id INTEGER NOT NULL,
+                    PRIMARY KEY (tri, file_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS trigrams_file ON trigrams(file_id);
+            """)
+
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # -------------------------------------------------
+    #   indexing
+    # -------------------------------------------------
+    def walk(self):
+        """Yields (relative_path, mtime_ns, size) for every indexable file"""
+        index_name = os.path.basename(self.db_path)
+        stack = [self.root]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SEARCH_SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.startswith(index_name):
+                        st = entry.stat(follow_symlinks=False)
+                        if st.st_size <= SEARCH_MAX_FILE_BYTES:
+                            yield os.path.relpath(entry.path, self.root), st.st_mtime_ns, st.st_size
+                except OSError:
+                    continue
+
+    def read_text(self, rel_path: str) -> Optional[str]:
+        """File content, or None for binary/unreadable files"""
+        try:
+            with open(os.path.join(self.root, rel_path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if b'\x00' in data[:8192]:
+            return None
+        return data.decode('utf-8', errors='replace')
+
+    def refresh(self, force=False) -> Dict[str, int]:
+        """Re-index files whose mtime/size changed; returns counts"""
+        with self.lock:
+            if not force and time.time() - self.last_refresh < SEARCH_REFRESH_INTERVAL:
+                return {}
+
+            stats = {'added': 0, 'updated': 0, 'removed': 0}
+            with self.connect() as db:
+                known = {path: (fid, mtime, size) for fid, path, mtime, size in db.execute("SELECT id, path, mtime_ns, size FROM files")}
+
+                seen = set()
+                for path, mtime, size in self.walk():
+                    seen.add(path)
+                    entry = known.get(path)
+                    if entry and entry[1] == mtime and entry[2] == size:
+                        continue
+
+                    text = self.read_text(path)
+                    if entry:
+                        file_id = entry[0]
+                        db.execute("DELETE FROM trigrams WHERE file_id = ?", (file_id,))
+                        db.execute("UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?", (mtime, size, file_id))
+                        stats['updated'] += 1
+                    else:
+                        file_id = db.execute("INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)", (path, mtime, size)).lastrowid
+                        stats['added'] += 1
+
+                    if text is not None:
+                        db.executemany("INSERT OR IGNORE INTO trigrams (tri, file_id) VALUES (?, ?)",
+                                       ((tri, file_id) for tri in trigrams(text)))
+
+                for path, (file_id, _, _) in known.items():
+                    if path not in seen:
+                        db.execute("DELETE FROM trigrams WHERE file_id = ?", (file_id,))
+                        db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                        stats['removed'] += 1
+
+            self.last_refresh = time.time()
+            return stats
+
+    def ensure_fresh(self):
+        """
+        Build the index on first use; afterwards rescan in the background so a
+        query never waits on a full tree walk (results may lag one rescan)
+        """
+        if self.last_refresh == 0.0:
+            self.refresh(force=True)
+        elif time.time() - self.last_refresh >= SEARCH_REFRESH_INTERVAL and not self.lock.locked():
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    # -------------------------------------------------
+    #   querying
+    # -------------------------------------------------
+    def candidates(self, query: str) -> List[str]:
+        """Paths of files that contain every trigram of the query"""
+        grams = trigrams(query)
+        with self.connect() as db:
+            if not grams:  # queries under 3 characters can't use the index
+                return [row[0] for row in db.execute("SELECT path FROM files")]
+
+            placeholders = ",".join("?" * len(grams))
+            rows = db.execute(f"""
+                SELECT f.path FROM trigrams t JOIN files f ON f.id = t.file_id
+                WHERE t.tri IN ({placeholders})
+                GROUP BY t.file_id HAVING COUNT(*) = ?
+            """, (*grams, len(grams)))
+            return [row[0] for row in rows]
+
+    def search(self, query: str, max_results: int = 20, context: int = 1, prefix: str = "") -> List[Dict]:
+        """
+        Ranked matches for a literal, case-insensitive query
+
+        Each match: {"path", "line", "score", "context": [(line_no, text), ...]}
+        Exact-case hits, definitions (def/class) and matching file names rank higher.
+        prefix limits the search to one subdirectory (relative to the index root).
+        """
+        self.ensure_fresh()
+        needle = query.lower()
+        matches = []
+
+        for path in self.candidates(query):
+            if prefix and not path.startswith(prefix):
+                continue
+            text = self.read_text(path)
+            if text is None:
+                continue
+            lines = text.splitlines()
+            name_bonus = 3 if needle in os.path.basename(path).lower() else 0
+
+            for i, line in enumerate(lines):
+                if needle not in line.lower():
+                    continue
+                stripped = line.lstrip()
+                score = 1 + name_bonus
+                if query in line:
+                    score += 1
+                if stripped.startswith(("def ", "class ", "async def ")) and needle in stripped.split("(")[0].lower():
+                    score += 5
+                lo, hi = max(0, i - context), min(len(lines), i + context + 1)
+                matches.append({
+                    'path': path,
+                    'line': i + 1,
+                    'score': score,
+                    'context': [(n + 1, lines[n]) for n in range(lo, hi)],
+                })
+
+        matches.sort(key=lambda m: (-m['score'], m['path'], m['line']))
+        return matches[:max_results]
+
+
+_default_index: Optional[WorkspaceIndex] = None
+_indexes: Dict[str, WorkspaceIndex] = {}  # by root, for workspaces outside ALLOWED_ROOT
+_index_lock = threading.Lock()
+
+
+def get_index(root: Optional[str] = None) -> WorkspaceIndex:
+    """The ALLOWED_ROOT index, or the own index of a root outside it"""
+    global _default_index
+    with _index_lock:
+        if root is None:
+            if _default_index is None:
+                _default_index = WorkspaceIndex()
+            return _default_index
+        root = os.path.normcase(os.path.abspath(root))
+        if root not in _indexes:
+            _indexes[root] = WorkspaceIndex(root, os.path.join(root, os.path.basename(SEARCH_INDEX_PATH)))
+        return _indexes[root]
+
+
+def index_for(root: Optional[str]):
+    """(index, path prefix) to search a workspace with"""
+    index = get_index()
+    try:
+        prefix = os.path.relpath(os.path.abspath(root), index.root) if root else "."
+    except ValueError:
+        prefix = os.pardir  # another drive
+    if prefix == os.pardir or prefix.startswith(os.pardir + os.sep):
+        return get_index(root), ""  # outside ALLOWED_ROOT
+    return index, "" if prefix == "." else prefix + os.sep
+
+
+def search_workspace(query: str, max_results: int = 20, root: Optional[str] = None) -> str:
+    """Search all workspace files for a string
+    ARGS:
+        query (str): Text to look for (case-insensitive, literal)
+        max_results (int): Maximum number of matches to return
+
+    RETURNS:
+        str: Ranked matches with line numbers and surrounding lines
+    """
+    if not query or not query.strip():
+        return "Error: Empty search query"
+
+    # A session searches only its own workspace
+    try:
+        index, prefix = index_for(root)
+    except sqlite3.Error as e:
+        return f"Error searching workspace: {e}"
+
+    start = time.perf_counter()
+    try:
+        matches = index.search(query, max_results=int(max_results), prefix=prefix)
+    except sqlite3.Error as e:
+        return f"Error searching workspace: {e}"
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if not matches:
+        return f"No matches for '{query}' ({elapsed:.0f} ms)"
+
+    out = [f"{len(matches)} matches for '{query}' ({elapsed:.0f} ms):"]
+    for m in matches:
+        out.append(f"\n{os.path.join(index.root, m['path'])}:{m['line']}")
+        for line_no, text in m['context']:
+            marker = ">" if line_no == m['line'] else " "
+            out.append(f"  {marker}{line_no:>5}: {text[:200]}")
+    return "\n".join(out)
@@ -0,0 +1,447 @@
+# =====================================================
+#          AGENT SERVER (HTTP + WebSocket)
+# =====================================================
+# Hosts many isolated Agent sessions behind one process.
+#
+#   POST   /sessions                 -> create a session          {"model": "..."} (optional)
+#   GET    /sessions                 -> list sessions
+#   DELETE /sessions/<id>            -> drop a session
+#   POST   /sessions/<id>/messages   -> {"message": "..."}; streams NDJSON events
+#   GET    /sessions/<id>/ws         -> WebSocket; send text, receive JSON events
+#
+# Every event is a JSON object {"event": ..., ...}: token, tool_call,
+# tool_result, response, error.
+import base64
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from termcolor import colored
+from agent import Agent
+from loop_detector import loop_rate
+from tool_pool import size_tool_pool
+from check import KeepAlivePinger, warm_up_models
+from config import (
+    SERVER_HOST,
+    SERVER_PORT,
+    SESSIONS_ROOT,
+    MAX_SESSIONS,
+    SESSION_IDLE_TIMEOUT,
+    MAX_CONCURRENT_REQUESTS,
+    QUEUE_TIMEOUT,
+    MAX_MESSAGE_BYTES,
+)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+DEFAULT_MODEL = "qwen2.5:7b"
+
+
+class Session:
+    def __init__(self, session_id: str, model: str, workspace: str):
+        self.session_id = session_id
+        self.workspace = workspace
+        self.created = time.time()
+        self.last_used = self.created
+        self.lock = threading.Lock()  # one message at a time per session
+        self.agent = Agent(model=model, workspace=workspace)
+
+    def close(self, archive_dir: str):
+        """
+        Dropped or deleted session: write its training log, stop its background
+        thread and remove its workspace (the log is kept in archive_dir)
+        """
+        self.agent.training_logger.end_session()
+        self.agent.background.shutdown(wait=False, cancel_futures=True)
+        log = self.agent.training_logger.training_file
+        if os.path.exists(log):
+            shutil.move(log, os.path.join(archive_dir, f"training_data_{self.session_id}.jsonl"))
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+    def info(self):
+        return {
+            "session_id": self.session_id,
+            "model": self.agent.model,
+            "workspace": self.workspace,
+            "created": self.created,
+            "last_used": self.last_used,
+            "busy": self.lock.locked(),
+            "loops": dict(self.agent.loop_stats, wasted_rate=loop_rate(self.agent.loop_stats)),
+            "step_checks": dict(self.agent.verification_stats),
+        }
+
+
+class SessionStore:
+    """Thread-safe registry of sessions with idle expiry"""
+
+    def __init__(self, root=SESSIONS_ROOT, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.root = root
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def create(self, model=DEFAULT_MODEL) -> Session:
+        session_id = uuid.uuid4().hex[:12]
+        workspace = os.path.join(self.root, session_id)
+        os.makedirs(workspace, exist_ok=True)
+
+        # Building the Agent can load a model or the catalog: not under the
+        # lock, so lookups by other requests don't wait for it
+        session = Session(session_id, model, workspace)
+        with self.lock:
+            dropped = self._evict()
+            self.sessions[session_id] = session
+        self.close_all(dropped)
+        return session
+
+    def get(self, session_id) -> Optional[Session]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session:
+            session.last_used = time.time()
+        return session
+
+    def delete(self, session_id) -> bool:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session:
+            session.close(self.root)
+        return session is not None
+
+    def close_all(self, sessions):
+        for session in sessions:
+            try:
+                session.close(self.root)
+            except Exception as e:
+                print(colored("[ x ]    ", "red"), f"Closing session {session.session_id} failed: {e}")
+
+    def list(self):
+        with self.lock:
+            return [s.info() for s in self.sessions.values()]
+
+    def _evict(self):
+        """
+        Unregister expired sessions, then the oldest idle ones while over
+        capacity (lock held); returns them for close_all() outside the lock
+        """
+        now, dropped = time.time(), []
+        for sid, s in list(self.sessions.items()):
+            if now - s.last_used > self.idle_timeout and not s.lock.locked():
+                dropped.append(self.sessions.pop(sid))
+
+        idle = sorted((s for s in self.sessions.values() if not s.lock.locked()), key=lambda s: s.last_used)
+        while len(self.sessions) >= self.max_sessions and idle:
+            dropped.append(self.sessions.pop(idle.pop(0).session_id))
+        return dropped
+
+
+def message_from(payload) -> Optional[str]:
+    """The "message" of a request payload, or None if it isn't a non-empty string"""
+    message = payload.get("message", "") if isinstance(payload, dict) else None
+    return message if isinstance(message, str) and message.strip() else None
+
+
+class AgentService:
+    """Runs messages against sessions, bounded by a global Ollama concurrency limit"""
+
+    def __init__(self, store: SessionStore, max_concurrent=MAX_CONCURRENT_REQUESTS, queue_timeout=QUEUE_TIMEOUT):
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.queue_timeout = queue_timeout
+
+    def stream(self, session: Session, message: str):
+        """Generator of event dicts for one message; runs the agent in a worker thread"""
+        if not session.lock.acquire(blocking=False):
+            yield {"event": "error", "error": "Session is busy with another message"}
+            return
+
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            session.lock.release()
+            yield {"event": "error", "error": "Server busy, try again later", "retry_after": self.queue_timeout}
+            return
+
+        events = queue.Queue()
+        done = object()
+
+        def worker():
+            session.agent.on_event = lambda event, data: events.put({"event": event, **data})
+            try:
+                response = session.agent.process_message(message)
+                events.put({"event": "response", "content": response})
+            except Exception as e:
+                events.put({"event": "error", "error": str(e)})
+            finally:
+                session.agent.on_event = None
+                session.last_used = time.time()
+                self.slots.release()
+                session.lock.release()
+                events.put(done)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+        while (item := events.get()) is not done:
+            yield item
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service: AgentService = None  # set by make_server
+
+    # -------------------------------------------------
+    #   helpers
+    # -------------------------------------------------
+    def log_message(self, format, *args):
+        print(colored("[ x ]    ", "green"), format % args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        """The JSON body, {} without one, None if it is too large or not JSON"""
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return None
+        if not length:
+            return {}
+        if length > MAX_MESSAGE_BYTES:
+            self.close_connection = True  # the body is left unread
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+
+    def route(self):
+        """Returns (session_id, action) from the path"""
+        match = re.fullmatch(r"/sessions(?:/([0-9a-f]+)(?:/(messages|ws))?)?/?", self.path.split("?")[0])
+        if not match:
+            return None
+        return match.group(1), match.group(2)
+
+    # -------------------------------------------------
+    #   HTTP verbs
+    # -------------------------------------------------
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            return self.send_json(404, {"error": "Not found"})
+        session_id, action = route
+
+        if session_id is None:
+            return self.send_json(200, {"sessions": self.service.store.list()})
+
+        session = self.service.store.get(session_id)
+        if not session:
+            return self.send_json(404, {"error": f"Session {session_id} not found"})
+
+        if action == "ws":
+            return self.handle_websocket(session)
+        if action is None:
+            return self.send_json(200, session.info())
+        return self.send_json(405, {"error": "Method not allowed"})
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            return self.send_json(404, {"error": "Not found"})
+        session_id, action = route
+
+        payload = self.read_json()
+        if not isinstance(payload, dict):
+            return self.send_json(400, {"error": f"Body must be a JSON object of at most {MAX_MESSAGE_BYTES} bytes"})
+
+        if session_id is None:
+            model = payload.get("model", DEFAULT_MODEL)
+            if not isinstance(model, str) or not model.strip():
+                return self.send_json(400, {"error": "'model' must be a non-empty string"})
+            session = self.service.store.create(model=model)
+            return self.send_json(201, session.info())
+
+        session = self.service.store.get(session_id)
+        if not session:
+            return self.send_json(404, {"error": f"Session {session_id} not found"})
+        if action != "messages":
+            return self.send_json(405, {"error": "Method not allowed"})
+
+        message = message_from(payload)
+        if message is None:
+            return self.send_json(400, {"error": "'message' must be a non-empty string"})
+
+        # Stream events as NDJSON using chunked transfer encoding
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in self.service.stream(session, message):
+                line = (json.dumps(event) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away, the agent finishes in the background
+
+    def do_DELETE(self):
+        route = self.route()
+        if route is None or route[0] is None or route[1] is not None:
+            return self.send_json(404, {"error": "Not found"})
+        session = self.service.store.get(route[0])
+        if session and session.lock.locked():
+            return self.send_json(409, {"error": "Session is busy with a message"})  # its workspace is in use
+        if self.service.store.delete(route[0]):
+            return self.send_json(200, {"deleted": route[0]})
+        return self.send_json(404, {"error": f"Session {route[0]} not found"})
+
+    # -------------------------------------------------
+    #   WebSocket (RFC 6455, text messages only)
+    # -------------------------------------------------
+    def handle_websocket(self, session: Session):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            return self.send_json(400, {"error": "Expected a WebSocket upgrade"})
+
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            while True:
+                opcode, data = self.ws_recv_message()
+                if opcode is None:  # oversized or malformed: closed with a status code
+                    return
+                if opcode == 0x8:  # close
+                    self.ws_send(data[:2], opcode=0x8)
+                    return
+                if opcode != 0x1:
+                    continue
+
+                try:
+                    text = data.decode("utf-8")
+                except UnicodeDecodeError:
+                    self.ws_send(json.dumps({"event": "error", "error": "Text frames must be UTF-8"}).encode("utf-8"))
+                    continue
+                try:
+                    payload = json.loads(text)
+                except json.JSONDecodeError:
+                    payload = {"message": text}  # plain text frames are accepted as-is
+                if not isinstance(payload, dict):
+                    payload = {"message": text}
+                message = message_from(payload)
+                if message is None:
+                    self.ws_send(json.dumps({"event": "error", "error": "'message' must be a non-empty string"}).encode("utf-8"))
+                    continue
+
+                for event in self.service.stream(session, message):
+                    self.ws_send(json.dumps(event).encode("utf-8"))
+        except (ConnectionError, struct.error, OSError):
+            return
+
+    def ws_close(self, code: int, reason: str):
+        self.ws_send(struct.pack(">H", code) + reason.encode("utf-8"), opcode=0x8)
+
+    def ws_recv_message(self):
+        """
+        (opcode, payload) of the next message, fragments joined; pings are
+        answered here. (None, None) after closing the connection for a
+        message over MAX_MESSAGE_BYTES or a protocol error.
+        """
+        opcode, fragments, size = None, [], 0
+        while True:
+            fin, frame_opcode, length = self.ws_recv_header()
+            if size + length > MAX_MESSAGE_BYTES:
+                self.ws_close(1009, f"Message over {MAX_MESSAGE_BYTES} bytes")
+                return None, None
+            data = self.ws_recv_payload(length)
+
+            if frame_opcode >= 0x8:  # control frames may come between fragments
+                if frame_opcode == 0x9:
+                    self.ws_send(data, opcode=0xA)
+                elif frame_opcode == 0x8:
+                    return 0x8, data
+                continue
+            if (frame_opcode == 0x0) != (opcode is not None):
+                self.ws_close(1002, "Unexpected continuation frame")
+                return None, None
+
+            opcode = opcode if frame_opcode == 0x0 else frame_opcode
+            fragments.append(data)
+            size += length
+            if fin:
+                return opcode, b"".join(fragments)
+
+    def ws_recv_header(self):
+        """(fin, opcode, payload length) of the next frame; the mask is read with the payload"""
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            raise ConnectionError("WebSocket closed")
+        self.ws_masked = bool(header[1] & 0x80)
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self.rfile.read(8))[0]
+        return bool(header[0] & 0x80), header[0] & 0x0F, length
+
+    def ws_recv_payload(self, length: int) -> bytes:
+        mask = self.rfile.read(4) if self.ws_masked else b"\x00" * 4
+        payload = self.rfile.read(length)
+        if len(payload) < length:
+            raise ConnectionError("WebSocket closed")
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def ws_send(self, payload: bytes, opcode=0x1):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack(">H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack(">Q", len(payload))
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+
+def make_server(host=SERVER_HOST, port=SERVER_PORT, store: Optional[SessionStore] = None):
+    """Build (but don't start) the threaded HTTP server"""
+    service = AgentService(store or SessionStore())
+    size_tool_pool(service.max_concurrent)  # sessions run tools concurrently up to the request limit
+    handler = type("BoundAgentRequestHandler", (AgentRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT):
+    server = make_server(host, port)
+    warm_up_models([DEFAULT_MODEL])
+    pinger = KeepAlivePinger([DEFAULT_MODEL])
+    pinger.start()
+    print(colored("[ x ]    ", "green"), f"Agent server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(colored("[ x ]    ", "green"), "Shutting down server...")
+    finally:
+        pinger.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,197 @@
+# =====================================================
+#          COPY-ON-WRITE WORKSPACE SNAPSHOTS
+# =====================================================
+# A snapshot is a directory under <workspace>/.snapshots/<id> mirroring the
+# workspace, plus a manifest of (mtime_ns, size) per file. Files are
+# reflinked (FICLONE, on btrfs/xfs) where the filesystem supports it, which
+# copies no data. Otherwise a file unchanged since the previous snapshot is
+# hardlinked to that snapshot's copy, and only changed files are copied.
+#
+# Snapshot files never share an inode with the workspace, so tools that
+# edit files in place (shell redirects, appends) cannot corrupt them.
+#
+# Rollback stats the workspace against the manifest and only touches what
+# differs. New files are deleted. Changed or missing files are copied back
+# from the snapshot and renamed into place.
+import fnmatch
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from config import SNAPSHOT_DIR_NAME, SNAPSHOT_KEEP, SNAPSHOT_SKIP_DIRS, SNAPSHOT_EXCLUDE
+
+try:
+    import fcntl
+    FICLONE = 0x40049409  # _IOW(0x94, 9, int), Linux only
+except ImportError:  # Windows
+    fcntl = None
+
+
+def reflink(src: str, dst: str) -> bool:
+    """Clone src to dst sharing extents (copy-on-write); False if unsupported"""
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+class SnapshotManager:
+    def __init__(self, workspace: str, keep: int = SNAPSHOT_KEEP):
+        self.workspace = os.path.abspath(workspace)
+        self.root = os.path.join(self.workspace, SNAPSHOT_DIR_NAME)
+        self.keep = keep
+        self.reflinks = None  # decided on the first file
+        self.taken: List[str] = []
+        self.stats = {'snapshots': 0, 'restored': 0, 'deleted': 0, 'unrestorable': 0}
+
+    def excluded(self, rel_path: str) -> bool:
+        name = os.path.basename(rel_path)
+        return any(fnmatch.fnmatch(name, pattern) for pattern in SNAPSHOT_EXCLUDE)
+
+    def walk(self) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+        """({relative_path: (mtime_ns, size)}, [relative_dirs]) of the workspace"""
+        files, dirs = {}, []
+        stack = [self.workspace]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    rel = os.path.relpath(entry.path, self.workspace)
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SNAPSHOT_SKIP_DIRS and entry.name != SNAPSHOT_DIR_NAME:
+                            dirs.append(rel)
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not self.excluded(rel):
+                        st = entry.stat(follow_symlinks=False)
+                        files[rel] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return files, dirs
+
+    def copy(self, src: str, dst: str):
+        """Independent copy of src at dst, copy-on-write when possible"""
+        if self.reflinks is not False:
+            self.reflinks = reflink(src, dst)
+            if self.reflinks:
+                return
+        shutil.copy2(src, dst)  # keeps mtime, so the manifest still matches
+
+    def capture(self, rel: str, state, target: str, previous: Optional[Dict]):
+        """Put the workspace file rel into the snapshot at target"""
+        dst = os.path.join(target, rel)
+        if not self.reflinks and previous and tuple(previous['files'].get(rel, ())) == tuple(state):
+            try:
+                os.link(os.path.join(self.root, previous['id'], rel), dst)  # unchanged: share the older copy
+                return
+            except OSError:
+                pass
+        self.copy(os.path.join(self.workspace, rel), dst)
+
+    # -------------------------------------------------
+    #   snapshots
+    # -------------------------------------------------
+    def take(self, label: str = "") -> Optional[str]:
+        """Snapshot the workspace; returns the snapshot id (None on failure)"""
+        snapshot_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        target = os.path.join(self.root, snapshot_id)
+        previous = self.manifest(self.taken[-1]) if self.taken else None
+        try:
+            files, dirs = self.walk()
+            os.makedirs(target)
+            for rel in dirs:
+                os.makedirs(os.path.join(target, rel), exist_ok=True)
+            for rel, state in list(files.items()):
+                try:
+                    self.capture(rel, state, target, previous)
+                except OSError:
+                    del files[rel]  # vanished or unreadable; rollback will leave it alone
+            with open(os.path.join(target, "manifest.json"), 'w', encoding='utf-8') as f:
+                json.dump({'id': snapshot_id, 'label': label, 'files': files, 'dirs': dirs}, f)
+        except OSError as e:
+            print(f"⚠️ Snapshot failed: {e}")
+            shutil.rmtree(target, ignore_errors=True)
+            return None
+
+        self.taken.append(snapshot_id)
+        self.stats['snapshots'] += 1
+        self.prune()
+        return snapshot_id
+
+    def prune(self):
+        """Keep only the newest self.keep snapshots"""
+        while len(self.taken) > self.keep:
+            shutil.rmtree(os.path.join(self.root, self.taken.pop(0)), ignore_errors=True)
+
+    def manifest(self, snapshot_id: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.root, snapshot_id, "manifest.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def restore_file(self, snapshot_id: str, rel: str) -> bool:
+        src = os.path.join(self.root, snapshot_id, rel)
+        dst = os.path.join(self.workspace, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.rollback.tmp"
+        try:
+            self.copy(src, tmp)
+            os.replace(tmp, dst)
+            return True
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+
+    def rollback(self, snapshot_id: str) -> Optional[Dict]:
+        """Restore the workspace to a snapshot, touching only files that differ"""
+        manifest = self.manifest(snapshot_id)
+        if manifest is None:
+            return None
+
+        saved = manifest['files']
+        current, current_dirs = self.walk()
+        result = {'restored': [], 'deleted': [], 'unrestorable': []}
+
+        for rel, state in current.items():
+            if rel not in saved:
+                try:
+                    os.remove(os.path.join(self.workspace, rel))
+                    result['deleted'].append(rel)
+                except OSError:
+                    result['unrestorable'].append(rel)
+            elif tuple(state) != tuple(saved[rel]):
+                (result['restored'] if self.restore_file(snapshot_id, rel) else result['unrestorable']).append(rel)
+
+        for rel in saved:
+            if rel not in current:
+                (result['restored'] if self.restore_file(snapshot_id, rel) else result['unrestorable']).append(rel)
+
+        # Directories created after the snapshot, deepest first, if now empty
+        known = set(manifest['dirs'])
+        for rel in sorted((d for d in current_dirs if d not in known), key=len, reverse=True):
+            try:
+                os.rmdir(os.path.join(self.workspace, rel))
+            except OSError:
+                pass
+
+        for key in result:
+            self.stats[key] += len(result[key])
+        return result
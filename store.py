@@ -0,0 +1,134 @@
+# =====================================================
+#          PERSISTENT CONVERSATION STORE (SQLite, WAL)
+# =====================================================
+# Every conversation message is appended here as it happens, once: the
+# Agent writes on the "agent" channel and TrainingDataLogger reads its
+# sessions back from there. Resuming a session only reads the newest
+# messages that fit the context window. Each session's owning workspace is
+# kept too, so readers of many sessions (memory.py) can scope by owner.
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from config import CONVERSATION_DB_PATH
+
+
+class ConversationStore:
+    def __init__(self, db_path: str = CONVERSATION_DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()  # sqlite connections are per thread
+
+        db = self.db()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                ts REAL NOT NULL,
+                role TEXT,
+                chars INTEGER NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, channel, id);
+            CREATE INDEX IF NOT EXISTS messages_ts ON messages(ts);
+            CREATE TABLE IF NOT EXISTS owners (
+                session_id TEXT PRIMARY KEY,
+                workspace TEXT NOT NULL
+            );
+        """)
+        db.commit()
+
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, fast appends
+            self.local.db = db
+        return db
+
+    def append(self, session_id: str, message: Dict, channel: str = "agent") -> int:
+        """Store a message; returns its id"""
+        content = message.get("content") or message.get("value") or ""
+        db = self.db()
+        cursor = db.execute(
+            "INSERT INTO messages (session_id, channel, ts, role, chars, message) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, channel, time.time(), message.get("role") or message.get("from"),
+             len(str(content)), json.dumps(message, ensure_ascii=False, default=str))
+        )
+        db.commit()
+        return cursor.lastrowid
+
+    def messages(self, session_id: str, channel: str = "agent") -> List[Dict]:
+        rows = self.db().execute(
+            "SELECT message FROM messages WHERE session_id = ? AND channel = ? ORDER BY id",
+            (session_id, channel)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def rows(self, session_id: str, after_id: int = 0, channel: str = "agent") -> List[tuple]:
+        """(id, ts, message) of a session's messages after after_id, oldest first"""
+        rows = self.db().execute(
+            "SELECT id, ts, message FROM messages WHERE session_id = ? AND channel = ? AND id > ? ORDER BY id",
+            (session_id, channel, after_id)
+        )
+        return [(i, ts, json.loads(m)) for i, ts, m in rows]
+
+    def tail(self, session_id: str, max_chars: int, channel: str = "agent") -> List[Dict]:
+        """Newest messages whose combined content fits in max_chars, oldest first"""
+        rows = self.db().execute(
+            "SELECT chars, message FROM messages WHERE session_id = ? AND channel = ? ORDER BY id DESC",
+            (session_id, channel)
+        )
+        tail, used = [], 0
+        for chars, message in rows:  # cursor is lazy: stops reading at the budget
+            if used + chars > max_chars and tail:
+                break
+            tail.append(json.loads(message))
+            used += chars
+        tail.reverse()
+        return tail
+
+    def since(self, last_id: int, channel: str = "agent", limit: int = 5000) -> List[tuple]:
+        """(id, session_id, ts, message) rows after last_id, for incremental readers"""
+        rows = self.db().execute(
+            "SELECT id, session_id, ts, message FROM messages WHERE id > ? AND channel = ? ORDER BY id LIMIT ?",
+            (last_id, channel, limit)
+        )
+        return [(i, s, ts, json.loads(m)) for i, s, ts, m in rows]
+
+    def clear(self, session_id: str, channel: str = "agent"):
+        db = self.db()
+        db.execute("DELETE FROM messages WHERE session_id = ? AND channel = ?", (session_id, channel))
+        db.commit()
+
+    def set_owner(self, session_id: str, workspace: str):
+        """Record the workspace a session belongs to (the first owner stays)"""
+        db = self.db()
+        db.execute("INSERT OR IGNORE INTO owners (session_id, workspace) VALUES (?, ?)", (session_id, workspace))
+        db.commit()
+
+    def owner(self, session_id: str) -> Optional[str]:
+        row = self.db().execute("SELECT workspace FROM owners WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def sessions(self, limit: int = 50) -> List[Dict]:
+        """Most recently active sessions"""
+        rows = self.db().execute("""
+            SELECT session_id, MIN(ts), MAX(ts), COUNT(*) FROM messages
+            WHERE channel = 'agent' GROUP BY session_id ORDER BY MAX(ts) DESC LIMIT ?
+        """, (limit,))
+        return [{"session_id": s, "started": a, "updated": b, "messages": n} for s, a, b, n in rows]
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ConversationStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
@@ -0,0 +1,121 @@
+# =====================================================
+#          READ-ONLY TOOL MEMOIZATION
+# =====================================================
+# Remembers which read-only tool calls were already answered in this
+# conversation and the on-disk state of their target at that time
+# (mtime, size, inode). Repeating such a call while the target is unchanged
+# returns a short reference to the earlier call (by its tool_call_id)
+# instead of another full copy of the content. Speculative plan steps use
+# the cache from a background thread, so every method takes the lock.
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+# tool name -> argument holding the path it reads
+READ_ONLY_TOOLS = {
+    'read_file': 'file_path',
+    'list_directory': 'dir_path',
+}
+
+# tool name -> argument holding the path it modifies
+WRITE_TOOLS = {
+    'write_file': 'file_path',
+    'delete_file': 'file_path',
+}
+
+# tool name -> (argument holding a list of files, key of the path in each entry)
+BULK_WRITE_TOOLS = {
+    'write_files': ('files', 'file_path'),
+}
+
+# Tools that can touch anything; they drop the whole cache
+UNTRACKED_WRITE_TOOLS = {'run_shell_command', 'create_and_setup_venv'}
+
+
+def file_state(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ToolCache:
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getcwd()  # relative paths are relative to the agent's workspace
+        self.entries: Dict[str, Dict] = {}  # key -> {"path", "state", "call"}
+        self.calls = 0
+        self.hits = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(name: str, arguments: Dict) -> str:
+        return json.dumps([name, arguments], sort_keys=True, default=str)
+
+    def resolve(self, path) -> Optional[str]:
+        return os.path.abspath(os.path.join(self.root, os.path.normpath(path))) if isinstance(path, str) else None
+
+    def target(self, name: str, arguments: Dict) -> Optional[str]:
+        arg = READ_ONLY_TOOLS.get(name) or WRITE_TOOLS.get(name)
+        return self.resolve(arguments.get(arg)) if arg else None
+
+    def lookup(self, name: str, arguments: Dict) -> Optional[str]:
+        """Short reference if this read was already answered and the target is unchanged"""
+        with self.lock:
+            self.calls += 1
+            if name not in READ_ONLY_TOOLS:
+                return None
+
+            entry = self.entries.get(self.key(name, arguments))
+            if not entry or not entry['call'] or entry['state'] is None or file_state(entry['path']) != entry['state']:
+                return None
+
+            self.hits += 1
+            return (f"[Unchanged since call {entry['call']}: {name}({entry['path']}) would return exactly "
+                    f"the same result as before. Use that earlier result instead of calling again.]")
+
+    def record(self, name: str, arguments: Dict, call_id: Optional[str] = None):
+        """Remember a read (answered by tool call call_id) after it ran; writes invalidate what they touched"""
+        with self.lock:
+            self._record(name, arguments, call_id)
+
+    def _record(self, name: str, arguments: Dict, call_id: Optional[str]):
+        if name in READ_ONLY_TOOLS:
+            path = self.target(name, arguments)
+            self.entries[self.key(name, arguments)] = {
+                'path': path,
+                'state': file_state(path),
+                'call': call_id,
+            }
+        elif name in WRITE_TOOLS:
+            self.invalidate(self.target(name, arguments))
+        elif name in BULK_WRITE_TOOLS:
+            arg, key = BULK_WRITE_TOOLS[name]
+            files = arguments.get(arg)
+            if not isinstance(files, list):
+                return self.clear()  # dict or JSON-string form: not worth parsing here
+            for entry in files:
+                path = entry.get(key) if isinstance(entry, dict) else None
+                self.invalidate(self.resolve(path))
+        elif name in UNTRACKED_WRITE_TOOLS:
+            self.clear()
+
+    def invalidate(self, path: Optional[str]):
+        """Drop entries for path and for the directory that contains it"""
+        if not path:
+            return self.clear()
+        parent = os.path.dirname(path)
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if e['path'] in (path, parent)]:
+                del self.entries[key]
+
+    def forget(self, call_id: str):
+        """Drop the entry of a call whose result never reached the conversation"""
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if e['call'] == call_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,278 @@
+# =====================================================
+#          ISOLATED TOOL WORKER POOL
+# =====================================================
+# Tools run in a fixed set of pre-started worker processes instead of the
+# agent's own process:
+#
+#   * every call has a wall-clock timeout (TOOL_TIMEOUT, or the tool's entry
+#     in TOOL_LONG_TIMEOUTS); a worker that doesn't answer in time is killed
+#     together with its process group (shell commands it started) and replaced
+#   * workers run under CPU and address-space rlimits (POSIX only), so a
+#     runaway tool dies on its own without taking the agent down. The
+#     address-space cap is a soft limit that commands started by a tool
+#     (shell, pip) get lifted again (child_preexec): Node and JVM processes
+#     reserve more virtual memory than that and would not even start
+#   * the pool has TOOL_POOL_SIZE workers per concurrently running agent
+#     (size_tool_pool: the server and batch runs call it); a call waits at
+#     most TOOL_POOL_WAIT seconds for a free worker, then fails
+#   * the raw result comes back; the agent bounds it once (Agent.run_tool)
+#   * workers are recycled after TOOL_WORKER_MAX_CALLS calls, so leaks in
+#     tool code don't accumulate over a long session
+#
+# Tools that only read agent-side state kept in memory (search index,
+# memory index, result store) stay in process: see TOOL_POOL_IN_PROCESS.
+import atexit
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, Optional
+from termcolor import colored
+from config import (
+    TOOL_POOL_SIZE,
+    TOOL_POOL_WAIT,
+    TOOL_TIMEOUT,
+    TOOL_CPU_SECONDS,
+    TOOL_LONG_TIMEOUTS,
+    TOOL_MEMORY_MB,
+    TOOL_WORKER_MAX_CALLS,
+)
+
+try:
+    import resource  # not on Windows
+except ImportError:
+    resource = None
+
+
+class ToolCallError(Exception):
+    """A tool raised, crashed its worker or timed out"""
+
+
+class ToolTimeout(ToolCallError):
+    pass
+
+
+# -------------------------------------------------
+#   worker side
+# -------------------------------------------------
+WORKER_ENV = "AGENT_TOOL_WORKER"  # set in workers, so tools know their children need child_preexec
+
+
+def set_limits(memory_mb: int):
+    if hasattr(os, "setsid"):
+        os.setsid()  # own process group: a timeout kills the shell commands too
+    os.environ[WORKER_ENV] = "1"
+    if resource and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        try:
+            hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+            resource.setrlimit(resource.RLIMIT_AS, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+        except (ValueError, OSError):
+            pass
+
+
+def lift_memory_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+
+
+def child_preexec():
+    """
+    preexec_fn for subprocesses started by a tool: in a worker, lifts the
+    worker's soft address-space cap (workers are single-threaded, so a
+    preexec_fn is safe there); None in the agent's own process
+    """
+    return lift_memory_limit if resource and os.environ.get(WORKER_ENV) else None
+
+
+def limit_cpu(seconds: int):
+    """CPU rlimits are per process lifetime: allow `seconds` more than used so far"""
+    if not (resource and seconds):
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + seconds
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+    except (ValueError, OSError):
+        pass
+
+
+def worker_main(conn, memory_mb: int, cpu_seconds: int):
+    set_limits(memory_mb)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is for the agent, which kills us itself
+    from tools import available_functions
+    conn.send(("ready", None))  # imports done: call timeouts start counting from here
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+        name, arguments = request
+        limit_cpu(TOOL_LONG_TIMEOUTS[name][1] if name in TOOL_LONG_TIMEOUTS else cpu_seconds)
+        try:
+            reply = ("ok", str(available_functions[name](**arguments)))
+        except MemoryError:
+            reply = ("error", f"{name} ran out of memory (limit {memory_mb} MB)")
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        try:
+            conn.send(reply)
+        except (BrokenPipeError, OSError):
+            return
+
+
+# -------------------------------------------------
+#   agent side
+# -------------------------------------------------
+class Worker:
+    def __init__(self, context, memory_mb: int, cpu_seconds: int):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child, memory_mb, cpu_seconds), daemon=True)
+        self.process.start()
+        child.close()
+        self.calls = 0
+        self.ready = False
+
+    def wait_ready(self, timeout: float = 60) -> bool:
+        if not self.ready and self.conn.poll(timeout):
+            self.ready = self.conn.recv()[0] == "ready"
+        return self.ready
+
+    def kill(self):
+        pid = self.process.pid
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(pid, signal.SIGKILL)  # worker and everything it started
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class ToolPool:
+    def __init__(self, size: int = TOOL_POOL_SIZE, timeout: float = TOOL_TIMEOUT, cpu_seconds: int = TOOL_CPU_SECONDS,
+                 memory_mb: int = TOOL_MEMORY_MB, max_calls: int = TOOL_WORKER_MAX_CALLS):
+        methods = multiprocessing.get_all_start_methods()
+        # forkserver forks from a clean single-threaded server (the agent has
+        # threads); Windows only has spawn
+        self.context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if "forkserver" in methods:
+            self.context.set_forkserver_preload(["tools"])
+        self.size = size
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_calls = max_calls
+        self.idle: "queue.Queue[Worker]" = queue.Queue()
+        self.stats = {'calls': 0, 'timeouts': 0, 'crashes': 0, 'recycled': 0, 'waits': 0}
+        self.lock = threading.Lock()
+        for _ in range(size):
+            self.idle.put(self.spawn())
+
+    def spawn(self) -> Worker:
+        return Worker(self.context, self.memory_mb, self.cpu_seconds)
+
+    def grow(self, size: int):
+        """Add workers up to size (the pool never shrinks)"""
+        with self.lock:
+            extra, self.size = max(size - self.size, 0), max(size, self.size)
+        for _ in range(extra):
+            self.idle.put(self.spawn())
+
+    def replace(self, worker: Worker, reason: str):
+        worker.kill()
+        with self.lock:
+            self.stats[reason] += 1
+        self.idle.put(self.spawn())
+
+    def call(self, name: str, arguments: Dict, timeout: Optional[float] = None) -> str:
+        """Run available_functions[name](**arguments) in a worker; raises ToolCallError"""
+        timeout = timeout or (TOOL_LONG_TIMEOUTS[name][0] if name in TOOL_LONG_TIMEOUTS else self.timeout)
+        try:
+            worker = self.idle.get(timeout=TOOL_POOL_WAIT)  # every worker busy: wait, but not forever
+        except queue.Empty:
+            with self.lock:
+                self.stats['waits'] += 1
+            raise ToolCallError(f"{name} not run: all {self.size} tool workers stayed busy for {TOOL_POOL_WAIT}s")
+        with self.lock:
+            self.stats['calls'] += 1
+        start = time.monotonic()
+        try:
+            if not worker.wait_ready():
+                raise EOFError
+            worker.conn.send((name, arguments))
+            if not worker.conn.poll(timeout):
+                self.replace(worker, 'timeouts')
+                print(colored("[ x ]    ", "red"), f"{name} timed out after {timeout:.0f}s, worker replaced")
+                raise ToolTimeout(f"{name} timed out after {timeout:.0f}s")
+            status, result = worker.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError, OSError):
+            worker.process.join(timeout=1)
+            code = worker.process.exitcode
+            self.replace(worker, 'crashes')
+            how = f"killed by signal {-code}" if code and code < 0 else f"exit code {code}"
+            raise ToolCallError(f"{name} crashed its worker after {time.monotonic() - start:.1f}s ({how}; "
+                                f"limits: {self.cpu_seconds}s CPU, {self.memory_mb} MB)")
+
+        worker.calls += 1
+        if worker.calls >= self.max_calls:
+            worker.stop()
+            with self.lock:
+                self.stats['recycled'] += 1
+            self.idle.put(self.spawn())
+        else:
+            self.idle.put(worker)
+
+        if status != "ok":
+            raise ToolCallError(result)
+        return result
+
+    def shutdown(self):
+        while True:
+            try:
+                self.idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+_pool: Optional[ToolPool] = None
+_pool_lock = threading.Lock()
+_pool_size = TOOL_POOL_SIZE
+
+
+def size_tool_pool(agents: int):
+    """Make room for `agents` agents running at once (TOOL_POOL_SIZE workers each)"""
+    global _pool_size
+    with _pool_lock:
+        _pool_size = max(_pool_size, agents * TOOL_POOL_SIZE)
+        pool = _pool
+    if pool is not None:
+        pool.grow(_pool_size)
+
+
+def get_tool_pool() -> ToolPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ToolPool(size=_pool_size)
+            atexit.register(_pool.shutdown)
+        return _pool
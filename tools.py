@@ -3,11 +3,18 @@ import json
 import ollama
 import subprocess
 import shlex
+import tempfile
+import shutil
 import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Callable
 from ollama import chat
 from check import MODEL
-from config import ALLOWED_ROOT
+from config import ALLOWED_ROOT, BULK_IO_WORKERS
+from results import read_result
+from search import search_workspace
+from memory import recall
+from tool_pool import child_preexec
 
 
 def get_temperature(city: str) -> str:
@@ -28,8 +35,21 @@ def get_temperature(city: str) -> str:
     }
     return temperature.get(city, "City not found")
 
+
+def inside_root(file_path, root=None):
+    """
+    Normalized path if it is inside root (default ALLOWED_ROOT), else None.
+    Relative paths are taken relative to root.
+    """
+    if not isinstance(file_path, str) or not file_path:
+        return None
+    normalized_root = os.path.abspath(os.path.normpath(root or ALLOWED_ROOT))
+    normalized_path = os.path.abspath(os.path.join(normalized_root, os.path.normpath(file_path)))
+    path, base = normalized_path.lower(), normalized_root.lower().rstrip(os.sep)
+    return normalized_path if path == base or path.startswith(base + os.sep) else None
+
     
-def write_file(file_path, content):
+def write_file(file_path, content, root=None):
     """
     Write content to a file
     """
@@ -41,21 +61,28 @@ def write_file(file_path, content):
     print(f"🔴 DEBUG - First 20 chars: {repr(content[:20])}")
     print(f"🔴 DEBUG - Last 20 chars: {repr(content[-20:]) if len(content) > 20 else 'too short'}")
     
-    allowed_root = r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-    normalized_path = os.path.abspath(os.path.normpath(file_path))
-    normalized_root = os.path.abspath(os.path.normpath(allowed_root))
-    
     # Security check
-    if not normalized_path.lower().startswith(normalized_root.lower()):
+    normalized_path = inside_root(file_path, root)
+    if not normalized_path:
         return f"Error: Access denied"
     
     try:
-        # Write the file
-        with open(normalized_path, 'w') as f:
-            f.write(content)
-        
+        # Write a temp file and rename it over the target, so readers never see a
+        # half-written file and a failed write leaves the old content in place
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(normalized_path), prefix=".write_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            # mkstemp creates 0600; keep the mode a plain open() would have given
+            os.chmod(tmp_path, os.stat(normalized_path).st_mode if os.path.exists(normalized_path) else 0o644)
+            os.replace(tmp_path, normalized_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
         # Verify by reading back
-        with open(normalized_path, 'r') as f:
+        with open(normalized_path, 'r', encoding='utf-8', errors='replace', newline='') as f:
             written_content = f.read()
         
         print(f"🔴 DEBUG - Written content: {repr(written_content)}")
@@ -69,7 +96,7 @@ def write_file(file_path, content):
         return f"❌ Error writing file: {str(e)}"
 
 
-def read_file(file_path):
+def read_file(file_path, root=None):
     """
     Read content from a file
     """
@@ -77,16 +104,13 @@ def read_file(file_path):
     
     print(f"🔵 DEBUG - Reading file: {file_path}")
     
-    allowed_root = r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-    normalized_path = os.path.abspath(os.path.normpath(file_path))
-    normalized_root = os.path.abspath(os.path.normpath(allowed_root))
-    
     # Security check
-    if not normalized_path.lower().startswith(normalized_root.lower()):
+    normalized_path = inside_root(file_path, root)
+    if not normalized_path:
         return f"Error: Access denied"
     
     try:
-        with open(normalized_path, 'r') as f:
+        with open(normalized_path, 'r', encoding='utf-8', errors='replace') as f:
             content = f.read()
         
         print(f"🔵 DEBUG - Read content: {repr(content)}")
@@ -96,7 +120,145 @@ def read_file(file_path):
     except Exception as e:
         return f"Error reading file: {str(e)}"
     
-def delete_file(file_path: str) -> str:
+def read_files(file_paths, root=None):
+    """
+    Read several files at once (concurrently) and return them in one result
+    """
+    if isinstance(file_paths, str):
+        try:
+            file_paths = json.loads(file_paths)
+        except json.JSONDecodeError:
+            file_paths = [file_paths]
+    if not isinstance(file_paths, list) or not file_paths:
+        return "Error: file_paths must be a non-empty list of paths"
+
+    def read_one(file_path):
+        """(content, ok): a file may itself start with "Error", so failures are flagged"""
+        path = inside_root(file_path, root)
+        if not path:
+            return "Error: Access denied", False
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read(), True
+        except Exception as e:
+            return f"Error reading file: {str(e)}", False
+
+    with ThreadPoolExecutor(max_workers=min(BULK_IO_WORKERS, len(file_paths))) as pool:
+        results = list(pool.map(read_one, file_paths))
+
+    failed = sum(1 for _, ok in results if not ok)
+    parts = [f"Read {len(file_paths) - failed} of {len(file_paths)} files" + (f" ({failed} failed)" if failed else "")]
+    for file_path, (content, ok) in zip(file_paths, results):
+        parts.append(f"===== {file_path} ({len(content)} chars) =====\n{content}" if ok else
+                     f"===== {file_path} (failed) =====\n{content}")
+    return "\n\n".join(parts)
+
+
+def write_files(files, root=None):
+    """
+    Write several files as one group: either every file is written or none is
+    
+    files: [{"file_path": ..., "content": ...}] (a {path: content} dict works too)
+    """
+    if isinstance(files, str):
+        try:
+            files = json.loads(files)
+        except json.JSONDecodeError:
+            return "Error: files must be a list of {file_path, content} objects"
+    if isinstance(files, dict):
+        files = [{"file_path": k, "content": v} for k, v in files.items()]
+    if not isinstance(files, list) or not files or not all(isinstance(f, dict) for f in files):
+        return "Error: files must be a non-empty list of {file_path, content} objects"
+
+    # Validate everything before touching the disk
+    targets = []
+    for entry in files:
+        path, content = inside_root(entry.get("file_path"), root), entry.get("content")
+        if not path:
+            return f"Error: Access denied for {entry.get('file_path')}. No files were changed"
+        if not isinstance(content, str):
+            return f"Error: content for {entry.get('file_path')} must be a string. No files were changed"
+        targets.append((entry["file_path"], path, content))
+    if len({path for _, path, _ in targets}) != len(targets):
+        return "Error: the same file appears more than once. No files were changed"
+
+    # Phase 1: every file goes to a temp file next to its target, concurrently
+    def stage(target):
+        _, path, content = target
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".write_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            os.chmod(tmp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    staged, backups, replaced, created_dirs = {}, {}, [], []
+    try:
+        # Missing parent directories, recorded one by one so a failure halfway
+        # still removes the ones already made
+        for _, path, _ in targets:
+            missing = []
+            parent = os.path.dirname(path)
+            while parent and not os.path.isdir(parent):
+                missing.append(parent)
+                parent = os.path.dirname(parent)
+            for d in reversed(missing):
+                os.makedirs(d, exist_ok=True)
+                created_dirs.append(d)
+
+        with ThreadPoolExecutor(max_workers=min(BULK_IO_WORKERS, len(targets))) as pool:
+            futures = {target[1]: pool.submit(stage, target) for target in targets}
+            errors = []
+            for path, future in futures.items():
+                try:
+                    staged[path] = future.result()
+                except Exception as e:
+                    errors.append(f"{path}: {e}")
+            if errors:
+                raise OSError("; ".join(errors))
+
+        # Phase 2: keep the old versions (hardlinks, no copy), then rename into place
+        for _, path, _ in targets:
+            if os.path.exists(path):
+                backup = path + ".rollback.tmp"
+                try:
+                    os.link(path, backup)
+                except OSError:
+                    shutil.copy2(path, backup)
+                backups[path] = backup
+        for _, path, _ in targets:
+            os.replace(staged[path], path)
+            del staged[path]
+            replaced.append(path)
+    except Exception as e:
+        # Undo: put old versions back, remove new files and directories we created
+        for path in replaced:
+            if path in backups:
+                os.replace(backups.pop(path), path)
+            elif os.path.exists(path):
+                os.remove(path)
+        for tmp_path in list(staged.values()) + list(backups.values()):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        for d in reversed(created_dirs):
+            try:
+                os.rmdir(d)
+            except OSError:
+                pass
+        return f"❌ Error writing files: {str(e)}. No files were changed"
+
+    for backup in backups.values():
+        os.remove(backup)
+    sizes = [os.path.getsize(path) for _, path, _ in targets]  # on disk: encoding and newlines change the length
+    lines = [f"✅ Wrote {len(targets)} files ({sum(sizes)} bytes)"]
+    lines += [f"  - {file_path} ({size} bytes)" for (file_path, _, _), size in zip(targets, sizes)]
+    return "\n".join(lines)
+
+
+def delete_file(file_path: str, root=None) -> str:
     """Delete a file
     ARGS:
         file_path (str): The path to the file
@@ -106,10 +268,10 @@ def delete_file(file_path: str) -> str:
     """
     
     # Normalize the path to resolve any '..' or '.' components
-    normalized_path = os.path.normpath(file_path)
+    normalized_path = inside_root(file_path, root)
     
-    if not normalized_path.startswith(ALLOWED_ROOT):
-        return f"Error: Access to {file_path} is denied. Allowed root is {ALLOWED_ROOT}."
+    if not normalized_path:
+        return f"Error: Access to {file_path} is denied. Allowed root is {root or ALLOWED_ROOT}."
     
     if not os.path.exists(normalized_path):
         return f"File {normalized_path} does not exist."
@@ -124,7 +286,7 @@ def delete_file(file_path: str) -> str:
     except Exception as e:
         return f"Error deleting file: {e}"
 
-def create_and_setup_venv(workspace_path: str, packages=None) -> str:
+def create_and_setup_venv(workspace_path: str, packages=None, root=None) -> str:
     """Create a virtual environment and optionally install packages
     ARGS:
         workspace_path (str): Path where to create the venv
@@ -138,21 +300,21 @@ def create_and_setup_venv(workspace_path: str, packages=None) -> str:
     import sys
     import ast  # Add this for safe parsing
     
-    # Normalize the path
-    workspace_path = os.path.normpath(workspace_path)
+    # Normalize the path + security check
+    normalized_path = inside_root(workspace_path, root)
+    if not normalized_path:
+        return f"Error: Access to {workspace_path} is denied. Allowed root is {root or ALLOWED_ROOT}."
+    workspace_path = normalized_path
     venv_path = os.path.join(workspace_path, "venv")
     
-    # Security check
-    if not workspace_path.startswith(ALLOWED_ROOT):
-        return f"Error: Access to {workspace_path} is denied. Allowed root is {ALLOWED_ROOT}."
-    
     try:
         # Step 1: Create virtual environment
         print(f"Creating virtual environment at {venv_path}...")
         result = subprocess.run(
             [sys.executable, "-m", "venv", venv_path],
             capture_output=True,
-            text=True
+            text=True,
+            preexec_fn=child_preexec()
         )
         
         if result.returncode != 0:
@@ -169,7 +331,7 @@ def create_and_setup_venv(workspace_path: str, packages=None) -> str:
         # Step 3: Upgrade pip
         print("Upgrading pip...")
         subprocess.run([pip_path, "install", "--upgrade", "pip"], 
-                      capture_output=True, text=True)
+                      capture_output=True, text=True, preexec_fn=child_preexec())
         
         # Step 4: Parse and install packages
         if packages:
@@ -206,7 +368,8 @@ def create_and_setup_venv(workspace_path: str, packages=None) -> str:
                 result = subprocess.run(
                     [pip_path, "install"] + clean_packages,
                     capture_output=True,
-                    text=True
+                    text=True,
+                    preexec_fn=child_preexec()
                 )
                 
                 if result.returncode != 0:
@@ -227,16 +390,16 @@ def create_and_setup_venv(workspace_path: str, packages=None) -> str:
     except Exception as e:
         return f"Error: {str(e)}"
 
-def run_shell_command(command, cwd=None):
+def run_shell_command(command, cwd=None, root=None):
     """
     Run a shell command and return the output
     """
-    # Security: Only allow commands in the workspace
-    allowed_root = r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-    
-    # Set working directory to workspace if not specified
-    if not cwd:
-        cwd = allowed_root
+    # Security: Only allow commands in the workspace (the working directory
+    # defaults to it; relative cwds are taken relative to it)
+    workdir = inside_root(cwd or ".", root)
+    if not workdir:
+        return f"Error: Working directory {cwd} is outside the workspace {root or ALLOWED_ROOT}"
+    cwd = workdir
     
     # Basic security: prevent dangerous commands
     dangerous_commands = ['rm -rf', 'del /f', 'format', 'diskpart']
@@ -252,6 +415,7 @@ def run_shell_command(command, cwd=None):
             cwd=cwd,
             capture_output=True,
             text=True,
+            preexec_fn=child_preexec(),
             timeout=30
         )
         
@@ -270,22 +434,16 @@ def run_shell_command(command, cwd=None):
     except Exception as e:
         return f"Error executing command: {str(e)}"
 
-def list_directory(dir_path):
+def list_directory(dir_path, root=None):
     """
     List contents of a directory
     """
     import os
     
-    # Define allowed root
-    allowed_root = r"C:\Users\Administrator\Desktop\code\swstk\workspace"
-    
-    # Normalize paths
-    normalized_path = os.path.abspath(os.path.normpath(dir_path))
-    normalized_root = os.path.abspath(os.path.normpath(allowed_root))
-    
-    # Security check
-    if not normalized_path.lower().startswith(normalized_root.lower()):
-        return f"Error: Access to {dir_path} is denied. Allowed root is {allowed_root}"
+    # Normalize path + security check
+    normalized_path = inside_root(dir_path, root)
+    if not normalized_path:
+        return f"Error: Access to {dir_path} is denied. Allowed root is {root or ALLOWED_ROOT}"
     
     # Check if it's a directory
     if not os.path.isdir(normalized_path):
@@ -387,6 +545,49 @@ tools = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_files",
+            "description": "Read several files at once and return all their contents in one result. Use this instead of several read_file calls",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "file_paths": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Full paths of the files to read",
+                    }
+                },
+                "required": ["file_paths"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_files",
+            "description": "Write several files in one call, e.g. when creating a project. Either all files are written or none (missing directories are created). Use this instead of several write_file calls",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "file_path": {"type": "string", "description": "Full path of the file"},
+                                "content": {"type": "string", "description": "The content to write to the file"},
+                            },
+                            "required": ["file_path", "content"],
+                        },
+                        "description": "The files to write",
+                    }
+                },
+                "required": ["files"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -459,6 +660,69 @@ tools = [
                 'required': ["command"]  # ← List format (and fixed placement!)
             }
         }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'read_result',
+            'description': 'Read more of a large tool result that was truncated. Use the handle and offset given in the truncated result',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'handle': {
+                        'type': 'string',
+                        'description': 'The result handle from the truncation notice'
+                    },
+                    'offset': {
+                        'type': 'integer',
+                        'description': 'Character offset to continue reading from'
+                    }
+                },
+                'required': ["handle"]
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'search_workspace',
+            'description': 'Search every file in the workspace for a string (symbol, function name, text). Returns ranked matches with file paths, line numbers and surrounding lines. Use this instead of listing directories and reading files one by one',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'query': {
+                        'type': 'string',
+                        'description': 'Text to search for (case-insensitive, literal)'
+                    },
+                    'max_results': {
+                        'type': 'integer',
+                        'description': 'Maximum number of matches to return (default 20)'
+                    }
+                },
+                'required': ["query"]
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'recall',
+            'description': 'Search memory of earlier sessions (past conversations and tool results) for facts already worked out, such as project layout, commands that worked or errors seen before. Try this before exploring the workspace again',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'query': {
+                        'type': 'string',
+                        'description': 'Keywords describing what to remember'
+                    },
+                    'max_results': {
+                        'type': 'integer',
+                        'description': 'Maximum number of snippets to return (default 5)'
+                    }
+                },
+                'required': ["query"]
+            }
+        }
     }
 ]
 
@@ -467,10 +731,25 @@ available_functions         :   Dict[str, Callable] = {
     'get_temperature'       :   get_temperature,
     'read_file'             :   read_file,
     'write_file'            :   write_file,
+    'read_files'            :   read_files,
+    'write_files'           :   write_files,
     'delete_file'           :   delete_file,
     'create_and_setup_venv' :   create_and_setup_venv,
     'run_shell_command'     :   run_shell_command,
-    'list_directory'        :   list_directory
+    'list_directory'        :   list_directory,
+    'read_result'           :   read_result,
+    'search_workspace'      :   search_workspace,
+    'recall'                :   recall
 }
 
 
+
+# Tools that touch the filesystem (or, for recall, the workspace's past
+# sessions) take the agent's workspace as `root`; the agent fills it in
+# (the model never chooses it)
+ROOTED_TOOLS = {'read_file', 'write_file', 'read_files', 'write_files', 'delete_file',
+                'create_and_setup_venv', 'run_shell_command', 'list_directory', 'search_workspace', 'recall'}
+
+# Tools that need the agent's session_id, filled in the same way: recall leaves
+# the asking session out of its results
+SESSION_TOOLS = {'recall'}
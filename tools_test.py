@@ -1,7 +1,7 @@
 import ollama 
 import yfinance as yf
 from typing import Dict, Any, Callable, List
-from main import ALLOWED_ROOT
+from config import ALLOWED_ROOT
 import os
 
 def get_stock_price(symbol: str) -> float:
@@ -378,21 +378,22 @@ available_functions         :   Dict[str, Callable] = {
     'create_and_setup_venv' :   create_and_setup_venv,
 }
 
-response = ollama.chat(
-    'llama3.2',
-    messages=[{
-        'role':'user',
-        'content':prompt_7
-    }],
-    tools=tools,
-)
+if __name__ == "__main__":
+    response = ollama.chat(
+        'llama3.2',
+        messages=[{
+            'role':'user',
+            'content':prompt_7
+        }],
+        tools=tools,
+    )
 
 
-if response.message.tool_calls:
-    for tool in response.message.tool_calls:
-        if function_to_call := available_functions.get(tool.function.name):
-            print('Calling function:', tool.function.name)
-            print('Arguments:', tool.function.arguments)
-            print('Function Output:', function_to_call(**tool.function.arguments))
-        else:
-            print('Function', tool.function.name, 'not found')
\ No newline at end of file
+    if response.message.tool_calls:
+        for tool in response.message.tool_calls:
+            if function_to_call := available_functions.get(tool.function.name):
+                print('Calling function:', tool.function.name)
+                print('Arguments:', tool.function.arguments)
+                print('Function Output:', function_to_call(**tool.function.arguments))
+            else:
+                print('Function', tool.function.name, 'not found')
\ No newline at end of file
@@ -0,0 +1,188 @@
+# =====================================================
+#          RULE-BASED STEP VERIFIERS
+# =====================================================
+# Deterministic checks for plan steps whose outcome can be confirmed
+# without asking the model. Each verifier takes (step, result) and returns
+# {'verified': bool, 'explanation': str}, or None when the outcome is
+# unclear. verify() returns None for tools with no rule, and the caller then
+# falls back to the LLM.
+import hashlib
+import os
+import re
+from typing import Callable, Dict, Optional
+from results import default_store
+
+ERROR_PREFIXES = ("Error", "ERROR", "❌", "⚠️")
+# Tools that return file content: only their own error messages are errors,
+# a file may well start with "Error" or "⚠️"
+CONTENT_TOOL_ERRORS = {
+    'read_file'     :   re.compile(r"Error: Access denied|Error reading file: [^\n]*"),
+    'read_result'   :   re.compile(r"Error: No stored result with handle [^\n]*"),
+}
+
+
+def passed(explanation: str) -> Dict:
+    return {'verified': True, 'explanation': f"YES (rule check): {explanation}"}
+
+
+def failed(explanation: str) -> Dict:
+    return {'verified': False, 'explanation': f"NO (rule check): {explanation}"}
+
+
+def is_error(result: str, tool: Optional[str] = None) -> bool:
+    if tool in CONTENT_TOOL_ERRORS:
+        return bool(CONTENT_TOOL_ERRORS[tool].fullmatch(result))
+    return result.lstrip().startswith(ERROR_PREFIXES)
+
+
+def is_unchanged_reference(result: str) -> bool:
+    """Memoized read (tool_cache.py): the earlier identical call already succeeded"""
+    return result.startswith("[Unchanged since call")
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_write_file(step, result) -> Optional[Dict]:
+    args = step.get('arguments', {})
+    path, content = args.get('file_path'), args.get('content')
+    if is_error(result):
+        return failed(result[:200])
+    if not isinstance(path, str) or not isinstance(content, str):
+        return None
+    if not os.path.isfile(path):
+        return failed(f"{path} does not exist after writing")
+    # write_file writes UTF-8 without newline translation, so the file's bytes
+    # must be exactly the encoded content (hashed: no second copy of huge files)
+    try:
+        written = sha256_file(path)
+    except OSError as e:
+        return failed(f"Cannot read back {path}: {e}")
+    if written != sha256_text(content):
+        return failed(f"{path} content does not match what was written")
+    return passed(f"{path} exists with the expected content ({len(content)} chars)")
+
+
+def verify_write_files(step, result) -> Optional[Dict]:
+    files = step.get('arguments', {}).get('files')
+    if is_error(result):
+        return failed(result[:200])
+    if not isinstance(files, list):
+        return None
+    for entry in files:
+        outcome = verify_write_file({'arguments': entry if isinstance(entry, dict) else {}}, result)
+        if outcome is None or not outcome['verified']:
+            return outcome
+    return passed(f"all {len(files)} files exist with the expected content")
+
+
+def verify_read_files(step, result) -> Optional[Dict]:
+    if is_error(result):
+        return failed(result[:200])
+    if match := re.match(r"Read (\d+) of (\d+) files \((\d+) failed\)", result):
+        return failed(f"{match.group(3)} of {match.group(2)} files could not be read")
+    return passed(f"read {len(result)} chars")
+
+
+def verify_delete_file(step, result) -> Optional[Dict]:
+    path = step.get('arguments', {}).get('file_path')
+    if is_error(result):
+        return failed(result[:200])
+    if not isinstance(path, str):
+        return None
+    if os.path.exists(path):
+        return failed(f"{path} still exists")
+    return passed(f"{path} no longer exists")
+
+
+def verify_run_shell_command(step, result) -> Optional[Dict]:
+    # run_shell_command ends its output with the exit status when it is not 0
+    if match := re.search(r"Command exited with code: (-?\d+)\s*$", result):
+        return failed(f"command exited with code {match.group(1)}")
+    if is_error(result):
+        return failed(result[:200])
+    return passed("command exited with code 0")
+
+
+def verify_read_file(step, result) -> Optional[Dict]:
+    if is_unchanged_reference(result):
+        return passed("file unchanged since it was last read")
+    if is_error(result, 'read_file'):
+        return failed(result[:200])
+    return passed(f"read {len(result)} chars")
+
+
+def verify_list_directory(step, result) -> Optional[Dict]:
+    if is_unchanged_reference(result):
+        return passed("directory unchanged since it was last listed")
+    if result.startswith("Directory:"):
+        return passed("directory listed")
+    return failed(result[:200])
+
+
+def verify_create_and_setup_venv(step, result) -> Optional[Dict]:
+    if "error installing packages" in result or is_error(result):
+        return failed(result[:200])
+    if "Virtual environment created successfully" in result:
+        return passed("virtual environment created")
+    return None
+
+
+def verify_no_error(step, result) -> Optional[Dict]:
+    """For read-style tools whose only failure mode is an error message"""
+    if is_error(result, step.get('tool')):
+        return failed(result[:200])
+    return passed("tool returned a result")
+
+
+verifiers                   :   Dict[str, Callable] = {
+    'write_file'            :   verify_write_file,
+    'write_files'           :   verify_write_files,
+    'read_files'            :   verify_read_files,
+    'delete_file'           :   verify_delete_file,
+    'run_shell_command'     :   verify_run_shell_command,
+    'read_file'             :   verify_read_file,
+    'list_directory'        :   verify_list_directory,
+    'create_and_setup_venv' :   verify_create_and_setup_venv,
+    'read_result'           :   verify_no_error,
+    'search_workspace'      :   verify_no_error,
+    'recall'                :   verify_no_error,
+}
+
+
+def with_root(step, root: Optional[str]):
+    """Step whose relative file paths are resolved against the agent's workspace"""
+    args = step.get('arguments')
+    if not root or not isinstance(args, dict):
+        return step
+
+    def resolve(entry):
+        path = entry.get('file_path')
+        return dict(entry, file_path=os.path.join(root, path)) if isinstance(path, str) else entry
+
+    args = resolve(args)
+    if isinstance(args.get('files'), list):
+        args['files'] = [resolve(e) if isinstance(e, dict) else e for e in args['files']]
+    return dict(step, arguments=args)
+
+
+def verify(step, result, root: Optional[str] = None) -> Optional[Dict]:
+    """
+    Rule-based verification, or None if the LLM has to decide. Truncated
+    results are checked against the full stored output.
+    """
+    if verifier := verifiers.get(step.get('tool')):
+        try:
+            return verifier(with_root(step, root), default_store.expand(str(result)))
+        except Exception:
+            return None
+    return None